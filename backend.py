@@ -1,36 +1,30 @@
 import os
 import sys
-import importlib.util
 import subprocess
 from dotenv import load_dotenv
-from openai import OpenAI
 import json
+import hashlib
 import re
-import streamlit as st
-import pandas as pd
-import tempfile
+import time
+import random
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from nexarClient import NexarClient
-
-# 检查并安装必要的依赖库
-def check_and_install_dependencies():
-    """检查并安装处理Excel文件所需的依赖库"""
-    dependencies = {
-        'xlrd': 'xlrd>=2.0.1',      # 处理旧版 .xls 文件
-        'openpyxl': 'openpyxl',     # 处理新版 .xlsx 文件
-    }
-    
-    for module, package in dependencies.items():
-        if importlib.util.find_spec(module) is None:
-            try:
-                st.info(f"正在安装依赖: {package}...")
-                subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-                st.success(f"{package} 安装完成")
-            except Exception as e:
-                st.error(f"安装 {package} 失败: {e}")
-                st.info(f"请手动安装: pip install {package}")
-
-# 在导入pandas之前检查依赖
-check_and_install_dependencies()
+from cache_manager import part_cache, ResponseStore, normalize_part_number
+from request_coalescer import request_coalescer
+from bom_reader import read_bom
+from json_utils import IncrementalJsonArrayParser, extract_json, extract_json_array, normalize_recommendation
+from structured_output import (request_structured, json_mode_kwargs, structured_stats, validate, StructuredResponseError,
+                               RECOMMENDATIONS_SCHEMA, RECOMMENDATION_ITEM_SCHEMA, RISK_SCHEMA, RISK_BATCH_SCHEMA,
+                               COMPONENT_INFO_SCHEMA)
+from prompts import get_prompt, prompt_cache_stats
+from rate_limiter import deepseek_limiter, estimate_tokens, INTERACTIVE, BATCH
+from circuit_breaker import deepseek_breaker, nexar_breaker, CircuitOpenError, CLOSED
+from chat_context import ChatContext, CHAT_SUMMARY_MAX_TOKENS, format_transcript
+import events
 
 # 加载环境变量
 load_dotenv(override=True)
@@ -38,22 +32,148 @@ load_dotenv(override=True)
 # DeepSeek API 配置
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
-if not DEEPSEEK_API_KEY:
-    raise ValueError("错误：未找到 DEEPSEEK_API_KEY 环境变量。")
-deepseek_client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL)
+
+# 客户端在第一次使用时才创建（进程内共享），导入 backend 不访问网络，也不导入 openai
+_client_lock = threading.Lock()
+_deepseek_client = None
+_nexar_client = None
+
+def get_deepseek_client():
+    """返回进程共享的 DeepSeek(OpenAI) 客户端，第一次调用时创建"""
+    global _deepseek_client
+    if _deepseek_client is None:
+        with _client_lock:
+            if _deepseek_client is None:
+                if not DEEPSEEK_API_KEY:
+                    raise ValueError("错误：未找到 DEEPSEEK_API_KEY 环境变量。")
+                from openai import OpenAI, Timeout
+                # 429 不由 SDK 各自重试，而是由 deepseek_create 通过共享限流器统一退避；
+                # 读取超时针对单次响应（流式调用为相邻两个数据块之间的间隔）
+                _deepseek_client = OpenAI(
+                    api_key=DEEPSEEK_API_KEY,
+                    base_url=DEEPSEEK_BASE_URL,
+                    max_retries=0,
+                    timeout=Timeout(float(os.getenv("DEEPSEEK_READ_TIMEOUT", "60")),
+                                    connect=float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "5"))),
+                )
+    return _deepseek_client
+
+DEEPSEEK_MAX_RETRIES = int(os.getenv("DEEPSEEK_MAX_RETRIES", "3"))
+
+def _rate_limit_delay(error, attempt):
+    """429 后的退避时间：优先使用 Retry-After，否则指数退避加随机抖动"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(60.0, float(retry_after))
+        except ValueError:
+            pass
+    return min(30.0, 2 ** attempt) + random.uniform(0, 1)
+
+def _is_deepseek_failure(error):
+    """超时、连接错误、429（重试后仍失败）与5xx说明DeepSeek异常，计入熔断器"""
+    from openai import RateLimitError, APIConnectionError, APIStatusError
+    if isinstance(error, (APIConnectionError, RateLimitError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def deepseek_create(prompt_name, priority=INTERACTIVE, on_usage=None, **kwargs):
+    """所有DeepSeek调用的统一入口：熔断、限流、429退避，并按提示词模板记录前缀缓存命中的token数
+
+    deepseek_breaker 打开时直接抛出 CircuitOpenError，调用方改用缓存或 Nexar 数据。
+    请求先从进程级的 deepseek_limiter 取得 RPM/TPM 配额；priority 为 BATCH 的后台请求
+    在有交互请求排队时让行。流式调用会请求在最后一个数据块中返回 usage，
+    返回的迭代器只包含带内容的数据块。
+    需要 create 函数的地方（如 request_structured）传入 partial(deepseek_create, 模板名)。
+    on_usage 在拿到 response.usage 后被调用（流式调用为最后一个数据块之后）。
+    """
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    estimated = estimate_tokens(kwargs.get("messages"), kwargs.get("max_tokens"))
+    deepseek_breaker.before_call()
+    try:
+        response, charged = _create_with_retries(estimated, priority, kwargs)
+    except Exception as e:
+        if _is_deepseek_failure(e):
+            deepseek_breaker.record_failure()
+        else:
+            deepseek_breaker.record_success()
+        raise
+    deepseek_breaker.record_success()
+
+    if kwargs.get("stream"):
+        return _track_stream_usage(prompt_name, response, charged, on_usage)
+    usage = getattr(response, "usage", None)
+    prompt_cache_stats.record(prompt_name, usage)
+    if on_usage is not None and usage is not None:
+        on_usage(usage)
+    deepseek_limiter.settle(charged, getattr(usage, "total_tokens", None))
+    return response
+
+def _create_with_retries(estimated, priority, kwargs):
+    """返回 (response, 从TPM桶扣除的token数)"""
+    client = get_deepseek_client()
+    from openai import RateLimitError
+    for attempt in range(DEEPSEEK_MAX_RETRIES + 1):
+        charged = deepseek_limiter.acquire(estimated, priority)
+        try:
+            response = client.chat.completions.create(**kwargs)
+            break
+        except RateLimitError as e:
+            # 被拒绝的请求不消耗token，归还扣除的配额后所有请求一起暂停
+            deepseek_limiter.settle(charged, 0)
+            if attempt == DEEPSEEK_MAX_RETRIES:
+                raise
+            deepseek_limiter.pause(_rate_limit_delay(e, attempt))
+    return response, charged
+
+def _track_stream_usage(prompt_name, stream, charged, on_usage=None):
+    usage = None
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            # 只携带 usage 的最后一个数据块没有 choices
+            if chunk.choices:
+                yield chunk
+    except Exception as e:
+        # 连接建立时已记为成功，传输中途超时/断开再记一次失败
+        if _is_deepseek_failure(e):
+            deepseek_breaker.record_failure()
+        raise
+    finally:
+        prompt_cache_stats.record(prompt_name, usage)
+        deepseek_limiter.settle(charged, getattr(usage, "total_tokens", None))
+        if on_usage is not None and usage is not None:
+            on_usage(usage)
 
 # Nexar API 配置
 NEXAR_CLIENT_ID = os.getenv("NEXAR_CLIENT_ID")
 NEXAR_CLIENT_SECRET = os.getenv("NEXAR_CLIENT_SECRET")
-if not NEXAR_CLIENT_ID or not NEXAR_CLIENT_SECRET:
-    raise ValueError("错误：未找到 NEXAR_CLIENT_ID 或 NEXAR_CLIENT_SECRET 环境变量。")
-nexar_client = NexarClient(NEXAR_CLIENT_ID, NEXAR_CLIENT_SECRET)
-
 
-# GraphQL 查询
-QUERY_ALTERNATIVE_PARTS = '''
-query findAlternativeParts($q: String!, $limit: Int = 10) {
-  supSearchMpn(q: $q, limit: $limit) {
+def get_nexar_client():
+    """返回进程共享的 NexarClient，第一次调用时创建（访问令牌在第一次查询时才获取）"""
+    global _nexar_client
+    if _nexar_client is None:
+        with _client_lock:
+            if _nexar_client is None:
+                if not NEXAR_CLIENT_ID or not NEXAR_CLIENT_SECRET:
+                    raise ValueError("错误：未找到 NEXAR_CLIENT_ID 或 NEXAR_CLIENT_SECRET 环境变量。")
+                _nexar_client = NexarClient(
+                    NEXAR_CLIENT_ID,
+                    NEXAR_CLIENT_SECRET,
+                    pool_size=int(os.getenv("NEXAR_POOL_SIZE", "10")),
+                    connect_timeout=float(os.getenv("NEXAR_CONNECT_TIMEOUT", "5")),
+                    read_timeout=float(os.getenv("NEXAR_READ_TIMEOUT", "30")),
+                    max_retries=int(os.getenv("NEXAR_MAX_RETRIES", "3")),
+                    circuit_breaker=nexar_breaker,
+                )
+    return _nexar_client
+
+
+# GraphQL 查询（supSearchMpn 的返回字段单独定义，供单个查询与批量查询共用）
+NEXAR_PART_SEARCH_FIELDS = '''
     hits
     results {
       part {
@@ -90,25 +210,179 @@ query findAlternativeParts($q: String!, $limit: Int = 10) {
         }
       }
     }
-  }
-}
 '''
 
+QUERY_ALTERNATIVE_PARTS = '''
+query findAlternativeParts($q: String!, $limit: Int = 10) {
+  supSearchMpn(q: $q, limit: $limit) {%s  }
+}
+''' % NEXAR_PART_SEARCH_FIELDS
+
+# 同一型号的 Nexar 原始响应在短时间内共享，元器件详情与替代列表只查询一次
+NEXAR_SHARED_LIMIT = 10
+nexar_response_store = ResponseStore(ttl=int(os.getenv("NEXAR_RESPONSE_TTL_SECONDS", "600")))
+
+def fetch_nexar_part_data(mpn: str, limit: int = NEXAR_SHARED_LIMIT):
+    """获取型号的 Nexar 查询响应
+
+    始终以 NEXAR_SHARED_LIMIT 条结果查询并缓存原始响应，较小的 limit 直接在缓存结果上截取，
+    因此 identify_component（limit=1）与 get_nexar_alternatives（limit=10）只产生一次 GraphQL 请求。
+    """
+    if limit > NEXAR_SHARED_LIMIT:
+        return get_nexar_client().get_query(QUERY_ALTERNATIVE_PARTS, {"q": mpn, "limit": limit})
+
+    data = nexar_response_store.get(mpn)
+    if data is None:
+        def load():
+            response = get_nexar_client().get_query(QUERY_ALTERNATIVE_PARTS, {"q": mpn, "limit": NEXAR_SHARED_LIMIT})
+            if response:
+                nexar_response_store.set(mpn, response)
+            return response
+        data = request_coalescer.do("nexar", mpn, load)
+
+    # 按调用方的 limit 截取结果（不修改共享的原始响应）
+    sup_search = data.get("supSearchMpn") if isinstance(data, dict) else None
+    if isinstance(sup_search, dict) and isinstance(sup_search.get("results"), list) and limit < NEXAR_SHARED_LIMIT:
+        return {**data, "supSearchMpn": {**sup_search, "results": sup_search["results"][:limit]}}
+    return data
+
+# 批量查询时每个GraphQL请求包含的型号数量
+NEXAR_BATCH_SIZE = int(os.getenv("NEXAR_BATCH_SIZE", "25"))
+NEXAR_BATCH_MAX_WORKERS = int(os.getenv("NEXAR_BATCH_MAX_WORKERS", "4"))
+
+def build_batch_search_query(count: int):
+    """生成包含 count 个别名字段（p0、p1 ...）的 supSearchMpn 批量查询"""
+    variables = ", ".join(f"$q{i}: String!" for i in range(count))
+    fields = "".join(
+        f"  p{i}: supSearchMpn(q: $q{i}, limit: $limit) {{{NEXAR_PART_SEARCH_FIELDS}  }}\n"
+        for i in range(count)
+    )
+    return f"\nquery batchSearchMpn({variables}, $limit: Int = 10) {{\n{fields}}}\n"
+
+def _fetch_nexar_chunk(mpns):
+    """用一次GraphQL请求查询一组型号，返回 {型号: 与单个查询相同结构的响应}"""
+    variables = {f"q{i}": mpn for i, mpn in enumerate(mpns)}
+    variables["limit"] = NEXAR_SHARED_LIMIT
+    data = get_nexar_client().get_query(build_batch_search_query(len(mpns)), variables) or {}
+    return {mpn: {"supSearchMpn": data.get(f"p{i}")} for i, mpn in enumerate(mpns) if data.get(f"p{i}") is not None}
+
+def batch_fetch_nexar_part_data(component_list, chunk_size=None, max_workers=None):
+    """批量获取BOM中所有型号的 Nexar 数据
+
+    component_list 为 process_bom_file 返回的元器件列表（也可直接传入型号字符串列表）。
+    型号按规范化结果去重后，每 chunk_size 个合并成一个带别名的 supSearchMpn 查询，
+    各块并发发送；已在共享响应中的型号不再查询。结果写入共享响应，
+    之后的 identify_component / get_nexar_alternatives 可直接复用。
+
+    Returns:
+        {型号: Nexar响应}，查询失败或无结果的型号值为 None
+    """
+    chunk_size = max(1, int(chunk_size or NEXAR_BATCH_SIZE))
+    max_workers = max(1, int(max_workers or NEXAR_BATCH_MAX_WORKERS))
+
+    mpns = []
+    seen = set()
+    for component in component_list:
+        mpn = (component.get("mpn", "") if isinstance(component, dict) else str(component or "")).strip()
+        key = normalize_part_number(mpn)
+        if key and key not in seen:
+            seen.add(key)
+            mpns.append(mpn)
+
+    results = {}
+    pending = []
+    for mpn in mpns:
+        data = nexar_response_store.get(mpn)
+        if data is not None:
+            results[mpn] = data
+        else:
+            pending.append(mpn)
+
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    if chunks:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            future_to_chunk = {executor.submit(events.bind(_fetch_nexar_chunk), chunk): chunk for chunk in chunks}
+            for future in as_completed(future_to_chunk):
+                chunk = future_to_chunk[future]
+                try:
+                    chunk_data = future.result()
+                except Exception as e:
+                    events.warning(f"Nexar批量查询失败（{len(chunk)} 个型号）: {e}")
+                    chunk_data = {}
+                for mpn in chunk:
+                    data = chunk_data.get(mpn)
+                    if data is not None:
+                        nexar_response_store.set(mpn, data)
+                    results[mpn] = data
+
+    # 按BOM中的顺序返回
+    return {mpn: results.get(mpn) for mpn in mpns}
+
+# BOM批量处理时是否先按块批量查询 Nexar，把制造商、类别、封装与生命周期作为DeepSeek的参考数据
+NEXAR_BOM_ENRICHMENT = os.getenv("NEXAR_BOM_ENRICHMENT", "1") == "1"
+NEXAR_FACT_LABELS = {"manufacturer": "制造商", "category": "类别", "package": "封装", "lifecycle": "生命周期",
+                     "eol_date": "停产日期"}
+
+def nexar_part_facts(data):
+    """从 Nexar 响应的第一条结果中提取写入提示词的精简数据，无结果时返回 None"""
+    sup_search = data.get("supSearchMpn") if isinstance(data, dict) else None
+    results = sup_search.get("results") if isinstance(sup_search, dict) else None
+    part = results[0].get("part") if results and isinstance(results[0], dict) else None
+    if not isinstance(part, dict):
+        return None
+    facts = {"manufacturer": (part.get("manufacturer") or {}).get("name")}
+    for spec in part.get("specs") or []:
+        if not isinstance(spec, dict) or not isinstance(spec.get("attribute"), dict):
+            continue
+        name = str(spec["attribute"].get("name") or "").lower()
+        value = str(spec.get("value") or "").strip()
+        if name in ("category", "package"):
+            facts.setdefault(name, value)
+        elif "life" in name and "cycle" in name:
+            facts.setdefault("lifecycle", value)
+        elif "end of life date" in name or "eol date" in name or "discontinue date" in name:
+            facts.setdefault("eol_date", value)
+    facts = {key: value for key, value in facts.items() if value}
+    return facts or None
+
+def format_nexar_facts(facts):
+    """把精简数据格式化为一行提示词文本"""
+    return "，".join(f"{NEXAR_FACT_LABELS[key]}: {value}" for key, value in facts.items())
+
+def prefetch_nexar_facts(component_list):
+    """用批量查询（每 NEXAR_BATCH_SIZE 个型号一次请求）获取一组元器件的 Nexar 精简数据
+
+    Returns:
+        {规范化型号: 精简数据}；未配置 Nexar、关闭了 NEXAR_BOM_ENRICHMENT 或查询失败时缺少对应型号
+    """
+    if not NEXAR_BOM_ENRICHMENT or not component_list:
+        return {}
+    if _nexar_client is None and not (NEXAR_CLIENT_ID and NEXAR_CLIENT_SECRET):
+        return {}
+    try:
+        responses = batch_fetch_nexar_part_data(component_list)
+    except Exception as e:
+        events.warning(f"Nexar批量查询失败，跳过参考数据: {e}")
+        return {}
+    facts = {}
+    for mpn, data in responses.items():
+        part_facts = nexar_part_facts(data)
+        if part_facts:
+            facts[normalize_part_number(mpn)] = part_facts
+    return facts
+
 def get_nexar_alternatives(mpn: str, limit: int = 10):
-    variables = {"q": mpn, "limit": limit}
     try:
-        data = nexar_client.get_query(QUERY_ALTERNATIVE_PARTS, variables)
+        data = fetch_nexar_part_data(mpn, limit)
         alternative_parts = []
         
         # 添加数据有效性检查与调试信息
         if not data:
-            st.warning(f"Nexar API 未返回有效数据，可能是查询 '{mpn}' 无结果")
+            events.warning(f"Nexar API 未返回有效数据，可能是查询 '{mpn}' 无结果", target="main")
             return []
             
         # 显示调试信息
-        with st.sidebar.expander(f"Nexar API 调试信息 - {mpn}", expanded=False):
-            st.write(f"**原始Nexar API响应结构:**")
-            st.write(data)
+        events.debug(f"Nexar API 调试信息 - {mpn}", data, message="**原始Nexar API响应结构:**")
             
         # 完全重写数据提取逻辑，以更健壮的方式处理各种可能的结构
         if isinstance(data, dict):
@@ -186,8 +460,7 @@ def get_nexar_alternatives(mpn: str, limit: int = 10):
                             })
                 else:
                     # 如果results不是列表，尝试其他数据结构
-                    with st.sidebar.expander("调试信息 - API结构错误", expanded=False):
-                        st.warning(f"Nexar API 返回了非标准结构的数据 (results不是列表)")
+                    events.debug("调试信息 - API结构错误", message="Nexar API 返回了非标准结构的数据 (results不是列表)")
                     
                     # 尝试直接从顶层提取数据
                     parts_data = []
@@ -214,8 +487,7 @@ def get_nexar_alternatives(mpn: str, limit: int = 10):
                                 "octopartUrl": part_item.get("octopartUrl", "https://example.com")
                             })
             else:
-                with st.sidebar.expander("调试信息 - API结构错误", expanded=False):
-                    st.warning(f"Nexar API 返回了非标准结构 (supSearchMpn不是字典)")
+                events.debug("调试信息 - API结构错误", message="Nexar API 返回了非标准结构 (supSearchMpn不是字典)")
                 # 尝试从整个响应中找到任何可能的部件信息
                 for key, value in data.items():
                     if isinstance(value, dict) and "parts" in value:
@@ -237,15 +509,16 @@ def get_nexar_alternatives(mpn: str, limit: int = 10):
         # 如果无法找到任何替代件
         if not alternative_parts:
             # 只在侧边栏显示错误信息，而不在主界面显示
-            st.sidebar.info(f"Nexar API 未能为 '{mpn}' 找到替代元器件")
+            events.info(f"Nexar API 未能为 '{mpn}' 找到替代元器件")
             
         return alternative_parts
         
+    except CircuitOpenError as e:
+        events.info(f"{e}，仅使用 DeepSeek 推荐替代方案")
+        return []
     except Exception as e:
-        st.error(f"Nexar API 查询失败: {e}")
-        import traceback
-        with st.sidebar.expander("Nexar API错误详情", expanded=False):
-            st.code(traceback.format_exc())
+        events.error(f"Nexar API 查询失败: {e}", target="main")
+        events.debug("Nexar API错误详情", traceback.format_exc(), language="python")
         return []
 
 def is_domestic_brand(model_name, brand_name=""):
@@ -338,447 +611,403 @@ def is_domestic_brand(model_name, brand_name=""):
     return any(brand.lower() in model_lower or brand.lower() in brand_lower 
                for brand in domestic_brands.keys() | domestic_brands.values())
 
+def show_raw_response(content, call_type):
+    """在侧边栏调试区域显示DeepSeek原始响应"""
+    events.debug(f"调试信息 - 原始响应 ({call_type})", content,
+                 message=f"**尝试解析的原始响应内容 ({call_type}):**", language="text")
+
+def _request_recommendations_quiet(prompt_name, payload, call_type, max_tokens=1000, priority=INTERACTIVE):
+    """request_recommendations 的无界面版本（可在工作线程中调用），返回 (recommendations, raw_content, error)
+
+    recommendations 为 None 表示结构校验失败，此时 error 为错误说明；其他异常照常抛出。
+    """
+    try:
+        data, raw_content = request_structured(
+            partial(deepseek_create, prompt_name, priority=priority),
+            get_prompt(prompt_name).messages(payload),
+            RECOMMENDATIONS_SCHEMA,
+            call_type,
+            max_tokens=max_tokens
+        )
+    except StructuredResponseError as e:
+        return None, e.content or "", '; '.join(e.errors[:3])
+    return [normalize_recommendation(item) for item in data["recommendations"]], raw_content, None
+
+def request_recommendations(prompt_name, payload, call_type, max_tokens=1000, priority=INTERACTIVE):
+    """以 prompt_name 模板加上 payload 请求替代方案列表并按结构校验，返回补全字段后的推荐
+
+    结构不符合要求时先做一次定向修复；修复后仍不合格返回 None（合法的空结果返回 []）。
+    """
+    recommendations, raw_content, error = _request_recommendations_quiet(prompt_name, payload, call_type, max_tokens,
+                                                                         priority)
+    show_raw_response(raw_content, call_type)
+    if recommendations is None:
+        events.error(f"DeepSeek返回的替代方案不符合格式要求 ({call_type}): {error}")
+    return recommendations
+
+# 国产优先补充查询的对冲：初次调用超过对冲延迟仍未返回时，
+# 提前并行发出补充查询，初次结果满足要求则丢弃补充结果。
+# 对冲延迟默认取最近初次调用耗时的 DOMESTIC_HEDGE_PERCENTILE 分位数，只有最慢的一小部分查询会投机发出
+# （样本少于 DOMESTIC_HEDGE_MIN_SAMPLES 个时不投机发出）；设置 DOMESTIC_HEDGE_SECONDS 后固定使用该秒数，
+# 0 表示与初次调用同时发出，小于 0 表示关闭对冲（只在需要时才发出补充查询）。
+_hedge_seconds_env = os.getenv("DOMESTIC_HEDGE_SECONDS", "").strip()
+DOMESTIC_HEDGE_SECONDS = float(_hedge_seconds_env) if _hedge_seconds_env else None
+DOMESTIC_HEDGE_PERCENTILE = float(os.getenv("DOMESTIC_HEDGE_PERCENTILE", "0.95"))
+DOMESTIC_HEDGE_MIN_SAMPLES = int(os.getenv("DOMESTIC_HEDGE_MIN_SAMPLES", "20"))
+DOMESTIC_HEDGE_MAX_WORKERS = int(os.getenv("DOMESTIC_HEDGE_MAX_WORKERS", "4"))
+_hedge_executor = ThreadPoolExecutor(max_workers=DOMESTIC_HEDGE_MAX_WORKERS, thread_name_prefix="domestic-hedge")
+_hedge_stats_lock = threading.Lock()
+# won：投机发出且结果被使用；wasted：已发出但结果被丢弃（请求已在进行，仍会完成并计费）
+_hedge_stats = {"started": 0, "speculative": 0, "used": 0, "won": 0, "discarded": 0, "wasted": 0}
+_primary_latencies = deque(maxlen=200)  # 最近初次调用（"alternatives" 模板）的耗时，单位秒
+
+def _count_hedge(field):
+    with _hedge_stats_lock:
+        _hedge_stats[field] += 1
+
+def record_primary_latency(seconds):
+    """记录一次成功的初次调用耗时，用于计算对冲延迟"""
+    with _hedge_stats_lock:
+        _primary_latencies.append(seconds)
+
+def domestic_hedge_delay():
+    """当前的对冲延迟（秒），返回负数表示不投机发出"""
+    if DOMESTIC_HEDGE_SECONDS is not None:
+        return DOMESTIC_HEDGE_SECONDS
+    with _hedge_stats_lock:
+        samples = sorted(_primary_latencies)
+    if len(samples) < DOMESTIC_HEDGE_MIN_SAMPLES:
+        return -1
+    return samples[min(len(samples) - 1, int(len(samples) * DOMESTIC_HEDGE_PERCENTILE))]
+
+class DomesticHedge:
+    """一个型号的"国产优先"补充查询（alternatives_retry 模板）
+
+    可以在初次调用进行中由定时器投机发出（start_after），也可以在确认需要时才发出；
+    工作线程中不发出界面事件，原始响应与错误在 result() 中由调用方发出。
+    """
+
+    CALL_TYPE = "国产优先补充"
+
+    def __init__(self, part_number):
+        self.part_number = part_number
+        self._lock = threading.Lock()
+        self._future = None
+        self._timer = None
+        self._speculative = False
+
+    def start(self, count=3, speculative=False):
+        """发出补充查询（已发出时不重复发出）"""
+        with self._lock:
+            if self._future is not None:
+                return
+            payload = retry_payload(self.part_number, count)
+            self._future = _hedge_executor.submit(
+                _request_recommendations_quiet, "alternatives_retry", payload, self.CALL_TYPE)
+            self._speculative = speculative
+        _count_hedge("started")
+        if speculative:
+            _count_hedge("speculative")
+
+    def start_after(self, delay):
+        """delay 秒后投机发出补充查询；delay 小于 0 时不做任何事"""
+        if delay < 0 or not deepseek_breaker.allows_request():
+            return
+        if delay == 0:
+            self.start(speculative=True)
+            return
+        self._timer = threading.Timer(delay, self.start, kwargs={"speculative": True})
+        self._timer.daemon = True
+        self._timer.start()
+
+    def cancel_timer(self):
+        """初次调用已返回：尚未发出的投机查询不再发出"""
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def result(self, count):
+        """等待补充查询的结果（尚未发出则现在发出），失败返回 None"""
+        self.cancel_timer()
+        self.start(count)
+        _count_hedge("used")
+        if self._speculative:
+            _count_hedge("won")
+        try:
+            recommendations, raw_content, error = self._future.result()
+        except Exception as e:
+            events.warning(f"⚠️ 补充查询失败：{e}")
+            return None
+        show_raw_response(raw_content, self.CALL_TYPE)
+        if recommendations is None:
+            events.error(f"DeepSeek返回的替代方案不符合格式要求 ({self.CALL_TYPE}): {error}")
+            return None
+        return [rec for rec in recommendations if _is_valid_recommendation(rec, self.part_number)]
+
+    def discard(self):
+        """初次结果已满足要求：取消未发出的查询，已发出的结果直接丢弃
+
+        已经开始执行的请求无法取消，会照常完成并计费，计入 wasted。
+        """
+        self.cancel_timer()
+        with self._lock:
+            future = self._future
+        if future is not None:
+            _count_hedge("discarded")
+            if not future.cancel():
+                _count_hedge("wasted")
+
+def retry_payload(part_number, count):
+    """"alternatives_retry" 模板的输入信息"""
+    return f"输入元器件型号：{part_number}\n需要推荐的数量：{max(1, count)}"
+
+def get_hedge_stats():
+    """国产优先补充查询的对冲统计（发出、投机发出、被使用、投机命中、被丢弃、浪费的次数）与当前对冲延迟"""
+    delay = domestic_hedge_delay()
+    with _hedge_stats_lock:
+        return dict(_hedge_stats, delay_seconds=round(delay, 3) if delay >= 0 else None,
+                    latency_samples=len(_primary_latencies))
+
 def extract_json_content(content, call_type="初次调用"):
+    """从DeepSeek返回的内容中提取替代方案列表，并补全缺少的字段
+
+    由 json_utils.extract_json_array 单遍扫描定位最外层的JSON数组/对象，
+    同时修复代码块标记、尾随逗号、单引号等常见问题。
+    """
     # 检查输入是否为字符串类型
     if not isinstance(content, str):
-        st.error(f"{call_type} - 输入内容不是字符串: {type(content)}")
+        events.error(f"{call_type} - 输入内容不是字符串: {type(content)}", target="main")
         return []
         
     # 记录原始内容以便调试
-    with st.sidebar.expander(f"调试信息 - 原始响应 ({call_type})", expanded=False):
-        st.write(f"**尝试解析的原始响应内容 ({call_type}):**")
-        st.code(content, language="text")
+    show_raw_response(content, call_type)
 
     # 处理空响应
     if not content or content.strip() == "":
-        st.warning(f"{call_type} 返回了空响应")
+        events.warning(f"{call_type} 返回了空响应", target="main")
         return []
 
-    # 直接尝试解析 JSON
-    try:
-        parsed = json.loads(content)
-        # 检查是否为列表
-        if not isinstance(parsed, list):
-            raise ValueError("响应不是 JSON 数组")
-        # 补全缺少的字段
-        for item in parsed:
-            # 确保item是字典类型
-            if not isinstance(item, dict):
-                continue
-                
-            # 确保基本字段存在
-            item["model"] = item.get("model", "未知型号")
-            item["brand"] = item.get("brand", "未知品牌")
-            item["parameters"] = item.get("parameters", "参数未知")
-            item["type"] = item.get("type", "未知")
-            item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-            
-            # 确保新增字段存在
-            item["category"] = item.get("category", "未知类别")
-            item["package"] = item.get("package", "未知封装")
-            
-            # 添加价格信息（如果没有）并确保价格包含货币符号
-            price = item.get("price", "未知")
-            # 检查价格是否已包含货币符号
-            if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                # 如果是纯数字或数字范围，添加美元符号
-                if re.match(r'^[\d\.\-\s]+$', price):
-                    # 处理类似 "1.8-2.5" 的价格范围
-                    if "-" in price:
-                        price_parts = price.split("-")
-                        price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                    else:
-                        price = f"${price.strip()}"
-            item["price"] = price
-            
-            # 添加物料状态信息
-            item["status"] = item.get("status", "未知")
-            item["leadTime"] = item.get("leadTime", "未知")
-            
-            # 添加 pin-to-pin 替代相关信息
-            item["pinToPin"] = item.get("pinToPin", False)
-            item["compatibility"] = item.get("compatibility", "兼容性未知")
-            
-        return parsed
-    except json.JSONDecodeError:
-        pass
-
-    # 尝试提取代码块中的 JSON
-    code_block_pattern = r"```(?:json)?\s*\n?([\s\S]*?)\n?```"
-    code_match = re.search(code_block_pattern, content, re.DOTALL)
-    if (code_match):
-        json_content = code_match.group(1).strip()
-        try:
-            parsed = json.loads(json_content)
-            for item in parsed:
-                # 确保item是字典类型
-                if not isinstance(item, dict):
-                    continue
-                    
-                # 确保基本字段存在
-                item["model"] = item.get("model", "未知型号")
-                item["brand"] = item.get("brand", "未知品牌")
-                item["parameters"] = item.get("parameters", "参数未知")
-                item["type"] = item.get("type", "未知")
-                item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-                
-                # 确保新增字段存在
-                item["category"] = item.get("category", "未知类别")
-                item["package"] = item.get("package", "未知封装")
-                
-                # 添加价格信息（如果没有）并确保价格包含货币符号
-                price = item.get("price", "未知")
-                # 检查价格是否已包含货币符号
-                if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                    # 如果是纯数字或数字范围，添加美元符号
-                    if re.match(r'^[\d\.\-\s]+$', price):
-                        # 处理类似 "1.8-2.5" 的价格范围
-                        if "-" in price:
-                            price_parts = price.split("-")
-                            price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                        else:
-                            price = f"${price.strip()}"
-                item["price"] = price
-                
-                # 添加物料状态信息
-                item["status"] = item.get("status", "未知")
-                item["leadTime"] = item.get("leadTime", "未知")
-                
-                # 添加 pin-to-pin 替代相关信息
-                item["pinToPin"] = item.get("pinToPin", False)
-                item["compatibility"] = item.get("compatibility", "兼容性未知")
-                
-            return parsed
-        except json.JSONDecodeError:
-            pass
+    parsed = extract_json_array(content)
+    if parsed is not None:
+        return [normalize_recommendation(item) if isinstance(item, dict) else item for item in parsed]
 
-    # 尝试提取裸 JSON 数组
-    json_match = re.search(r'\[\s*\{.*\}\s*\]', content, re.DOTALL)
-    if json_match:
-        try:
-            parsed = json.loads(json_match.group(0))
-            for item in parsed:
-                # 确保item是字典类型
-                if not isinstance(item, dict):
-                    continue
-                    
-                if not all(key in item for key in ["model", "parameters", "type", "datasheet"]):
-                    item["model"] = item.get("model", "未知型号")
-                    item["parameters"] = item.get("parameters", "参数未知")
-                    item["type"] = item.get("type", "未知")
-                    item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-                # 确保品牌字段存在
-                if "brand" not in item:
-                    item["brand"] = item.get("brand", "未知品牌")
-                # 确保新增字段存在
-                item["category"] = item.get("category", "未知类别")
-                item["package"] = item.get("package", "未知封装")
-                
-                # 添加价格信息（如果没有）并确保价格包含货币符号
-                price = item.get("price", "未知")
-                # 检查价格是否已包含货币符号
-                if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                    # 如果是纯数字或数字范围，添加美元符号
-                    if re.match(r'^[\d\.\-\s]+$', price):
-                        # 处理类似 "1.8-2.5" 的价格范围
-                        if "-" in price:
-                            price_parts = price.split("-")
-                            price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                        else:
-                            price = f"${price.strip()}"
-                item["price"] = price
-                
-                # 添加物料状态信息
-                item["status"] = item.get("status", "未知")
-                item["leadTime"] = item.get("leadTime", "未知")
-                
-                # 添加 pin-to-pin 替代相关信息
-                item["pinToPin"] = item.get("pinToPin", False)
-                item["compatibility"] = item.get("compatibility", "兼容性未知")
-                
-            return parsed
-        except json.JSONDecodeError:
-            pass
+    # 处理可能的非标准JSON格式
+    # 如果内容看起来包含元器件信息但不是有效JSON，构造一个基本响应
+    if "型号" in content and ("国产" in content or "进口" in content):
+        events.warning(f"DeepSeek API返回了非标准JSON格式，尝试构建基本替代方案 ({call_type})")
+        # 构造一个基本的替代方案
+        basic_alt = [{
+            "model": "未能解析出型号",
+            "brand": "未知品牌",
+            "category": "未知类别",
+            "package": "未知封装",
+            "parameters": "无法解析参数，请查看API原始响应",
+            "type": "未知",
+            "price": "未知",
+            "status": "未知",
+            "leadTime": "未知",
+            "pinToPin": False,
+            "compatibility": "未知",
+            "datasheet": "https://www.example.com"
+        }]
+        return basic_alt
 
-    # 尝试逐行解析，处理可能的多行 JSON
-    lines = content.strip().split('\n')
-    json_content = ''
-    in_json = False
-    for line in lines:
-        line = line.strip()
-        if line.startswith('[') or in_json:
-            json_content += line
-            in_json = True
-        if line.endswith(']'):
-            break
-    if json_content:
-        try:
-            parsed = json.loads(json_content)
-            for item in parsed:
-                # 确保item是字典类型
-                if not isinstance(item, dict):
-                    continue
-                    
-                if not all(key in item for key in ["model", "parameters", "type", "datasheet"]):
-                    item["model"] = item.get("model", "未知型号")
-                    item["parameters"] = item.get("parameters", "参数未知")
-                    item["type"] = item.get("type", "未知")
-                    item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-                # 确保品牌字段存在
-                if "brand" not in item:
-                    item["brand"] = item.get("brand", "未知品牌")
-                # 确保新增字段存在
-                item["category"] = item.get("category", "未知类别")
-                item["package"] = item.get("package", "未知封装")
-                
-                # 添加价格信息（如果没有）并确保价格包含货币符号
-                price = item.get("price", "未知")
-                # 检查价格是否已包含货币符号
-                if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                    # 如果是纯数字或数字范围，添加美元符号
-                    if re.match(r'^[\d\.\-\s]+$', price):
-                        # 处理类似 "1.8-2.5" 的价格范围
-                        if "-" in price:
-                            price_parts = price.split("-")
-                            price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                        else:
-                            price = f"${price.strip()}"
-                item["price"] = price
-                
-                # 添加物料状态信息
-                item["status"] = item.get("status", "未知")
-                item["leadTime"] = item.get("leadTime", "未知")
-                
-                # 添加 pin-to-pin 替代相关信息
-                item["pinToPin"] = item.get("pinToPin", False)
-                item["compatibility"] = item.get("compatibility", "兼容性未知")
-                
-            return parsed
-        except json.JSONDecodeError:
-            pass
+    events.error(f"无法从API响应中提取有效的JSON内容 ({call_type})")
+    return []
 
-    # 添加更强大的JSON提取处理，处理更多边缘情况
-    # 尝试从文本中抽取任何看起来像JSON对象的内容
-    possible_json_pattern = r'\[\s*\{\s*"model"\s*:.*?\}\s*\]'
-    json_fragments = re.findall(possible_json_pattern, content, re.DOTALL)
-    
-    for fragment in json_fragments:
-        try:
-            parsed = json.loads(fragment)
-            # 补全缺少的字段
-            for item in parsed:
-                # 确保item是字典类型
-                if not isinstance(item, dict):
-                    continue
-                    
-                if not all(key in item for key in ["model", "parameters", "type", "datasheet"]):
-                    item["model"] = item.get("model", "未知型号")
-                    item["parameters"] = item.get("parameters", "参数未知")
-                    item["type"] = item.get("type", "未知")
-                    item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-                # 确保品牌字段存在
-                if "brand" not in item:
-                    item["brand"] = item.get("brand", "未知品牌")
-                # 确保新增字段存在
-                item["category"] = item.get("category", "未知类别")
-                item["package"] = item.get("package", "未知封装")
-                
-                # 添加价格信息（如果没有）并确保价格包含货币符号
-                price = item.get("price", "未知")
-                # 检查价格是否已包含货币符号
-                if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                    # 如果是纯数字或数字范围，添加美元符号
-                    if re.match(r'^[\d\.\-\s]+$', price):
-                        # 处理类似 "1.8-2.5" 的价格范围
-                        if "-" in price:
-                            price_parts = price.split("-")
-                            price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                        else:
-                            price = f"${price.strip()}"
-                item["price"] = price
-                
-                # 添加物料状态信息
-                item["status"] = item.get("status", "未知")
-                item["leadTime"] = item.get("leadTime", "未知")
-                
-                # 添加 pin-to-pin 替代相关信息
-                item["pinToPin"] = item.get("pinToPin", False)
-                item["compatibility"] = item.get("compatibility", "兼容性未知")
-                
-            return parsed
-        except json.JSONDecodeError:
-            pass
-            
-    # 如果上面方法都失败，尝试手动修复常见的JSON格式错误
-    for fix_attempt in [
-        lambda c: c.replace("'", '"'),  # 单引号替换为双引号
-        lambda c: re.sub(r'",\s*\}', '"}', c),  # 修复尾部多余逗号
-        lambda c: re.sub(r',\s*]', ']', c)  # 修复数组尾部多余逗号
-    ]:
-        try:
-            fixed_content = fix_attempt(content)
-            parsed = json.loads(fixed_content)
-            if isinstance(parsed, list):
-                for item in parsed:
-                    # 确保item是字典类型
-                    if not isinstance(item, dict):
-                        continue
-                        
-                    if not all(key in item for key in ["model", "parameters", "type", "datasheet"]):
-                        item["model"] = item.get("model", "未知型号")
-                        item["parameters"] = item.get("parameters", "参数未知")
-                        item["type"] = item.get("type", "未知")
-                        item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
-                    # 确保品牌字段存在
-                    if "brand" not in item:
-                        item["brand"] = item.get("brand", "未知品牌")
-                    # 确保新增字段存在
-                    item["category"] = item.get("category", "未知类别")
-                    item["package"] = item.get("package", "未知封装")
-                    
-                    # 添加价格信息（如果没有）并确保价格包含货币符号
-                    price = item.get("price", "未知")
-                    # 检查价格是否已包含货币符号
-                    if price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
-                        # 如果是纯数字或数字范围，添加美元符号
-                        if re.match(r'^[\d\.\-\s]+$', price):
-                            # 处理类似 "1.8-2.5" 的价格范围
-                            if "-" in price:
-                                price_parts = price.split("-")
-                                price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
-                            else:
-                                price = f"${price.strip()}"
-                    item["price"] = price
-                    
-                    # 添加物料状态信息
-                    item["status"] = item.get("status", "未知")
-                    item["leadTime"] = item.get("leadTime", "未知")
-                    
-                    # 添加 pin-to-pin 替代相关信息
-                    item["pinToPin"] = item.get("pinToPin", False)
-                    item["compatibility"] = item.get("compatibility", "兼容性未知")
-                    
-                return parsed
-        except:
-            pass
+def _upstreams_healthy():
+    """Nexar 与 DeepSeek 的熔断器都处于关闭状态（降级期间的结果不写入缓存）"""
+    return deepseek_breaker.state == CLOSED and nexar_breaker.state == CLOSED
 
-    # 处理可能的非标准JSON格式
-    try:
-        # 最后尝试一种更宽松的解析方法，直接从文本构建数据
-        # 如果内容看起来包含元器件信息但不是有效JSON，构造一个基本响应
-        if "型号" in content and ("国产" in content or "进口" in content):
-            st.sidebar.warning(f"DeepSeek API返回了非标准JSON格式，尝试构建基本替代方案 ({call_type})")
-            # 构造一个基本的替代方案
-            basic_alt = [{
-                "model": "未能解析出型号",
-                "brand": "未知品牌",
-                "category": "未知类别",
-                "package": "未知封装",
-                "parameters": "无法解析参数，请查看API原始响应",
-                "type": "未知",
-                "price": "未知",
-                "status": "未知",
-                "leadTime": "未知",
-                "pinToPin": False,
-                "compatibility": "未知",
-                "datasheet": "https://www.example.com"
-            }]
-            return basic_alt
-    except:
-        pass
+def _stale_alternatives(part_number):
+    """DeepSeek 熔断时返回已过期的缓存结果，没有则返回 None"""
+    if deepseek_breaker.allows_request():
+        return None
+    stale = part_cache.get("alternatives", part_number, allow_stale=True)
+    if stale:
+        events.info(f"DeepSeek 暂不可用（熔断中），显示 '{part_number}' 的历史缓存结果")
+    return stale or None
 
-    st.sidebar.error(f"无法从API响应中提取有效的JSON内容 ({call_type})")
-    return []
+def get_alternative_parts(part_number, nexar_alternatives=None):
+    """查询元器件替代方案（优先读取持久化缓存，未命中时调用 Nexar + DeepSeek）
 
-def get_alternative_parts(part_number):
+    DeepSeek 熔断时优先返回过期的缓存结果，没有缓存则只根据 Nexar 数据给出替代方案。
+    已经查询过 Nexar 替代数据时通过 nexar_alternatives 传入，不再重复查询。
+    """
+    cached = part_cache.get("alternatives", part_number)
+    if cached is not None:
+        return cached
+    stale = _stale_alternatives(part_number)
+    if stale is not None:
+        return stale
+
+    def load():
+        recommendations = _fetch_alternative_parts(part_number, nexar_alternatives)
+        # 仅缓存上游正常时的非空结果，避免把临时故障或降级结果固化到缓存中
+        if recommendations and _upstreams_healthy():
+            part_cache.set("alternatives", part_number, recommendations)
+        return recommendations
+
+    # 多个会话同时查询同一型号时只请求一次上游
+    return request_coalescer.do("alternatives", part_number, load)
+
+def _prepare_alternatives_prompt(part_number, nexar_alternatives=None):
+    """查询 Nexar 替代数据并构造 "alternatives" 模板的输入信息，返回 (nexar_alternatives, payload)"""
     # Step 1: 获取 Nexar API 的替代元器件数据
-    nexar_alternatives = get_nexar_alternatives(part_number, limit=10)
+    if nexar_alternatives is None:
+        nexar_alternatives = get_nexar_alternatives(part_number, limit=10)
     context = "Nexar API 提供的替代元器件数据：\n"
     if (nexar_alternatives):
         for i, alt in enumerate(nexar_alternatives, 1):
             context += f"{i}. 型号: {alt['mpn']}, 名称: {alt['name']}, 链接: {alt['octopartUrl']}\n"
     else:
         # 将警告移到侧边栏
-        st.sidebar.warning(f"Nexar API 未能为 '{part_number}' 找到替代元件")
+        events.warning(f"Nexar API 未能为 '{part_number}' 找到替代元件")
         context = "无 Nexar API 数据可用，请直接推荐替代元器件。\n"
 
-    # Step 2: 构造 DeepSeek API 的提示词
-    prompt = f"""
-    任务：你是一个专业的电子元器件顾问，专精于国产替代方案。以下是 Nexar API 提供的替代元器件数据，请结合这些数据为输入元器件推荐替代产品。推荐的替代方案必须与输入型号 {part_number} 不同（绝对不能推荐 {part_number} 或其变体，如 {part_number} 的不同封装）。
-
-    输入元器件型号：{part_number}
-
-    {context}
-
-    要求：
-    1. 必须推荐至少一种中国大陆本土品牌的替代方案（如 GigaDevice/兆易创新、WCH/沁恒、复旦微电子、中颖电子、圣邦微电子等）
-    2. 如果能找到多种中国大陆本土品牌的替代产品，优先推荐这些产品，推荐的国产方案数量越多越好
-    3. 如果实在找不到足够三种中国大陆本土品牌的产品，可以推荐国外品牌产品作为补充，但必须明确标注
-    4. 总共需要推荐 3 种性能相近的替代型号
-    5. 提供每种型号的品牌名称、封装信息和元器件类目（例如：MCU、DCDC、LDO、传感器、存储芯片等）
-    6. 根据元器件类型提供不同的关键参数：
-       - 若是MCU/单片机：提供CPU内核、主频、程序存储容量、RAM大小、IO数量
-       - 若是DCDC：提供输入电压范围、输出电压、最大输出电流、效率
-       - 若是LDO：提供输入电压范围、输出电压、最大输出电流、压差
-       - 若是存储器：提供容量、接口类型、读写速度
-       - 若是传感器：提供测量范围、精度、接口类型
-       - 其他类型提供对应的关键参数
-    7. 产地判断必须严格遵循：
-        a. 优先根据品牌判断（如TI/ST/ADI为进口；兆易创新/圣邦微为国产）
-        b. 若品牌未知，可根据型号前缀辅助判断（如GDxxx为兆易创新国产；STxxx为意法半导体进口）
-        c. 不确定的情况必须标记为"进口"，禁止猜测
-    8. 提供产品大致价格范围，**必须明确标示货币单位**：
-       - 对于人民币价格，使用格式：¥X-¥Y（例如：¥10-¥15）
-       - 对于美元价格，使用格式：$X-$Y（例如：$1.5-$2.0）
-       - 请根据产品实际销售地区和行情确定合适的货币单位
-    9. 详细评估物料生命周期状态：
-       a. 提供上市时间（例如：2015年上市）
-       b. 明确当前生命周期阶段（例如："量产中"、"新产品"、"即将停产"、"已停产"、"不推荐用于新设计"等）
-       c. 预估剩余生命周期（例如：预计2030年前持续供货）
-       d. 标明是否有长期供货计划或EOL（生命周期终止）通知
-    10. 重要：准确判断每个替代方案是否与原始元器件为"pin-to-pin替代"，必须满足以下所有条件才能标记为pin兼容:
-        a. 如果是标准封装，封装与原元器件相同就满足条件a。或者非标准封装，物理尺寸公差在1mm以内，引脚排列和间距一致，可以在相同PCB焊盘位置安装
-        b. 所有引脚的功能和编号与原元器件完全匹配
-        c. 电气特性（电压/电流/时序等）与原元器件在合理范围内兼容
-        d. 无需对PCB进行任何修改（包括布线、跳线等）就能替换使用
-        e. 如果以上任何一点不符合，或者无法确定，则标记为"非Pin兼容"
-    11. 提供产品官网链接（若无真实链接，可提供示例链接，如 https://www.example.com/datasheet）
-    12. 推荐的型号不能与输入型号 {part_number} 相同
-    13. 必须严格返回以下 JSON 格式的结果，不允许添加任何额外说明、Markdown 格式或代码块标记（即不要使用 ```json 或其他标记），直接返回裸 JSON：
-    [
-        {{"model": "SG1117-1.2", "brand": "SG Micro/圣邦微电子", "category": "LDO", "package": "DPAK", "parameters": "输入电压: 2.0-12V, 输出电压: 1.2V, 输出电流: 800mA, 压差: 1.1V", "type": "国产", "status": "量产中", "price": "¥2.5-¥3.5", "leadTime": "4-6周", "pinToPin": true, "compatibility": "完全兼容，可直接替换原型号", "datasheet": "https://www.sgmicro.com/datasheet", "releaseDate": "2015年", "lifecycle": "量产中，预计2030年前持续供货"}},
-        {{"model": "GD32F103C8T6", "brand": "GigaDevice/兆易创新", "category": "MCU", "package": "LQFP48", "parameters": "CPU内核: ARM Cortex-M3, 主频: 72MHz, Flash: 64KB, RAM: 20KB, IO: 37", "type": "国产", "status": "量产中", "price": "¥12-¥15", "leadTime": "3-5周", "pinToPin": true, "compatibility": "引脚完全兼容，软件需少量修改", "datasheet": "https://www.gigadevice.com/datasheet", "releaseDate": "2013年", "lifecycle": "量产中，长期供货计划（10年+）"}},
-        {{"model": "MP2307DN", "brand": "MPS/芯源系统", "category": "DCDC", "package": "SOIC-8", "parameters": "输入电压: 4.75-23V, 输出电压: 0.925-20V, 输出电流: 3A, 效率: 95%", "type": "进口", "status": "即将停产", "price": "$0.8-$1.2", "leadTime": "6-8周", "pinToPin": false, "compatibility": "需要重新设计PCB布局", "datasheet": "https://www.monolithicpower.com/datasheet", "releaseDate": "2010年", "lifecycle": "将于2025年停产，建议寻找替代方案"}}
-    ]
-    """
+    # Step 2: 提示词的静态部分在 prompts 模板中，这里只构造变量部分
+    payload = f"输入元器件型号：{part_number}\n\n{context}"
+
+    return nexar_alternatives, payload
+
+def _fetch_alternative_parts(part_number, nexar_alternatives=None):
+    nexar_alternatives, payload = _prepare_alternatives_prompt(part_number, nexar_alternatives)
 
+    # 初次调用较慢时提前并行发出国产优先的补充查询，而不是等初次结果返回后再依次重试
+    hedge = DomesticHedge(part_number)
+    hedge.start_after(domestic_hedge_delay())
     try:
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一个精通中国电子元器件行业的专家，擅长为各种元器件寻找合适的替代方案，尤其专注于中国大陆本土生产的国产元器件。始终以有效的JSON格式回复，不添加任何额外说明。"},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False,
-            max_tokens=1000
-        )
-        raw_content = response.choices[0].message.content
-        recommendations = extract_json_content(raw_content, "初次调用")
+        try:
+            start = time.perf_counter()
+            recommendations = request_recommendations("alternatives", payload, "初次调用") or []
+            record_primary_latency(time.perf_counter() - start)
+        except Exception as e:
+            if not (isinstance(e, CircuitOpenError) or _is_deepseek_failure(e)):
+                raise
+            # DeepSeek 不可用：只根据 Nexar 数据给出替代方案（Step 6 的重新调用也会跳过）
+            events.warning(f"DeepSeek 暂不可用（{e}），仅根据 Nexar 数据给出替代方案")
+            recommendations = []
+        finally:
+            hedge.cancel_timer()
+        return _complete_recommendations(part_number, recommendations, nexar_alternatives, hedge)
+    except Exception as e:
+        hedge.discard()
+        events.error(f"DeepSeek API 调用失败：{e}")
+        return []
 
-        # Step 3: 过滤掉与输入型号相同的推荐
-        filtered_recommendations = []
-        for rec in recommendations:
-            if isinstance(rec, dict) and rec.get("model", "").lower() != part_number.lower():
-                filtered_recommendations.append(rec)
-        recommendations = filtered_recommendations
+def _is_valid_recommendation(rec, part_number):
+    """推荐项必须是字典，且型号与输入型号不同"""
+    return isinstance(rec, dict) and rec.get("model", "").lower() != part_number.lower()
+
+def _merge_recommendations(primary, extra, part_number, limit=3, fixed=0):
+    """合并初次推荐与补充推荐：按型号去重并保留 primary 的顺序
 
-        # Step 4: 如果推荐数量不足，从 Nexar 数据中补充
-        if len(recommendations) < 3 and nexar_alternatives:
+    primary 不足 limit 个时用 extra 补足（国产方案优先）；primary 中没有国产方案时，
+    用 extra 中的第一个国产方案替换 primary 中最后一个进口方案（前 fixed 个已展示的推荐不替换）。
+    """
+    merged = list(primary)
+    seen = {rec.get("model", "").lower() for rec in merged if isinstance(rec, dict)}
+    seen.add(part_number.lower())
+    candidates = []
+    for rec in extra:
+        model = rec.get("model", "").lower() if isinstance(rec, dict) else ""
+        if model and model not in seen:
+            seen.add(model)
+            candidates.append(rec)
+    candidates.sort(key=lambda rec: rec.get("type") != "国产")
+
+    while len(merged) < limit and candidates:
+        merged.append(candidates.pop(0))
+    has_domestic = any(isinstance(rec, dict) and rec.get("type") == "国产" for rec in merged)
+    if not has_domestic and candidates and candidates[0].get("type") == "国产":
+        for i in range(len(merged) - 1, fixed - 1, -1):
+            if isinstance(merged[i], dict) and merged[i].get("type") != "国产":
+                merged[i] = candidates.pop(0)
+                break
+    return merged
+
+def _complete_recommendations(part_number, recommendations, nexar_alternatives, domestic_hedge=None, fixed=0):
+    """对初次推荐结果做过滤、补充与国产识别（Step 3 - Step 7），返回最多3个推荐
+
+    domestic_hedge 为已经（或计划）投机发出的"国产优先"补充查询，初次结果已满足要求时丢弃；
+    fixed 为已经流式展示给用户的推荐个数，补充国产方案时不替换这些推荐。
+    """
+    # Step 3: 过滤掉与输入型号相同的推荐
+    filtered_recommendations = []
+    for rec in recommendations:
+        if isinstance(rec, dict) and rec.get("model", "").lower() != part_number.lower():
+            filtered_recommendations.append(rec)
+    recommendations = filtered_recommendations
+
+    # Step 4: 如果推荐数量不足，从 Nexar 数据中补充
+    if len(recommendations) < 3 and nexar_alternatives:
+        for alt in nexar_alternatives:
+            if len(recommendations) >= 3:
+                break
+            if alt["mpn"].lower() != part_number.lower():
+                recommendations.append({
+                    "model": alt["mpn"],
+                    "brand": alt.get("name", "未知品牌").split(' ')[0] if alt.get("name") else "未知品牌",
+                    "category": "未知类别",
+                    "package": "未知封装",
+                    "parameters": "参数未知",
+                    "type": "未知",
+                    "datasheet": alt["octopartUrl"]
+                })
+
+    # Step 5: 后处理，识别国产方案
+    # 在Step 5和Step 7的后处理中，传入品牌信息
+    for rec in recommendations:
+        if isinstance(rec, dict):
+            # 优先使用brand字段判断，而非仅依赖model
+            brand = rec.get("brand", "").strip()
+            model = rec.get("model", "").strip()
+            # 关键修改：传入brand参数
+            if rec.get("type") == "未知":
+                rec["type"] = "国产" if is_domestic_brand(model, brand) else "进口"
+
+    # Step 6: 如果仍然不足 3 个，或缺少国产方案，重新调用 DeepSeek 强调国产优先
+    need_second_query = len(recommendations) < 3 or not any(isinstance(rec, dict) and rec.get("type") == "国产" for rec in recommendations)
+    # DeepSeek 熔断时不再重新调用，直接使用已有结果
+    need_second_query = need_second_query and deepseek_breaker.allows_request()
+
+    if not need_second_query and domestic_hedge is not None:
+        domestic_hedge.discard()
+
+    if need_second_query:
+        events.warning("⚠️ 推荐结果不足或未包含国产方案，将补充国产优先的推荐。")
+
+        # 投机请求已经发出时直接等待其结果，否则现在发出（只请求一次，不再依次重试）
+        hedge = domestic_hedge or DomesticHedge(part_number)
+        with events.status("正在补充国产优先的推荐..."):
+            additional_recommendations = hedge.result(3 - len(recommendations))
+
+        second_query_success = additional_recommendations is not None
+        if second_query_success:
+            for rec in additional_recommendations:
+                if rec.get("type") == "未知" and is_domestic_brand(rec.get("model", ""), rec.get("brand", "")):
+                    rec["type"] = "国产"
+            found_domestic = any(rec.get("type") == "国产" for rec in additional_recommendations)
+
+            # 记录二次查询结果
+            if found_domestic:
+                events.success(f"✅ 补充查询成功！找到了 {len(additional_recommendations)} 个替代方案，其中包含国产方案。")
+            else:
+                events.info(f"ℹ️ 补充查询返回了 {len(additional_recommendations)} 个替代方案，但未找到国产方案。")
+
+            recommendations = _merge_recommendations(recommendations, additional_recommendations, part_number, fixed=fixed)
+        else:
+            events.error("❌ 补充查询未能返回有效推荐，将使用默认替代方案。")
+
+        # 如果二次查询失败且结果仍然不足，从 Nexar 数据中补充
+        if not second_query_success or len(recommendations) < 3:
             for alt in nexar_alternatives:
                 if len(recommendations) >= 3:
                     break
-                if alt["mpn"].lower() != part_number.lower():
-                    recommendations.append({
+                # 检查是否已经包含此型号
+                if alt["mpn"].lower() != part_number.lower() and not any(
+                        isinstance(rec, dict) and rec.get("model", "").lower() == alt["mpn"].lower() 
+                        for rec in recommendations):
+                    new_rec = {
                         "model": alt["mpn"],
                         "brand": alt.get("name", "未知品牌").split(' ')[0] if alt.get("name") else "未知品牌",
                         "category": "未知类别",
@@ -786,534 +1015,552 @@ def get_alternative_parts(part_number):
                         "parameters": "参数未知",
                         "type": "未知",
                         "datasheet": alt["octopartUrl"]
-                    })
-
-        # Step 5: 后处理，识别国产方案
-        # 在Step 5和Step 7的后处理中，传入品牌信息
-        for rec in recommendations:
-            if isinstance(rec, dict):
-                # 优先使用brand字段判断，而非仅依赖model
-                brand = rec.get("brand", "").strip()
-                model = rec.get("model", "").strip()
-                # 关键修改：传入brand参数
-                if rec.get("type") == "未知":
-                    rec["type"] = "国产" if is_domestic_brand(model, brand) else "进口"
+                    }
+                    # 识别国产方案
+                    if is_domestic_brand(new_rec["model"]):
+                        new_rec["type"] = "国产"
+                    recommendations.append(new_rec)
 
-        # Step 6: 如果仍然不足 3 个，或缺少国产方案，重新调用 DeepSeek 强调国产优先
-        need_second_query = len(recommendations) < 3 or not any(isinstance(rec, dict) and rec.get("type") == "国产" for rec in recommendations)
-        
+        # 在二次查询完成后再做一次最终统计
         if need_second_query:
-            st.sidebar.warning("⚠️ 推荐结果不足或未包含国产方案，将重新调用 DeepSeek 推荐。")
-            
-            prompt_retry = f"""
-            任务：为以下元器件推荐替代产品，推荐的替代方案必须与输入型号 {part_number} 不同（绝对不能推荐 {part_number} 或其变体，如 {part_number} 的不同封装）。
-            输入元器件型号：{part_number}
-
-            之前的推荐结果未包含国产方案或数量不足，请重新推荐，重点关注国产替代方案。
-
-            要求：
-            1. 必须推荐至少一种中国大陆本土品牌的替代方案（如 GigaDevice/兆易创新、WCH/沁恒、复旦微电子、中颖电子、圣邦微电子、3PEAK、Chipsea 等）
-            2. 优先推荐国产芯片，推荐的国产方案数量越多越好
-            3. 如果找不到足够的国产方案，可以补充进口方案，但必须明确标注
-            4. 总共推荐 {3 - len(recommendations)} 种替代方案
-            5. 提供每种型号的品牌名称、封装信息和元器件类目（例如：MCU、DCDC、LDO、传感器等）
-            6. 根据元器件类型提供不同的关键参数：
-               - 若是MCU/单片机：提供CPU内核、主频、程序存储容量、RAM大小、IO数量
-               - 若是DCDC：提供输入电压范围、输出电压、最大输出电流、效率
-               - 若是LDO：提供输入电压范围、输出电压、最大输出电流、压差
-               - 若是存储器：提供容量、接口类型、读写速度
-               - 若是传感器：提供测量范围、精度、接口类型
-               - 其他类型提供对应的关键参数
-            7. 在每个推荐方案中明确标注是"国产"还是"进口"产品
-                a. 优先根据品牌判断（如TI/ST/ADI为进口；兆易创新/圣邦微为国产）
-                b. 若品牌未知，可根据型号前缀辅助判断（如GDxxx为兆易创新国产；STxxx为意法半导体进口）
-                c. 不确定的情况必须标记为"进口"，禁止猜测
-            8. 提供产品官网链接（若无真实链接，可提供示例链接，如 https://www.example.com/datasheet）
-            9. 推荐的型号不能与输入型号 {part_number} 相同
-            10.重要：准确判断每个替代方案是否与原始元器件为"pin-to-pin替代"，必须满足以下所有条件才能标记为pin兼容:
-                    a. 如果是标准封装，封装与原元器件相同就满足条件a。或者非标准封装，物理尺寸公差在1mm以内，引脚排列和间距一致，可以在相同PCB焊盘位置安装
-                    b. 所有引脚的功能和编号与原元器件完全匹配
-                    c. 电气特性（电压/电流/时序等）与原元器件在合理范围内兼容
-                    d. 无需对PCB进行任何修改（包括布线、跳线等）就能替换使用
-                    e. 如果以上任何一点不符合，或者无法确定，则标记为"非Pin兼容"
-            11. 必须严格返回以下 JSON 格式的结果，不允许添加任何额外说明、Markdown 格式或代码块标记，直接返回裸 JSON：
-            [
-                {{"model": "型号1", "brand": "品牌1", "category": "类别1", "package": "封装1", "parameters": "参数1", "type": "国产/进口", "datasheet": "链接1"}},
-                {{"model": "型号2", "brand": "品牌2", "category": "类别2", "package": "封装2", "parameters": "参数2", "type": "国产/进口", "datasheet": "链接2"}}
-            ]
-            11. 每个推荐项必须包含 "model"、"brand"、"category"、"package"、"parameters"、"type" 和 "datasheet" 七个字段
-            12. 如果无法找到合适的替代方案，返回空的 JSON 数组：[]
-            """
-            
-            second_query_success = False
-            max_retries = 3
-            additional_recommendations = []
-            
-            for attempt in range(max_retries):
-                try:
-                    response_retry = deepseek_client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=[
-                            {"role": "system", "content": "你是一个精通中国电子元器件行业的专家，擅长为各种元器件寻找合适的替代方案，尤其专注于中国大陆本土生产的国产元器件。始终以有效的JSON格式回复，不添加任何额外说明。"},
-                            {"role": "user", "content": prompt_retry}
-                        ],
-                        stream=False,
-                        max_tokens=1000
-                    )
-                    raw_content_retry = response_retry.choices[0].message.content
-                    
-                    with st.spinner(f"正在解析第 {attempt + 1} 次二次查询结果..."):
-                        additional_recommendations = extract_json_content(raw_content_retry, f"重新调用，第 {attempt + 1} 次")
-                    
-                    if additional_recommendations:
-                        second_query_success = True
-                        # 过滤掉与原型号相同的推荐
-                        filtered_additional_recommendations = []
-                        for rec in additional_recommendations:
-                            if isinstance(rec, dict) and rec.get("model", "").lower() != part_number.lower():
-                                filtered_additional_recommendations.append(rec)
-                        additional_recommendations = filtered_additional_recommendations
-                        
-                        # 快速检查是否找到了国产方案
-                        found_domestic = False
-                        for rec in additional_recommendations:
-                            if not isinstance(rec, dict):
-                                continue
-                            if rec.get("type") == "未知" and is_domestic_brand(rec.get("model", "")):
-                                rec["type"] = "国产"
-                            if rec.get("type") == "国产":
-                                found_domestic = True
-                        
-                        # 记录二次查询结果
-                        if found_domestic:
-                            st.sidebar.success(f"✅ 二次查询成功！找到了 {len(additional_recommendations)} 个替代方案，其中包含国产方案。")
-                        else:
-                            st.sidebar.info(f"ℹ️ 二次查询返回了 {len(additional_recommendations)} 个替代方案，但未找到国产方案。")
-                        
-                        # 添加到推荐列表
-                        for rec in additional_recommendations:
-                            if len(recommendations) >= 3:
-                                break
-                            recommendations.append(rec)
-                        break
-                    else:
-                        st.sidebar.warning(f"⚠️ 重新调用 DeepSeek API 第 {attempt + 1} 次未返回有效推荐。")
-                        if attempt == max_retries - 1:
-                            st.sidebar.error("❌ 重新调用 DeepSeek API 未能返回有效推荐，将使用默认替代方案。")
-                except Exception as e:
-                    st.sidebar.warning(f"⚠️ 重新调用 DeepSeek API 第 {attempt + 1} 次失败：{e}")
-                    if attempt == max_retries - 1:
-                        st.sidebar.error("❌ 重新调用 DeepSeek API 失败，将使用默认替代方案。")
-            
-            # 如果二次查询失败且结果仍然不足，从 Nexar 数据中补充
-            if not second_query_success or len(recommendations) < 3:
-                for alt in nexar_alternatives:
-                    if len(recommendations) >= 3:
-                        break
-                    # 检查是否已经包含此型号
-                    if alt["mpn"].lower() != part_number.lower() and not any(
-                            isinstance(rec, dict) and rec.get("model", "").lower() == alt["mpn"].lower() 
-                            for rec in recommendations):
-                        new_rec = {
-                            "model": alt["mpn"],
-                            "brand": alt.get("name", "未知品牌").split(' ')[0] if alt.get("name") else "未知品牌",
-                            "category": "未知类别",
-                            "package": "未知封装",
-                            "parameters": "参数未知",
-                            "type": "未知",
-                            "datasheet": alt["octopartUrl"]
-                        }
-                        # 识别国产方案
-                        if is_domestic_brand(new_rec["model"]):
-                            new_rec["type"] = "国产"
-                        recommendations.append(new_rec)
-            
-            # 在二次查询完成后再做一次最终统计
-            if need_second_query:
-                domestic_count = sum(1 for rec in recommendations if isinstance(rec, dict) and rec.get("type") == "国产")
-                import_count = sum(1 for rec in recommendations if isinstance(rec, dict) and (rec.get("type") == "进口" or rec.get("type") == "未知"))
-                st.sidebar.info(f"🔍 查找完成，共找到 {len(recommendations)} 个替代方案，其中国产方案 {domestic_count} 个，进口/未知方案 {import_count} 个。")
-
-        # Step 7: 再次后处理，识别国产方案
-        # 在Step 5和Step 7的后处理中，传入品牌信息
-        for rec in recommendations:
-            if isinstance(rec, dict):
-                # 优先使用brand字段判断，而非仅依赖model
-                brand = rec.get("brand", "").strip()
-                model = rec.get("model", "").strip()
-                # 关键修改：传入brand参数
-                if rec.get("type") == "未知":
-                    rec["type"] = "国产" if is_domestic_brand(model, brand) else "进口"
-
-        # 确保recommendations是可切片类型并安全执行切片
-        try:
-            # 确保输出结果是列表类型
-            if not isinstance(recommendations, list):
-                st.sidebar.warning(f"推荐结果不是列表类型: {type(recommendations)}")
-                if recommendations:
-                    if isinstance(recommendations, dict):
-                        recommendations = [recommendations]
-                    else:
-                        try:
-                            recommendations = list(recommendations)
-                        except:
-                            st.sidebar.error("无法将推荐结果转换为列表")
-                            return []
-                else:
-                    return []
-                    
-            # 安全地执行切片
-            return recommendations[:3] if recommendations else []
-        except Exception as slice_error:
-            st.sidebar.error(f"切片操作失败: {slice_error}")
-            # 处理非常规情况，确保返回一个列表
+            domestic_count = sum(1 for rec in recommendations if isinstance(rec, dict) and rec.get("type") == "国产")
+            import_count = sum(1 for rec in recommendations if isinstance(rec, dict) and (rec.get("type") == "进口" or rec.get("type") == "未知"))
+            events.info(f"🔍 查找完成，共找到 {len(recommendations)} 个替代方案，其中国产方案 {domestic_count} 个，进口/未知方案 {import_count} 个。")
+
+    # Step 7: 再次后处理，识别国产方案
+    # 在Step 5和Step 7的后处理中，传入品牌信息
+    for rec in recommendations:
+        if isinstance(rec, dict):
+            # 优先使用brand字段判断，而非仅依赖model
+            brand = rec.get("brand", "").strip()
+            model = rec.get("model", "").strip()
+            # 关键修改：传入brand参数
+            if rec.get("type") == "未知":
+                rec["type"] = "国产" if is_domestic_brand(model, brand) else "进口"
+
+    # 用 Nexar 的实际价格、货期与生命周期补充推荐中缺失的字段
+    _add_nexar_details(recommendations, nexar_alternatives)
+
+    # 确保recommendations是可切片类型并安全执行切片
+    try:
+        # 确保输出结果是列表类型
+        if not isinstance(recommendations, list):
+            events.warning(f"推荐结果不是列表类型: {type(recommendations)}")
             if recommendations:
-                if isinstance(recommendations, (list, tuple)):
-                    return list(recommendations)[:3] if len(recommendations) >= 3 else list(recommendations)
+                if isinstance(recommendations, dict):
+                    recommendations = [recommendations]
                 else:
-                    return [recommendations]
+                    try:
+                        recommendations = list(recommendations)
+                    except:
+                        events.error("无法将推荐结果转换为列表")
+                        return []
             else:
                 return []
+
+        # 安全地执行切片
+        return recommendations[:3] if recommendations else []
+    except Exception as slice_error:
+        events.error(f"切片操作失败: {slice_error}")
+        # 处理非常规情况，确保返回一个列表
+        if recommendations:
+            if isinstance(recommendations, (list, tuple)):
+                return list(recommendations)[:3] if len(recommendations) >= 3 else list(recommendations)
+            else:
+                return [recommendations]
+        else:
+            return []
+
+def _add_nexar_details(recommendations, nexar_alternatives):
+    """推荐型号出现在 Nexar 替代数据中时，用 Nexar 的价格、货期、状态补充未知的字段"""
+    by_mpn = {alt["mpn"].lower(): alt for alt in nexar_alternatives or [] if alt.get("mpn")}
+    for rec in recommendations if isinstance(recommendations, list) else []:
+        alt = by_mpn.get(rec.get("model", "").lower()) if isinstance(rec, dict) else None
+        if alt is None:
+            continue
+        for field in ("price", "leadTime", "status"):
+            if rec.get(field) in (None, "", "未知") and alt.get(field) not in (None, "", "未知"):
+                rec[field] = alt[field]
+
+def nexar_recommendations(part_number, nexar_alternatives, limit=3):
+    """把 Nexar 的 similarParts 直接转换为推荐卡片（不经过 DeepSeek），国产方案排在前面
+
+    pinToPin 为 None 表示尚未分析，由后台的 DeepSeek 推荐给出。
+    """
+    cards = []
+    seen = {part_number.lower()}
+    for alt in nexar_alternatives or []:
+        mpn = alt.get("mpn", "")
+        if not mpn or mpn.lower() in seen:
+            continue
+        seen.add(mpn.lower())
+        brand = alt.get("manufacturer") or (alt.get("name", "").split(' ')[0] if alt.get("name") else "未知品牌")
+        cards.append({
+            "model": mpn,
+            "brand": brand,
+            "category": "未知类别",
+            "package": "未知封装",
+            "parameters": alt.get("name") or "参数未知",
+            "type": "国产" if is_domestic_brand(mpn, brand) else "进口",
+            "price": alt.get("price", "未知"),
+            "status": alt.get("status", "未知"),
+            "leadTime": alt.get("leadTime", "未知"),
+            "pinToPin": None,
+            "datasheet": alt.get("octopartUrl", ""),
+            "source": "nexar",
+        })
+    cards.sort(key=lambda rec: rec["type"] != "国产")
+    return cards[:limit]
+
+# 渐进式查询中后台运行 DeepSeek 推荐的线程数
+ENRICHMENT_MAX_WORKERS = int(os.getenv("ENRICHMENT_MAX_WORKERS", "4"))
+_enrichment_executor = ThreadPoolExecutor(max_workers=ENRICHMENT_MAX_WORKERS, thread_name_prefix="alternatives-enrichment")
+
+def start_progressive_alternatives(part_number):
+    """渐进式查询：一次 Nexar 往返后即返回 Nexar 替代件，DeepSeek 国产推荐与 pin-to-pin 分析在后台进行
+
+    Returns:
+        (fast_recommendations, enrichment)：enrichment 为 Future，结果为 (recommendations, recorded_events)，
+        recommendations 与 get_alternative_parts 相同（已用 Nexar 数据补充价格与货期）；
+        后台任务的提示与调试事件记录在 recorded_events 中，由调用方合并结果时用 events.replay() 显示，
+        而不是发给提交时的 sink（后台任务完成时提交它的那次页面运行可能已经结束）。
+        命中缓存或 DeepSeek 熔断时 fast_recommendations 即为最终结果，enrichment 为 None。
+    """
+    cached = part_cache.get("alternatives", part_number)
+    if cached is None:
+        cached = _stale_alternatives(part_number)
+    if cached is not None:
+        return cached, None
+
+    nexar_alternatives = get_nexar_alternatives(part_number, limit=10)
+    fast_recommendations = nexar_recommendations(part_number, nexar_alternatives)
+    if not deepseek_breaker.allows_request():
+        events.warning("DeepSeek 暂不可用（熔断中），仅根据 Nexar 数据给出替代方案")
+        return fast_recommendations, None
+    enrichment = _enrichment_executor.submit(_recorded_alternative_parts, part_number, nexar_alternatives)
+    return fast_recommendations, enrichment
+
+def _recorded_alternative_parts(part_number, nexar_alternatives):
+    """在后台线程中执行 get_alternative_parts，返回 (推荐列表, 期间发出的事件)"""
+    sink = events.CollectingSink(kinds=events.MESSAGE_KINDS + ("debug",))
+    with events.use_sink(sink):
+        recommendations = get_alternative_parts(part_number, nexar_alternatives)
+    return recommendations, list(sink.events)
+
+def stream_alternative_parts(part_number):
+    """流式查询元器件替代方案，每解析出一个推荐就立即返回
+
+    DeepSeek 以 stream=True 返回，IncrementalJsonArrayParser 在数组元素完整时即给出对象，
+    前端可以边生成边渲染卡片。初次结果不足3个或缺少国产方案时，
+    与 get_alternative_parts 相同地补充，补充的推荐在最后依次返回。
+    与 get_alternative_parts 共用请求合并的键：同一型号正在查询时等待其结果，不再重复请求上游。
+    """
+    cached = part_cache.get("alternatives", part_number)
+    if cached is None:
+        cached = _stale_alternatives(part_number)
+    if cached is not None:
+        yield from cached
+        return
+
+    yield from request_coalescer.stream("alternatives", part_number, _stream_alternative_parts, part_number)
+
+def _stream_alternative_parts(part_number):
+    nexar_alternatives, payload = _prepare_alternatives_prompt(part_number)
+
+    hedge = DomesticHedge(part_number)
+    hedge.start_after(domestic_hedge_delay())
+    streamed = []
+    try:
+        start = time.perf_counter()
+        response = deepseek_create(
+            "alternatives",
+            model="deepseek-chat",
+            messages=get_prompt("alternatives").messages(payload),
+            stream=True,
+            max_tokens=1000,
+            **json_mode_kwargs()
+        )
+        structured_stats.count("流式调用", "completions")
+        parser = IncrementalJsonArrayParser()
+        for chunk in response:
+            for rec in parser.feed(chunk.choices[0].delta.content):
+                # 逐个元素按结构校验，不合格的元素直接跳过（由后续补充步骤补足）
+                if len(streamed) >= 3 or validate(rec, RECOMMENDATION_ITEM_SCHEMA) or not _is_valid_recommendation(rec, part_number):
+                    continue
+                normalize_recommendation(rec)
+                if rec.get("type") == "未知":
+                    rec["type"] = "国产" if is_domestic_brand(rec.get("model", "").strip(), rec.get("brand", "").strip()) else "进口"
+                streamed.append(rec)
+                # 已经得到3个且包含国产方案，不再需要投机的补充查询
+                if len(streamed) >= 3 and any(r.get("type") == "国产" for r in streamed):
+                    hedge.cancel_timer()
+                yield rec
+
+        record_primary_latency(time.perf_counter() - start)
+        # 流中没有解析出完整的数组元素时，按非流式的方式解析全文
+        recommendations = list(streamed) if streamed else extract_json_content(parser.text, "流式调用")
+        if recommendations:
+            structured_stats.count("流式调用", "succeeded")
+        hedge.cancel_timer()
+        recommendations = _complete_recommendations(part_number, recommendations, nexar_alternatives,
+                                                     hedge, fixed=len(streamed))
     except Exception as e:
-        st.sidebar.error(f"DeepSeek API 调用失败：{e}")
-        return []
+        hedge.cancel_timer()
+        if not (isinstance(e, CircuitOpenError) or _is_deepseek_failure(e)):
+            hedge.discard()
+            events.error(f"DeepSeek API 调用失败：{e}")
+            return
+        events.warning(f"DeepSeek 暂不可用（{e}），仅根据 Nexar 数据给出替代方案")
+        recommendations = _complete_recommendations(part_number, list(streamed), nexar_alternatives,
+                                                     hedge, fixed=len(streamed))
+
+    for rec in recommendations[len(streamed):]:
+        yield rec
+    if recommendations and _upstreams_healthy():
+        part_cache.set("alternatives", part_number, recommendations)
+
+def load_bom_file(uploaded_file):
+    """流式读取上传的BOM文件，返回 BomData（预览行 + 去重后的元器件列表），失败时返回 None
+
+    直接读取上传文件的缓冲区，不再复制到临时文件；预览与批量处理共用同一次读取结果。
+    """
+    try:
+        return read_bom(uploaded_file, uploaded_file.name)
+    except Exception as e:
+        events.error(f"处理BOM文件时出错: {e}", target="main")
+        if "xlrd" in str(e):
+            events.info("正在尝试安装xlrd依赖...", target="main")
+            try:
+                subprocess.check_call([sys.executable, "-m", "pip", "install", "xlrd>=2.0.1"])
+                events.success("xlrd安装成功，请重新上传文件", target="main")
+            except Exception as install_error:
+                events.error(f"自动安装xlrd失败: {install_error}", target="main")
+                events.info("请手动运行: pip install xlrd>=2.0.1", target="main")
+        if "openpyxl" in str(e):
+            events.info("正在尝试安装openpyxl依赖...", target="main")
+            try:
+                subprocess.check_call([sys.executable, "-m", "pip", "install", "openpyxl"])
+                events.success("openpyxl安装成功，请重新上传文件", target="main")
+            except Exception as install_error:
+                events.error(f"自动安装openpyxl失败: {install_error}", target="main")
+                events.info("请手动运行: pip install openpyxl", target="main")
+        return None
 
 def process_bom_file(uploaded_file):
     """处理上传的BOM文件并返回元器件列表"""
-    # 再次检查依赖，确保已安装
-    check_and_install_dependencies()
-    
-    # 创建临时文件
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_filepath = tmp_file.name
+    bom_data = load_bom_file(uploaded_file)
+    if bom_data is None:
+        return [], {}
+    # 返回元器件列表和识别的列名
+    return bom_data.components, bom_data.columns_info
+
+# 批量风险评估的最大并发请求数（需结合 DeepSeek API 配额调整，可通过环境变量覆盖）
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+# 调试用：DeepSeek 未返回有效替代方案时以测试数据补足（测试数据不写入缓存）
+USE_DUMMY_DATA = os.getenv("USE_DUMMY_DATA", "0") == "1"
+
+# 风险等级定义（新划分标准）
+RISK_LEVELS = {
+    "HIGH": "红色",    # 已停产或2年以内停产（高风险）
+    "LOW": "黄色",     # 2-4年停产（低风险）
+    "SAFE": "绿色",    # 4年以上停产（无风险）
+    "UNKNOWN": "未知"  # 未检测出停产时间（灰色）
+}
+
+# 风险等级对应的描述
+RISK_DESC_MAP = {
+    "红色": "高风险（已停产或1年以内停产）",
+    "黄色": "低风险（1-5年停产）",
+    "绿色": "无风险（5年以上停产）",
+    "未知": "未知风险（未检测出停产信息）"
+}
+
+def assess_risk_with_deepseek(mpn, name, description, debug_mode=False, nexar_facts=None):
+    """调用DeepSeek评估元器件停产风险，按新标准划分等级
+
+    该函数会在线程池中并发执行，因此内部不调用任何 Streamlit 接口，
+    调试信息和错误信息通过返回值交给调用方在主线程中展示。
+    多个批量任务同时以相同输入评估同一型号时只请求一次DeepSeek。
+    nexar_facts 为 prefetch_nexar_facts 得到的参考数据（可选）。
+    """
+    # 名称、描述和 Nexar 参考数据都会写入提示词，debug_mode 决定返回值中是否带调试信息，
+    # 因此一并计入合并键：只有输入完全相同的调用才共享结果
+    inputs = json.dumps([name, description, bool(debug_mode), nexar_facts], sort_keys=True, ensure_ascii=False,
+                        default=str)
+    key = f"{mpn}|{hashlib.md5(inputs.encode('utf-8')).hexdigest()}"
+    return request_coalescer.do("risk", key, _assess_risk_with_deepseek, mpn, name, description, debug_mode,
+                                nexar_facts)
+
+# 批量评估时每个提示词包含的元器件数量（设为1则逐个评估）
+RISK_BATCH_SIZE = int(os.getenv("RISK_BATCH_SIZE", "20"))
+
+def _build_risk_info(risk_data, response_text=None, parse_error=None, debug_mode=False):
+    """根据DeepSeek返回的 status/eol_year/description 计算风险等级"""
+    from datetime import date
     
-    try:
-        # 根据文件扩展名读取文件
-        file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_ext == '.csv':
-            df = pd.read_csv(tmp_filepath)
-        elif file_ext == '.xls':
-            # 专门处理旧版Excel文件
-            try:
-                df = pd.read_excel(tmp_filepath, engine='xlrd')
-            except Exception as e:
-                st.error(f"无法使用xlrd读取.xls文件: {e}")
-                st.warning("尝试使用openpyxl引擎...")
-                df = pd.read_excel(tmp_filepath, engine='openpyxl')
-        elif file_ext == '.xlsx':
-            # 处理新版Excel文件
-            df = pd.read_excel(tmp_filepath, engine='openpyxl')
-        else:
-            raise ValueError(f"不支持的文件格式: {file_ext}")
-        
-        # 尝试识别关键列：型号列、名称列、描述列
-        # 可能的列名
-        mpn_columns = []  # 型号列
-        name_columns = []  # 名称列
-        desc_columns = []  # 描述列
-        
-        mpn_keywords = ['mpn', 'part', 'part_number', 'part number', 'partnumber', '型号', '规格型号', '器件型号']
-        name_keywords = ['name', 'component', 'component_name', '名称', '元件名称', '器件名称']
-        desc_keywords = ['description', 'desc', '描述', '规格', '说明', '特性']
-        
-        # 遍历所有列，尝试匹配关键词
-        for col in df.columns:
-            col_lower = str(col).lower()
-            # 检查是否为型号列
-            if any(keyword in col_lower for keyword in mpn_keywords):
-                mpn_columns.append(col)
-            # 检查是否为名称列
-            if any(keyword in col_lower for keyword in name_keywords):
-                name_columns.append(col)
-            # 检查是否为描述列
-            if any(keyword in col_lower for keyword in desc_keywords):
-                desc_columns.append(col)
-        
-        # 如果没有找到明确的列，尝试从所有列中查找最有可能的型号列
-        if not mpn_columns:
-            for col in df.columns:
-                sample_values = df[col].dropna().astype(str).tolist()[:5]
-                # 检查值的特征是否像型号（通常含有数字和字母的组合）
-                if sample_values and all(bool(re.search(r'[A-Za-z].*\d|\d.*[A-Za-z]', val)) for val in sample_values):
-                    mpn_columns.append(col)
-        
-        # 构建元器件列表，包含型号、名称和描述信息
-        component_list = []
-        
-        # 确定最终使用的列
-        mpn_col = mpn_columns[0] if mpn_columns else None
-        name_col = name_columns[0] if name_columns else None
-        desc_col = desc_columns[0] if desc_columns else None
+    # 验证数据结构
+    if not risk_data or not isinstance(risk_data, dict):
+        status, eol_year, status_desc = "未知", "未知", "响应格式非JSON"
+    else:
+        status = risk_data.get("status", "未知")
+        eol_year = str(risk_data.get("eol_year", "未知")).strip()
+        status_desc = risk_data.get("description", "未知")
         
-        # 如果没有找到任何列，使用前几列
-        if not mpn_col and len(df.columns) >= 1:
-            mpn_col = df.columns[0]
-        if not name_col and len(df.columns) >= 2:
-            name_col = df.columns[1]
-        if not desc_col and len(df.columns) >= 3:
-            desc_col = df.columns[2]
+        # 验证状态值
+        if status not in ["已停产", "未停产"]:
+            status = "未知"
+
+    # 计算风险等级（核心逻辑）
+    today = date.today()
+    warning_level = "UNKNOWN"  # 默认未知
+    
+    # 情况1：已停产
+    if status == "已停产":
+        warning_level = "HIGH"
+        eol_year = "已停产"
+    
+    # 情况2：有明确停产年份（只接受合理范围内的4位年份，其他数字按未知处理）
+    elif re.fullmatch(r"\d{4}", eol_year) and 1950 <= int(eol_year) <= 2100:
+        eol_date = date(int(eol_year), 12, 31)
+        months_diff = (eol_date - today).days // 30  # 转换为月
         
-        # 从DataFrame中提取元器件列表
-        for _, row in df.iterrows():
-            component = {}
+        if months_diff <= 12:  # 1年内
+            warning_level = "HIGH"
+        elif 12 < months_diff <= 60:  # 1-5年
+            warning_level = "LOW"
+        else:  # 5年以上
+            warning_level = "SAFE"
             
-            # 提取型号信息
-            if mpn_col and pd.notna(row.get(mpn_col)):
-                component['mpn'] = str(row.get(mpn_col)).strip()
-            else:
-                continue  # 如果没有型号，则跳过该行
-                
-            # 提取名称信息
-            if name_col and pd.notna(row.get(name_col)):
-                component['name'] = str(row.get(name_col)).strip()
-            else:
-                component['name'] = ''
-                
-            # 提取描述信息
-            if desc_col and pd.notna(row.get(desc_col)):
-                component['description'] = str(row.get(desc_col)).strip()
-            else:
-                component['description'] = ''
-                
-            # 仅添加有型号的元器件
-            if component.get('mpn'):
-                component_list.append(component)
-        
-        # 去重，通常BOM表中会有重复的元器件
-        unique_components = []
-        seen_mpns = set()
-        for comp in component_list:
-            mpn = comp['mpn']
-            if mpn not in seen_mpns:
-                seen_mpns.add(mpn)
-                unique_components.append(comp)
-        
-        # 返回元器件列表和识别的列名
-        columns_info = {
-            'mpn_column': mpn_col,
-            'name_column': name_col,
-            'description_column': desc_col
+    # 情况3：无停产计划
+    elif eol_year == "无计划":
+        warning_level = "SAFE"
+        eol_year = "无停产计划"
+    
+    elif eol_year.isdigit():
+        eol_year = "未知"
+    
+    
+    # 转换为中文等级
+    chinese_level = RISK_LEVELS.get(warning_level, "未知")
+    
+    return {
+        "warning_level": chinese_level,
+        "eol_date": eol_year,
+        "status": status_desc,
+        "raw_status": status,
+        "debug_info": {  # 仅用于调试，可在生产环境移除
+            "original_response": response_text if debug_mode else None,
+            "parse_error": parse_error if debug_mode else None
         }
+    }
+
+def _assess_risk_with_deepseek(mpn, name, description, debug_mode=False, nexar_facts=None):
+    # 规则与返回格式在 "risk" 模板的静态前缀中，这里只追加型号
+    payload = f"待评估元器件：{mpn}（{name}）"
+    if nexar_facts:
+        payload += f"\nNexar数据：{format_nexar_facts(nexar_facts)}"
+
+    try:
+        # 调用DeepSeek（JSON模式 + 结构校验，不合格时定向修复一次）
+        try:
+            risk_data, response_text = request_structured(
+                partial(deepseek_create, "risk", priority=BATCH),
+                get_prompt("risk").messages(payload),
+                RISK_SCHEMA,
+                "风险评估",
+                max_tokens=200
+            )
+            parse_error = None
+        except StructuredResponseError as e:
+            risk_data, response_text, parse_error = None, e.content, "; ".join(e.errors)
+        
+        return _build_risk_info(risk_data, response_text, parse_error, debug_mode)
         
-        return unique_components, columns_info
-            
     except Exception as e:
-        st.error(f"处理BOM文件时出错: {e}")
-        if "Missing optional dependency 'xlrd'" in str(e):
-            st.info("正在尝试安装xlrd依赖...")
-            try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install", "xlrd>=2.0.1"])
-                st.success("xlrd安装成功，请重新上传文件")
-            except Exception as install_error:
-                st.error(f"自动安装xlrd失败: {install_error}")
-                st.info("请手动运行: pip install xlrd>=2.0.1")
-        if "Missing optional dependency 'openpyxl'" in str(e):
-            st.info("正在尝试安装openpyxl依赖...")
-            try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install", "openpyxl"])
-                st.success("openpyxl安装成功，请重新上传文件")
-            except Exception as install_error:
-                st.error(f"自动安装openpyxl失败: {install_error}")
-                st.info("请手动运行: pip install openpyxl")
-        return [], {}
-    finally:
-        # 删除临时文件
-        if os.path.exists(tmp_filepath):
-            os.unlink(tmp_filepath)
+        return {
+            "warning_level": "未知",
+            "eol_date": "未知",
+            "status": f"评估失败：{str(e)}",
+            "raw_status": "错误",
+            "error": str(e),
+            "circuit_open": isinstance(e, CircuitOpenError)
+        }
+
+def assess_risk_batch_with_deepseek(components, debug_mode=False, nexar_facts=None):
+    """一次DeepSeek调用评估多个元器件的停产风险
+
+    规则说明在 "risk_batch" 模板的静态前缀中只出现一次，DeepSeek在 results 数组中按型号逐项返回。
+    与 assess_risk_with_deepseek 一样在线程池中执行，不调用 Streamlit 接口。
+    nexar_facts 为 {规范化型号: 参考数据}，有数据的元器件在输入行中附带 nexar 字段。
+
+    Returns:
+        {规范化型号: 风险信息}，缺失或格式错误的条目不出现在结果中，由调用方逐个重新评估
+    """
+    if not components:
+        return {}
+    
+    nexar_facts = nexar_facts or {}
+    lines = []
+    for c in components:
+        line = {"mpn": c.get('mpn', ''), "name": c.get('name', ''), "description": c.get('description', '')}
+        facts = nexar_facts.get(normalize_part_number(c.get('mpn', '')))
+        if facts:
+            line["nexar"] = facts
+        lines.append(json.dumps(line, ensure_ascii=False))
+    part_lines = "\n".join(lines)
+    payload = f"共 {len(components)} 个元器件：\n{part_lines}"
+
+    # 结构正确的条目直接使用；个别条目出错时只修复这些条目，修复失败的条目由调用方逐个重新评估
+    try:
+        data, response_text = request_structured(
+            partial(deepseek_create, "risk_batch", priority=BATCH),
+            get_prompt("risk_batch").messages(payload),
+            RISK_BATCH_SCHEMA,
+            "批量风险评估",
+            max_tokens=min(8000, 120 * len(components) + 100)
+        )
+    except StructuredResponseError:
+        return {}
+    items = data["results"]
+    
+    expected = {normalize_part_number(c.get('mpn', '')) for c in components}
+    results = {}
+    for item in items:
+        key = normalize_part_number(item.get("mpn"))
+        if key in expected and key not in results:
+            results[key] = _build_risk_info(item, response_text, None, debug_mode)
+    return results
 
-def batch_get_alternative_parts(component_list, progress_callback=None):
+def batch_get_alternative_parts(component_list, progress_callback=None, max_workers=None, risk_batch_size=None,
+                                debug_mode=False):
     """批量评估元器件停产风险（仅判断风险，不查询替代方案）
     
+    每 risk_batch_size 个元器件合并为一次DeepSeek调用，使用线程池并发发送，
+    同时在途的请求数不超过 max_workers；批量结果中缺失或格式错误的元器件再逐个评估。
+    
     Args:
         component_list: 包含元器件信息的列表
-        progress_callback: 进度回调函数
+        progress_callback: 进度回调函数（始终在调用线程中执行）
+        max_workers: 最大并发请求数，默认使用 BATCH_MAX_WORKERS
+        risk_batch_size: 每次调用评估的元器件数量，默认使用 RISK_BATCH_SIZE，设为1则逐个评估
+        debug_mode: 是否以调试事件发出每个元器件的原始响应
         
     Returns:
-        批量风险评估结果字典
+        批量风险评估结果字典，"__batch_stats__" 中记录耗时、吞吐量与DeepSeek调用次数
     """
     # 初始化结果字典
     results = {}
     total = len(component_list)
     error_count = 0
     success_count = 0
+    circuit_open_count = 0
+    max_workers = max(1, int(max_workers or BATCH_MAX_WORKERS))
+    risk_batch_size = max(1, int(risk_batch_size or RISK_BATCH_SIZE))
 
-    # 风险等级定义（新划分标准）
-    RISK_LEVELS = {
-        "HIGH": "红色",    # 已停产或2年以内停产（高风险）
-        "LOW": "黄色",     # 2-4年停产（低风险）
-        "SAFE": "绿色",    # 4年以上停产（无风险）
-        "UNKNOWN": "未知"  # 未检测出停产时间（灰色）
-    }
-
-    def assess_risk_with_deepseek(mpn, name, description):
-        """调用DeepSeek评估元器件停产风险，按新标准划分等级"""
-        from datetime import datetime, date
-        
-        # 构建提示词（要求返回JSON格式）
-        prompt = f"""
-        按以下规则评估元器件"{mpn}（{name}）"的停产风险：
-        优先判断：允许评估元器件的停产风险等级
-        若仍然在量产，但是预计会在几年内逐步淘汰，封装已被TI列为"Legacy Packaging"（传统封装），则：status=未停产, eol_year=“当前年份”+“4年”
-        若仍然在量产，且出货量充足，并且暂时无停产计划，则：status=未停产, eol_year=无计划
-        若有较大风险，已经有明确的停产计划，或者即将有停产安排，则：status=未停产, eol_year=当前年份
-        1. 若已停产：status=已停产
-        2. 若未停产但有停产计划：status=未停产, eol_year=具体年份
-        3. 若正常生产无停产计划：status=未停产, eol_year=无计划
+    # 仅进行风险评估（无替代方案查询）
+    events.info(f"正在评估所有元器件的停产风险（并发数 {max_workers}）...")
+    eol_warnings = []
+    outcomes = [None] * total  # 按BOM原始顺序保存 (risk_info, exception)
+    start_time = time.perf_counter()
+    request_count = 0
+    done_count = 0
+    
+    def report_progress(mpn):
+        elapsed = time.perf_counter() - start_time
+        rate = done_count / elapsed if elapsed > 0 else 0.0
+        text = f"已评估 {done_count}/{total} 个元器件: {mpn}（{rate:.2f} 个/秒）"
+        events.progress(done_count / total, text)
+        if progress_callback:
+            progress_callback(done_count / total, text)
+    
+    # Nexar 参考数据：每块元器件先用一次批量查询获取，再评估风险（逐个补评时复用）
+    nexar_facts = {}
+    
+    def assess_chunk(components):
+        nexar_facts.update(prefetch_nexar_facts(components))
+        return assess_risk_batch_with_deepseek(components, debug_mode, nexar_facts)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 第一步：多个元器件合并为一次调用
+        pending = list(range(total))
+        if risk_batch_size > 1 and total > 1:
+            chunks = [pending[i:i + risk_batch_size] for i in range(0, total, risk_batch_size)]
+            future_to_chunk = {
+                executor.submit(events.bind(assess_chunk), [component_list[idx] for idx in chunk]): chunk
+                for chunk in chunks
+            }
+            request_count += len(chunks)
+            pending = []
+            for future in as_completed(future_to_chunk):
+                chunk = future_to_chunk[future]
+                try:
+                    chunk_results = future.result()
+                except Exception:
+                    chunk_results = {}
+                for idx in chunk:
+                    risk_info = chunk_results.get(normalize_part_number(component_list[idx].get('mpn', '')))
+                    if risk_info is None:
+                        pending.append(idx)
+                        continue
+                    outcomes[idx] = (risk_info, None)
+                    done_count += 1
+                report_progress(component_list[chunk[-1]].get('mpn', ''))
+        fallback_count = len(pending) if risk_batch_size > 1 and total > 1 else 0
+        if risk_batch_size == 1 or total == 1:
+            # 逐个评估模式：评估前一次性批量获取参考数据
+            nexar_facts.update(prefetch_nexar_facts([component_list[idx] for idx in pending]))
         
-        返回严格的JSON格式（禁止包含其他文本）：
-        {{
-            "status": "已停产|未停产",
-            "eol_year": "2025|无计划|未知",
-            "description": "详细状态说明"
-        }}
-        """
+        # 第二步：批量结果中缺失的元器件逐个评估
+        future_to_idx = {
+            executor.submit(
+                events.bind(assess_risk_with_deepseek),
+                component_list[idx].get('mpn', ''),
+                component_list[idx].get('name', ''),
+                component_list[idx].get('description', ''),
+                debug_mode,
+                nexar_facts.get(normalize_part_number(component_list[idx].get('mpn', '')))
+            ): idx
+            for idx in sorted(pending)
+        }
+        request_count += len(future_to_idx)
         
-        try:
-            # 调用DeepSeek
-            response = deepseek_client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是电子元器件领域专家，擅长评估产品生命周期。请严格按JSON格式返回，不添加任何额外内容。"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-                max_tokens=200
-            )
-            response_text = response.choices[0].message.content.strip()
-            
-            # 调试：记录原始响应（仅开发阶段使用）
-            if st.session_state.get("debug_mode", False):
-                st.write(f"原始响应（{mpn}）：", response_text)
-            
-            # 增强版JSON解析逻辑
-            risk_data = None
+        for future in as_completed(future_to_idx):
+            idx = future_to_idx[future]
             try:
-                # 尝试直接解析
-                risk_data = json.loads(response_text)
-                
-            except json.JSONDecodeError as e:
-                # 尝试提取JSON部分（处理可能包含额外文本的情况）
-                try:
-                    # 提取第一个大括号开始到最后一个大括号结束的部分
-                    start_idx = response_text.find("{")
-                    end_idx = response_text.rfind("}")
-                    
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = response_text[start_idx:end_idx+1]
-                        risk_data = json.loads(json_str)
-                    else:
-                        # 尝试更宽松的解析（移除前缀文本）
-                        lines = response_text.split('\n')
-                        json_lines = []
-                        in_json = False
-                        
-                        for line in lines:
-                            line = line.strip()
-                            if line.startswith("{"):
-                                in_json = True
-                            if in_json:
-                                json_lines.append(line)
-                            if line.endswith("}"):
-                                break
-                        
-                        if json_lines:
-                            json_str = '\n'.join(json_lines)
-                            risk_data = json.loads(json_str)
-                
-                except Exception as e2:
-                    # 解析失败，记录错误信息
-                    if st.session_state.get("debug_mode", False):
-                        st.write(f"JSON解析失败（{mpn}）：", str(e2))
-                    risk_data = None
-            
-            # 验证数据结构
-            if not risk_data or not isinstance(risk_data, dict):
-                status, eol_year, status_desc = "未知", "未知", "响应格式非JSON"
-            else:
-                status = risk_data.get("status", "未知")
-                eol_year = risk_data.get("eol_year", "未知")
-                status_desc = risk_data.get("description", "未知")
-                
-                # 验证状态值
-                if status not in ["已停产", "未停产"]:
-                    status = "未知"
-
-            # 计算风险等级（核心逻辑）
-            today = date.today()
-            warning_level = "UNKNOWN"  # 默认未知
-            
-            # 情况1：已停产
-            if status == "已停产":
-                warning_level = "HIGH"
-                eol_year = "已停产"
-            
-            # 情况2：有明确停产年份
-            elif eol_year.isdigit():
-                eol_date = datetime.strptime(f"{eol_year}-12-31", "%Y-%m-%d").date()
-                months_diff = (eol_date - today).days // 30  # 转换为月
-                
-                if months_diff <= 12:  # 1年内
-                    warning_level = "HIGH"
-                elif 12 < months_diff <= 60:  # 1-5年
-                    warning_level = "LOW"
-                else:  # 5年以上
-                    warning_level = "SAFE"
-                    
-            # 情况3：无停产计划
-            elif eol_year == "无计划":
-                warning_level = "SAFE"
-                eol_year = "无停产计划"
-            
-            
-            # 转换为中文等级
-            chinese_level = RISK_LEVELS.get(warning_level, "未知")
-            
-            return {
-                "warning_level": chinese_level,
-                "eol_date": eol_year,
-                "status": status_desc,
-                "raw_status": status,
-                "debug_info": {  # 仅用于调试，可在生产环境移除
-                    "original_response": response_text if st.session_state.get("debug_mode", False) else None
-                }
-            }
+                outcomes[idx] = (future.result(), None)
+            except Exception as e:
+                outcomes[idx] = (None, e)
             
-        except Exception as e:
-            st.error(f"DeepSeek风险评估失败（{mpn}）：{str(e)}")
-            return {
-                "warning_level": "未知",
-                "eol_date": "未知",
-                "status": f"评估失败：{str(e)}",
-                "raw_status": "错误"
-            }
-
-    # 仅进行风险评估（无替代方案查询）
-    st.sidebar.info("正在评估所有元器件的停产风险...")
-    eol_warnings = []
+            # 更新进度
+            done_count += 1
+            report_progress(component_list[idx].get('mpn', ''))
     
-    for idx, component in enumerate(component_list):
+    elapsed = time.perf_counter() - start_time
+    
+    for component, (risk_info, exc) in zip(component_list, outcomes):
         mpn = component.get('mpn', '')
         name = component.get('name', '')
         description = component.get('description', '')
         
-        # 更新进度
-        progress = (idx + 1) / total
-        if progress_callback:
-            progress_callback(progress, f"评估第 {idx+1}/{total} 个元器件: {mpn}")
-        
         try:
-            # 获取风险信息
-            risk_info = assess_risk_with_deepseek(mpn, name, description)
+            if exc is not None:
+                raise exc
+            
+            if risk_info.get("circuit_open"):
+                # 熔断期间快速失败的元器件最后汇总提示一次
+                circuit_open_count += 1
+            elif risk_info.get("error"):
+                events.error(f"DeepSeek风险评估失败（{mpn}）：{risk_info['error']}", target="main")
+            
+            # 调试：记录原始响应（仅开发阶段使用）
+            debug_info = risk_info.get("debug_info") or {}
+            if debug_mode and debug_info.get("original_response") is not None:
+                events.debug(f"原始响应（{mpn}）", debug_info["original_response"])
+            if debug_mode and debug_info.get("parse_error"):
+                events.debug(f"JSON解析失败（{mpn}）", debug_info["parse_error"])
             
             # 收集预警信息
-            risk_desc_map = {
-                "红色": "高风险（已停产或1年以内停产）",
-                "黄色": "低风险（1-5年停产）",
-                "绿色": "无风险（5年以上停产）",
-                "未知": "未知风险（未检测出停产信息）"
-            }
-            risk_description = risk_desc_map.get(risk_info["warning_level"], "未知风险")
+            risk_description = RISK_DESC_MAP.get(risk_info["warning_level"], "未知风险")
             
             eol_warnings.append({
                 "mpn": mpn,
@@ -1324,111 +1571,128 @@ def batch_get_alternative_parts(component_list, progress_callback=None):
                 "risk_description": risk_description
             })
             
-            # 保存结果（不包含替代方案）
+            # 保存结果（不包含替代方案）；failed 表示未能得到评估结果（可稍后重试）
             results[mpn] = {
                 'name': name,
                 'description': description,
                 'eol_date': risk_info["eol_date"],
                 'warning_level': risk_info["warning_level"],
                 'status': risk_info["status"],
-                'risk_description': risk_description
+                'risk_description': risk_description,
+                'failed': bool(risk_info.get("error") or risk_info.get("circuit_open"))
             }
             success_count += 1
             
         except Exception as e:
             error_count += 1
-            st.error(f"处理元器件 {mpn} 时出错: {e}")
+            events.error(f"处理元器件 {mpn} 时出错: {e}", target="main")
             results[mpn] = {
                 'name': name,
                 'description': description,
                 'eol_date': "未知",
                 'warning_level': "未知",
                 'status': f"处理错误: {str(e)}",
-                'risk_description': "处理异常"
+                'risk_description': "处理异常",
+                'failed': True
             }
     
+    if circuit_open_count:
+        events.warning(f"DeepSeek 暂不可用（熔断中），{circuit_open_count} 个元器件未能评估，请稍后重试", target="main")
+    
     # 保存风险预警信息
     results["__eol_warnings__"] = eol_warnings
-    with st.sidebar.expander("调试：风险评估结果", expanded=False):
-        st.write(f"共评估 {len(eol_warnings)} 个元器件，成功 {success_count} 个，失败 {error_count} 个")
     
-    st.sidebar.success(f"批量评估完成：共 {total} 个元器件")
+    # 记录端到端吞吐量，便于按API配额调整并发数
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    results["__batch_stats__"] = {
+        "total": total,
+        "success": success_count,
+        "errors": error_count,
+        "circuit_open": circuit_open_count,
+        "max_workers": max_workers,
+        "risk_batch_size": risk_batch_size,
+        "requests": request_count,
+        "fallbacks": fallback_count,
+        "elapsed_seconds": round(elapsed, 3),
+        "parts_per_second": round(throughput, 3)
+    }
+    events.debug("调试：风险评估结果", message="\n\n".join([
+        f"共评估 {len(eol_warnings)} 个元器件，成功 {success_count} 个，失败 {error_count} 个",
+        f"并发数 {max_workers}，耗时 {elapsed:.1f} 秒，吞吐量 {throughput:.2f} 个/秒",
+        f"DeepSeek调用 {request_count} 次（每次最多 {risk_batch_size} 个元器件，逐个补评 {fallback_count} 个）",
+    ]))
+    
+    events.success(f"批量评估完成：共 {total} 个元器件，耗时 {elapsed:.1f} 秒（{throughput:.2f} 个/秒）")
     return results
 
-def get_alternatives_direct(mpn, name="", description=""):
-    """直接使用DeepSeek API查询元器件替代方案，不通过Nexar API"""
+def get_alternatives_direct(mpn, name="", description="", priority=INTERACTIVE):
+    """直接使用DeepSeek API查询元器件替代方案，不通过Nexar API（结果按型号缓存）"""
+    return lookup_alternatives_direct(mpn, name, description, priority)[0]
+
+def lookup_alternatives_direct(mpn, name="", description="", priority=INTERACTIVE, nexar_facts=None):
+    """与 get_alternatives_direct 相同，返回 (推荐列表, 是否为真实结果)
+
+    查询失败时推荐列表中是测试数据（不写入缓存），批量任务据此把该型号记为失败。
+    nexar_facts 为批量预取的 Nexar 参考数据（可选），附加在查询信息中。
+    """
+    cached = part_cache.get("direct", mpn)
+    if cached is not None:
+        return cached, True
+
+    recommendations, cacheable = _fetch_alternatives_direct(mpn, name, description, priority, nexar_facts)
+    if cacheable:
+        part_cache.set("direct", mpn, recommendations)
+    return recommendations, cacheable
+
+def batch_lookup_alternatives_direct(component_list, max_workers=None, on_result=None):
+    """并发查询多个元器件的替代方案（BATCH 优先级，不挤占交互查询的限流配额）
+
+    Args:
+        component_list: 包含 mpn / name / description 的元器件列表
+        max_workers: 最大并发数，默认使用 BATCH_MAX_WORKERS
+        on_result: 每完成一个元器件在调用线程中执行 on_result(mpn, entry)
+
+    Returns:
+        {型号: {"name", "description", "recommendations", "failed"}}，failed 的元器件推荐列表为空
+    """
+    results = {}
+    max_workers = max(1, int(max_workers or BATCH_MAX_WORKERS))
+    # 未缓存的元器件先按块批量查询 Nexar 参考数据
+    nexar_facts = prefetch_nexar_facts([c for c in component_list if not part_cache.contains("direct", c.get('mpn', ''))])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(events.bind(lookup_alternatives_direct), c.get('mpn', ''), c.get('name', ''),
+                            c.get('description', ''), BATCH, nexar_facts.get(normalize_part_number(c.get('mpn', '')))): c
+            for c in component_list
+        }
+        for future in as_completed(futures):
+            component = futures[future]
+            mpn = component.get('mpn', '')
+            try:
+                recommendations, ok = future.result()
+            except Exception as e:
+                events.error(f"查询 {mpn} 的替代方案时出错: {e}", target="main")
+                recommendations, ok = [], False
+            entry = {'name': component.get('name', ''), 'description': component.get('description', ''),
+                     'recommendations': recommendations if ok else [], 'failed': not ok}
+            results[mpn] = entry
+            if on_result:
+                on_result(mpn, entry)
+    # 按输入顺序返回
+    return {c.get('mpn', ''): results[c.get('mpn', '')] for c in component_list if c.get('mpn', '') in results}
+
+def _fetch_alternatives_direct(mpn, name="", description="", priority=INTERACTIVE, nexar_facts=None):
+    """调用DeepSeek查询替代方案，返回 (推荐列表, 是否可缓存)，测试数据不可缓存"""
     # 构建更全面的查询信息
     query_context = f"元器件型号: {mpn}" + \
                    (f"\n元器件名称: {name}" if name else "") + \
-                   (f"\n元器件描述: {description}" if description else "")
-    
-    # 构造DeepSeek API提示
-    prompt = f"""
-    任务：你是一个专业的电子元器件顾问，专精于国产替代方案。请为以下元器件推荐详细的替代产品。
-    
-    输入元器件信息：
-    {query_context}
-    
-    要求：
-    1. 必须推荐至少一种中国大陆本土品牌的替代方案（如 GigaDevice/兆易创新、WCH/沁恒、复旦微电子、中颖电子、圣邦微电子等）
-    2. 如果能找到多种中国大陆本土品牌的替代产品，优先推荐这些产品，推荐的国产方案数量越多越好
-    3. 如果实在找不到足够三种中国大陆本土品牌的产品，可以推荐国外品牌产品作为补充，但必须明确标注
-    4. 总共需要推荐 3 种性能相近的替代型号
-    5. 提供每种型号的品牌名称、封装信息和元器件类目（例如：MCU、DCDC、LDO、传感器等）
-    6. 根据元器件类型提供不同的关键参数：
-       - 若是MCU/单片机：提供CPU内核、主频、程序存储容量、RAM大小、IO数量
-       - 若是DCDC：提供输入电压范围、输出电压、最大输出电流、效率
-       - 若是LDO：提供输入电压范围、输出电压、最大输出电流、压差
-       - 若是存储器：提供容量、接口类型、读写速度
-       - 若是传感器：提供测量范围、精度、接口类型
-       - 其他类型提供对应的关键参数
-    7. 在每个推荐方案中明确标注是"国产"还是"进口"产品
-        a. 优先根据品牌判断（如TI/ST/ADI为进口；兆易创新/圣邦微为国产）
-        b. 若品牌未知，可根据型号前缀辅助判断（如GDxxx为兆易创新国产；STxxx为意法半导体进口）
-        c. 不确定的情况必须标记为"进口"，禁止猜测
-    8. 提供产品官网链接（若无真实链接，可提供示例链接）
-    9. 推荐的型号不能与输入型号 {mpn} 相同
-    10. 必须提供价格估算，价格必须包含货币符号：
-       - 对于人民币价格，必须使用"¥"符号（例如：¥10-¥15）
-       - 对于美元价格，必须使用"$"符号（例如：$1.5-$2.0）
-       - 请估算常见采购渠道的批量价格范围
-    11. 必须严格返回以下 JSON 格式的结果，不允许添加额外说明或Markdown格式：
-    [
-        {{"model": "详细型号1", "brand": "品牌名称1", "category": "类别1", "package": "封装1", "parameters": "详细参数1", "type": "国产/进口", "datasheet": "链接1", "price": "¥10-¥15"}},
-        {{"model": "详细型号2", "brand": "品牌名称2", "category": "类别2", "package": "封装2", "parameters": "详细参数2", "type": "国产/进口", "datasheet": "链接2", "price": "$1.5-$2.0"}},
-        {{"model": "详细型号3", "brand": "品牌名称3", "category": "类别3", "package": "封装3", "parameters": "详细参数3", "type": "国产/进口", "datasheet": "链接3", "price": "¥8-¥12"}}
-    ]
-    12. 每个推荐项必须包含 "model"、"brand"、"category"、"package"、"parameters"、"type"、"datasheet"和"price"八个字段
-    13. 如果无法找到合适的替代方案，返回空的 JSON 数组：[]
-    14.重要：准确判断每个替代方案是否与原始元器件为"pin-to-pin替代"，必须满足以下所有条件才能标记为pin兼容:
-                    a. 如果是标准封装，封装与原元器件相同就满足条件a。或者非标准封装，物理尺寸公差在1mm以内，引脚排列和间距一致，可以在相同PCB焊盘位置安装
-                    b. 所有引脚的功能和编号与原元器件完全匹配
-                    c. 电气特性（电压/电流/时序等）与原元器件在合理范围内兼容
-                    d. 无需对PCB进行任何修改（包括布线、跳线等）就能替换使用
-                    e. 如果以上任何一点不符合，或者无法确定，则标记为"非Pin兼容"
-    """
+                   (f"\n元器件描述: {description}" if description else "") + \
+                   (f"\nNexar数据: {format_nexar_facts(nexar_facts)}" if nexar_facts else "")
     
     try:
-        # 调用DeepSeek API
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一个精通中国电子元器件行业的专家，擅长为各种元器件寻找合适的替代方案，尤其专注于中国大陆本土生产的国产元器件。始终以有效的JSON格式回复，不添加任何额外说明。"},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False,
-            max_tokens=1200
-        )
-        
-        raw_content = response.choices[0].message.content
-        
-        # 记录API返回的原始内容以便调试
-        with st.sidebar.expander(f"调试信息 - API原始响应 ({mpn})", expanded=False):
-            st.write(f"**原始响应内容:**")
-            st.code(raw_content, language="text")
-        
-        # 使用简化版的extract_json_content处理API返回结果
-        recommendations = extract_json_content(raw_content, "批量查询")
+        # 调用DeepSeek API（JSON模式 + 结构校验，原始响应显示在侧边栏调试区域）
+        recommendations = request_recommendations("alternatives_direct", query_context, f"批量查询 - {mpn}",
+                                                  max_tokens=1200, priority=priority) or []
         
         # 确保所有必要字段都存在
         validated_recommendations = []
@@ -1458,10 +1722,13 @@ def get_alternatives_direct(mpn, name="", description=""):
                         rec["type"] = "国产"
                     validated_recommendations.append(rec)
             
+        # 只有真实的推荐结果才允许写入缓存
+        cacheable = len(validated_recommendations) > 0 and not USE_DUMMY_DATA
+        
         # 如果没有找到任何有效推荐或推荐数量不足
         if len(validated_recommendations) < 3:
             # 创建测试数据以确保至少有一些结果
-            if st.session_state.get("use_dummy_data", False) or len(validated_recommendations) == 0:
+            if USE_DUMMY_DATA or len(validated_recommendations) == 0:
                 missing_count = 3 - len(validated_recommendations)
                 for i in range(missing_count):
                     validated_recommendations.append({
@@ -1480,16 +1747,15 @@ def get_alternatives_direct(mpn, name="", description=""):
                     })
         
         # 确保不返回超过3个结果
-        return validated_recommendations[:3]
+        return validated_recommendations[:3], cacheable
         
     except Exception as e:
-        st.sidebar.error(f"DeepSeek API 查询失败: {e}")
-        import traceback
-        st.sidebar.error(f"错误详情: {traceback.format_exc()}")
+        events.error(f"DeepSeek API 查询失败: {e}")
+        events.debug("DeepSeek API错误详情", traceback.format_exc(), language="python")
         
         # 返回测试数据以保证前端显示正常
-        if st.session_state.get("use_dummy_data", False):
-            st.sidebar.info(f"使用测试数据继续处理 {mpn}")
+        if USE_DUMMY_DATA:
+            events.info(f"使用测试数据继续处理 {mpn}")
             return [
                 {
                     "model": f"{mpn}_ALT1",
@@ -1519,16 +1785,34 @@ def get_alternatives_direct(mpn, name="", description=""):
                     "compatibility": "需要修改PCB",
                     "datasheet": "https://www.example.com/datasheet"
                 }
-            ]
-        return []
-
-def chat_with_expert(user_input, history=None):
+            ], False
+        return [], False
+
+def summarize_chat(previous_summary, messages):
+    """把已有摘要与新移出上下文预算的对话合并为新摘要（在 chat_context 的后台线程中调用）"""
+    payload = f"已有摘要：\n{previous_summary or '无'}\n\n新增对话：\n{format_transcript(messages)}"
+    response = deepseek_create(
+        "chat_summary",
+        priority=BATCH,
+        model="deepseek-chat",
+        messages=get_prompt("chat_summary").messages(payload),
+        stream=False,
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS
+    )
+    return response.choices[0].message.content
+
+def new_chat_context():
+    """创建一个会话的对话上下文（按token预算保留最近对话，较早的对话替换为滚动摘要）"""
+    return ChatContext(summarize_chat)
+
+def chat_with_expert(user_input, history=None, context=None):
     """
     使用DeepSeek API实现与电子元器件专家的对话
     
     参数:
         user_input (str): 用户的输入/问题
         history (list): 对话历史记录，格式为[{"role": "user/assistant", "content": "消息内容"}, ...]
+        context (ChatContext): 会话的对话上下文；为 None 时发送完整历史
     
     返回:
         str 或 Generator: 根据stream参数，返回完整回复或流式回复
@@ -1536,62 +1820,24 @@ def chat_with_expert(user_input, history=None):
     if history is None:
         history = []
     
-    # 构建完整的消息历史
-    messages = [
-        {"role": "system", "content": """  
-您是一名电子元器件选型专家，请严格遵循以下流程：
-
-**处理流程**
-一. 参数解析阶段：
-   - 识别【硬性参数】（字体加粗）：电压/电流/频率/温度/封装
-   - 提取【应用场景】（字体加粗）：工业/消费/汽车/医疗
-   - 确认【限制条件】（字体加粗）：成本/供货周期/认证/国产化需求
-   - 强制检查：必须询问"是否需要包含国产方案？"
-
-二. 方案生成阶段：
-   a. 获取候选型号（必须包含：圣邦微/长电/士兰微等国产方案）
-   b. 分级推荐：
-      1) 旗舰方案（⭐⭐⭐⭐⭐）：国际大厂+参数完美匹配
-      2) 优选方案（⭐⭐⭐⭐）：国产替代+参数匹配≥95% 
-      3) 备选方案（⭐⭐⭐）：参数临界匹配但成本优势>30%
-   c. 推荐策略：
-       * 至少提供5个有效选项（其中国产≥2个）
-       * 标注"国产优选"标签（需满足：量产历史≥2年）
-
-三. 输出规范：
-   - 严格使用Markdown格式
-   - 必须包含：
-     * 参数对比表格，一定要标记出元器件地价格（标注关键性能指标）
-     * TOP5推荐表（含价格梯度/供货指数）
-     * 国产方案竞争力分析
-     * 生命周期预警（停产风险型号标红）
-
-    输出必须严格遵循：
-    1. 标题使用##（二级标题）、###（三级标题），禁止使用#（一级标题）
-    2. 正文使用纯文本，换行用<br>或空行分隔
-    3. 表格使用标准Markdown格式（|表头|...|）
-    4. 禁止使用HTML标签或其他非Markdown语法
-    
-**对话规范**
-- 技术参数必须标注来源（如"参照圣邦微SGM2042手册第8页"）
-- 出现以下情况立即警示：
-  1) 单一供应商依赖风险（某型号采购占比>60%）
-  2) 国产方案参数达标但未被选择
-  3) 成本敏感场景选用超规格器件
-- 优先推荐已验证的"芯片组"方案（如MCU+配套电源芯片）
-"""}
-    ]
-    
-    # 添加历史对话
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
-    
-    # 添加当前用户问题
-    messages.append({"role": "user", "content": user_input})
+    system_prompt = get_prompt("expert_chat").system
+    on_usage = None
+    if context is not None:
+        # system 提示词 + 较早对话的摘要 + 最近的对话 + 当前问题，总量不超过token预算
+        messages, turn = context.build_messages(system_prompt, history, user_input)
+        on_usage = partial(ChatContext.record_usage, turn)
+    else:
+        # 构建完整的消息历史（system 提示词为静态前缀，历史与当前问题依次追加）
+        messages = [{"role": "system", "content": system_prompt}]
+        for msg in history:
+            messages.append({"role": msg["role"], "content": msg["content"]})
+        messages.append({"role": "user", "content": user_input})
     
     try:
         # 调用DeepSeek API获取回复 - 使用流式响应
-        response = deepseek_client.chat.completions.create(
+        response = deepseek_create(
+            "expert_chat",
+            on_usage=on_usage,
             model="deepseek-chat",
             messages=messages,
             stream=True,
@@ -1600,9 +1846,8 @@ def chat_with_expert(user_input, history=None):
         return response
     
     except Exception as e:
-        st.error(f"调用DeepSeek API失败: {e}")
-        import traceback
-        st.error(f"错误详情: {traceback.format_exc()}")
+        events.error(f"调用DeepSeek API失败: {e}", target="main")
+        events.debug("DeepSeek API错误详情", traceback.format_exc(), language="python")
         # 返回一个只包含错误信息的生成器，以保持接口一致性
         def error_generator():
             yield f"很抱歉，我暂时无法回答你的问题。错误信息: {str(e)}"
@@ -1619,32 +1864,100 @@ def format_response(text):
         text = text.replace(k, v)
     return text
 
+def get_cache_stats():
+    """返回持久化缓存与 Nexar 共享响应的命中/未命中统计"""
+    stats = part_cache.stats()
+    nexar_stats = nexar_response_store.stats()
+    lookups = nexar_stats["hits"] + nexar_stats["misses"]
+    nexar_stats["hit_rate"] = round(nexar_stats["hits"] / lookups, 3) if lookups else 0.0
+    stats["nexar_response"] = nexar_stats
+    return stats
+
+def get_nexar_latency_stats():
+    """返回 Nexar 各查询的延迟直方图（客户端尚未创建时为空）"""
+    return _nexar_client.latency_stats() if _nexar_client is not None else {}
+
+def get_nexar_token_stats():
+    """返回 Nexar 令牌刷新统计（后台刷新次数/阻塞刷新次数/失败次数）"""
+    if _nexar_client is None:
+        return {"refreshes": 0, "blocking_refreshes": 0, "failures": 0}
+    return dict(_nexar_client.tokens.stats)
+
+def get_structured_output_stats():
+    """返回各类DeepSeek调用的补全次数、修复次数与每次成功调用浪费的补全数"""
+    return structured_stats.snapshot()
+
+def get_prompt_cache_stats():
+    """返回各提示词模板的输入token数与DeepSeek前缀缓存命中token数"""
+    return prompt_cache_stats.snapshot()
+
+def get_rate_limiter_stats():
+    """返回DeepSeek限流统计（各优先级的排队次数与等待时间、429次数、当前排队数）"""
+    return deepseek_limiter.stats()
+
+def get_circuit_breaker_stats():
+    """返回 Nexar / DeepSeek 熔断器的状态与计数"""
+    return {"Nexar": nexar_breaker.snapshot(), "DeepSeek": deepseek_breaker.snapshot()}
+
+def get_coalescing_stats():
+    """返回并发请求合并的统计（实际执行次数/被合并次数）"""
+    return request_coalescer.stats()
+
+def invalidate_component_cache(mpn):
+    """清除指定型号的元器件识别缓存与共享的 Nexar 原始响应，下次识别重新查询上游"""
+    part_cache.invalidate("identify", mpn)
+    nexar_response_store.invalidate(mpn)
+
+def is_component_cached(mpn):
+    """指定型号是否有未过期的识别结果（identify_component 会直接返回缓存，不调用上游API）"""
+    return part_cache.contains("identify", mpn)
+
 def identify_component(mpn):
-    """识别元器件信息，新增停产时间提取"""
-    import re
-    from datetime import datetime, date  # 新增：用于日期处理
+    """识别元器件信息（优先读取持久化缓存）"""
     if not mpn or len(mpn) < 3 or not re.search(r'[A-Za-z0-9]', mpn):
         return {}
 
-    variables = {"q": mpn, "limit": 1}
+    cached = part_cache.get("identify", mpn)
+    if cached is not None:
+        return cached
+
+    def load():
+        component_info = _fetch_component_info(mpn)
+        # DeepSeek兜底失败时返回的默认值不写入缓存
+        if component_info and component_info.get("manufacturer", "未知") != "未知":
+            part_cache.set("identify", mpn, component_info)
+        else:
+            # 两个上游都没有结果（例如都在熔断中）时，使用过期的缓存结果
+            stale = part_cache.get("identify", mpn, allow_stale=True)
+            if stale:
+                events.info(f"暂时无法识别 '{mpn}'，显示历史缓存结果")
+                return stale
+        return component_info
+
+    return request_coalescer.do("identify", mpn, load)
+
+def _fetch_component_info(mpn):
+    """识别元器件信息，新增停产时间提取"""
+    from datetime import datetime, date  # 新增：用于日期处理
+
     try:
-        data = nexar_client.get_query(QUERY_ALTERNATIVE_PARTS, variables)
+        data = fetch_nexar_part_data(mpn, limit=1)
         
         if not data:
-            st.sidebar.info(f"Nexar未找到{mpn}，尝试DeepSeek检索")
+            events.info(f"Nexar未找到{mpn}，尝试DeepSeek检索")
             return call_deepseek_for_component(mpn)
         
         sup_search = data.get("supSearchMpn", {})
         results = sup_search.get("results", [])
         
         if not results:
-            st.sidebar.info(f"Nexar结果为空，尝试DeepSeek检索{mpn}")
+            events.info(f"Nexar结果为空，尝试DeepSeek检索{mpn}")
             return call_deepseek_for_component(mpn)
         
         part = results[0].get("part", {})
         required_fields = ["mpn", "manufacturer", "specs"]
         if not all(part.get(field) for field in required_fields):
-            st.sidebar.info(f"Nexar数据不完整，尝试DeepSeek检索{mpn}")
+            events.info(f"Nexar数据不完整，尝试DeepSeek检索{mpn}")
             return call_deepseek_for_component(mpn)
 
         # 基础信息（新增eol_date和warning_level字段）
@@ -1717,7 +2030,7 @@ def identify_component(mpn):
                     else:  # 已过期（停产日期在今天之前）
                         component_info["warning_level"] = "红色"  # 已停产也标红
             except Exception as e:
-                st.sidebar.warning(f"解析{mpn}停产日期失败: {e}")
+                events.warning(f"解析{mpn}停产日期失败: {e}")
                 component_info["warning_level"] = "未知"
         else:
             # 若未找到明确停产日期，根据状态推断
@@ -1775,78 +2088,44 @@ def identify_component(mpn):
 
         return component_info
     
+    except CircuitOpenError as e:
+        events.info(f"{e}，尝试使用DeepSeek检索")
+        return call_deepseek_for_component(mpn)
     except Exception as e:
-        st.error(f"Nexar API 查询失败: {e}，尝试使用DeepSeek检索")
-        import traceback
-        with st.sidebar.expander("Nexar API错误详情", expanded=False):
-            st.code(traceback.format_exc())
+        events.error(f"Nexar API 查询失败: {e}，尝试使用DeepSeek检索", target="main")
+        events.debug("Nexar API错误详情", traceback.format_exc(), language="python")
         return call_deepseek_for_component(mpn)  # 调用DeepSeek检索
 
 def call_deepseek_for_component(mpn):
     """调用DeepSeek API获取元器件信息"""
     try:
-        # 构造DeepSeek提示词
-        prompt = f"""
-        任务：你是一个专业的电子元器件专家，请分析以下元器件型号并提取关键信息：
-        
-        元器件型号：{mpn}
-        
-        要求：
-        1. 提取以下关键信息（如果无法获取则填"未知"）：
-           - 制造商
-           - 元器件类别（如MCU、DCDC、LDO等）
-           - 封装类型
-           - 主要技术参数（格式为JSON对象，例如：{{"电压": "3.3V", "电流": "1A"}}）
-           - 价格范围（格式示例："¥10-¥15" 或 "$1.5-$2.0"）
-           - 生命周期状态（量产中、已停产等）
-           - 供货周期
-           - 是否为PIN兼容器件（是/否/未知）
-           
-        2. 输出格式要求：
-        {{
-            "mpn": "{mpn}",
-            "manufacturer": "制造商名称",
-            "category": "元器件类别",
-            "package": "封装类型",
-            "parameters": {{"参数名称": "参数值", ...}},
-            "price": "价格范围，包含货币符号",
-            "status": "生命周期状态",
-            "leadTime": "供货周期",
-            "pin_compatible": "是/否/未知"
-        }}
-        
-        3. 注意事项：
-        - 严格按照JSON格式输出，不添加任何额外内容
-        - 价格范围必须包含货币符号（¥或$）
-        """
-        
-        # 调用DeepSeek API
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一个精通电子元器件的专家，能够根据型号准确提取元器件关键信息。始终以有效的JSON格式回复，不添加任何额外说明。"},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False,
-            max_tokens=500
-        )
-        
-        raw_content = response.choices[0].message.content
+        # 调用DeepSeek API（JSON模式 + 结构校验，不合格时定向修复一次）
+        try:
+            data, raw_content = request_structured(
+                partial(deepseek_create, "component_info"),
+                get_prompt("component_info").messages(f"元器件型号：{mpn}"),
+                COMPONENT_INFO_SCHEMA,
+                "元器件识别",
+                max_tokens=500
+            )
+        except StructuredResponseError as e:
+            data, raw_content = None, e.content or ""
         
         # 记录API返回的原始内容以便调试
-        with st.sidebar.expander(f"调试信息 - DeepSeek响应 ({mpn})", expanded=False):
-            st.write(f"**DeepSeek原始响应:**")
-            st.code(raw_content, language="text")
+        events.debug(f"调试信息 - DeepSeek响应 ({mpn})", raw_content, message="**DeepSeek原始响应:**", language="text")
         
         # 解析DeepSeek响应
+        if data is not None:
+            return component_info_from_data(data, mpn)
         component_info = parse_deepseek_response(raw_content, mpn)
         return component_info
     
     except Exception as e:
-        st.error(f"DeepSeek API 调用失败: {e}")
-        import traceback
-        with st.sidebar.expander("DeepSeek API错误详情", expanded=False):
-            st.code(traceback.format_exc())
+        if isinstance(e, CircuitOpenError):
+            events.warning(str(e))
+        else:
+            events.error(f"DeepSeek API 调用失败: {e}", target="main")
+            events.debug("DeepSeek API错误详情", traceback.format_exc(), language="python")
         return {
             "mpn": mpn,
             "manufacturer": "未知",
@@ -1859,86 +2138,49 @@ def call_deepseek_for_component(mpn):
             "pin_compatible": "未知"
         }
 
-def parse_deepseek_response(response_content, mpn):
-    """解析DeepSeek API返回的元器件信息"""
-    import json
-    import re
+def component_info_from_data(data, mpn):
+    """把DeepSeek返回的元器件信息对象整理为统一格式"""
+    # 确保返回数据包含必要字段
+    component_info = {
+        "mpn": data.get("mpn", mpn),
+        "manufacturer": data.get("manufacturer", "未知"),
+        "category": data.get("category", "未知"),
+        "package": data.get("package", "未知"),
+        "parameters": data.get("parameters", {}),  # 直接使用JSON对象
+        "price": format_price_string(data.get("price", "未知")),
+        "status": data.get("status", "未知"),
+        "leadTime": data.get("leadTime", "未知"),
+        "pin_compatible": data.get("pin_compatible", "未知")
+    }
     
-    # 尝试直接解析JSON
-    try:
-        data = json.loads(response_content)
-        # 确保返回数据包含必要字段
-        component_info = {
-            "mpn": data.get("mpn", mpn),
-            "manufacturer": data.get("manufacturer", "未知"),
-            "category": data.get("category", "未知"),
-            "package": data.get("package", "未知"),
-            "parameters": data.get("parameters", {}),  # 直接使用JSON对象
-            "price": format_price_string(data.get("price", "未知")),
-            "status": data.get("status", "未知"),
-            "leadTime": data.get("leadTime", "未知"),
-            "pin_compatible": data.get("pin_compatible", "未知")
-        }
-        
-        # 如果parameters是字符串格式，尝试解析为字典
-        if isinstance(component_info["parameters"], str):
-            try:
-                component_info["parameters"] = json.loads(component_info["parameters"])
-            except:
-                # 解析失败，尝试简单分割
-                params = {}
-                params_text = component_info["parameters"]
-                if params_text and params_text != "未知":
-                    for param in params_text.split(","):
-                        if ":" in param:
-                            key, value = param.split(":", 1)
-                            params[key.strip()] = value.strip()
-                        else:
-                            params[param.strip()] = "未知"
-                component_info["parameters"] = params
-        
-        return component_info
+    # 如果parameters是字符串格式，尝试解析为字典
+    if isinstance(component_info["parameters"], str):
+        parsed_params = extract_json(component_info["parameters"], prefer='{')
+        if isinstance(parsed_params, dict):
+            component_info["parameters"] = parsed_params
+        else:
+            # 解析失败，尝试简单分割
+            params = {}
+            params_text = component_info["parameters"]
+            if params_text and params_text != "未知":
+                for param in params_text.split(","):
+                    if ":" in param:
+                        key, value = param.split(":", 1)
+                        params[key.strip()] = value.strip()
+                    else:
+                        params[param.strip()] = "未知"
+            component_info["parameters"] = params
     
-    except json.JSONDecodeError:
-        # 尝试从响应中提取JSON
-        json_match = re.search(r'(\{.*\})', response_content, re.DOTALL)
-        if json_match:
-            try:
-                data = json.loads(json_match.group(1))
-                component_info = {
-                    "mpn": data.get("mpn", mpn),
-                    "manufacturer": data.get("manufacturer", "未知"),
-                    "category": data.get("category", "未知"),
-                    "package": data.get("package", "未知"),
-                    "parameters": data.get("parameters", {}),
-                    "price": format_price_string(data.get("price", "未知")),
-                    "status": data.get("status", "未知"),
-                    "leadTime": data.get("leadTime", "未知"),
-                    "pin_compatible": data.get("pin_compatible", "未知")
-                }
-                
-                # 如果parameters是字符串格式，尝试解析为字典
-                if isinstance(component_info["parameters"], str):
-                    try:
-                        component_info["parameters"] = json.loads(component_info["parameters"])
-                    except:
-                        params = {}
-                        params_text = component_info["parameters"]
-                        if params_text and params_text != "未知":
-                            for param in params_text.split(","):
-                                if ":" in param:
-                                    key, value = param.split(":", 1)
-                                    params[key.strip()] = value.strip()
-                                else:
-                                    params[param.strip()] = "未知"
-                        component_info["parameters"] = params
-                
-                return component_info
-            except:
-                pass
+    return component_info
+
+def parse_deepseek_response(response_content, mpn):
+    """解析DeepSeek API返回的元器件信息"""
+    data = extract_json(response_content, prefer='{')
+    if isinstance(data, dict):
+        return component_info_from_data(data, mpn)
     
     # 无法解析JSON时返回默认值
-    st.sidebar.warning(f"无法解析DeepSeek响应，返回默认值: {response_content}")
+    events.warning(f"无法解析DeepSeek响应，返回默认值: {response_content}")
     return {
         "mpn": mpn,
         "manufacturer": "未知",
@@ -1962,6 +2204,8 @@ def format_price(price_val, currency):
 
 def format_price_string(price_str):
     """处理DeepSeek返回的价格字符串，确保包含货币符号"""
+    if isinstance(price_str, (int, float)) and not isinstance(price_str, bool):
+        price_str = str(price_str)
     if not price_str or price_str.lower() == "未知":
         return "未知"
     
@@ -0,0 +1,62 @@
+"""对比同步 NexarClient（线程池）与 AsyncNexarClient（单事件循环）的吞吐量
+
+完全离线运行，使用本地桩服务模拟 Nexar 延迟：
+    python -m benchmarks.bench_async_nexar --parts 500 --latency 0.05 --concurrency 50
+
+AsyncNexarClient 的连接池和并发上限为 AsyncNexarClient.MAX_POOL_SIZE（--concurrency 更大时按上限运行），
+同步客户端按 --concurrency 使用线程与连接。
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_nexar_server import run_stub_nexar_server
+from nexarClient import AsyncNexarClient, NexarClient
+
+QUERY = '''
+query findAlternativeParts($q: String!, $limit: Int = 10) {
+  supSearchMpn(q: $q, limit: $limit) { hits results { part { mpn } } }
+}
+'''
+
+
+def bench_sync(stub, mpns, concurrency):
+    client = NexarClient("bench", "bench", pool_size=concurrency, url=stub.graphql_url, token_url=stub.token_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda mpn: client.get_query(QUERY, {"q": mpn, "limit": 1}), mpns))
+    return time.perf_counter() - start, len(results), client.latency_stats()
+
+
+async def bench_async(stub, mpns, concurrency):
+    async with AsyncNexarClient("bench", "bench", max_concurrency=concurrency, pool_size=concurrency,
+                                url=stub.graphql_url, token_url=stub.token_url) as client:
+        start = time.perf_counter()
+        results = await client.get_queries(QUERY, [{"q": mpn, "limit": 1} for mpn in mpns])
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for result in results if isinstance(result, Exception))
+        return elapsed, len(results) - errors, client.latency_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nexar 同步/异步客户端吞吐量对比")
+    parser.add_argument("--parts", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    mpns = [f"PART{i:05d}" for i in range(args.parts)]
+    with run_stub_nexar_server(latency=args.latency) as stub:
+        for label, runner in (
+            ("sync + threads", lambda: bench_sync(stub, mpns, args.concurrency)),
+            ("async", lambda: asyncio.run(bench_async(stub, mpns, args.concurrency))),
+        ):
+            elapsed, ok, latency = runner()
+            p95 = latency.get("findAlternativeParts", {}).get("p95_ms")
+            print(f"{label:<15} {ok}/{len(mpns)} ok in {elapsed:.2f}s -> {ok / elapsed:.1f} parts/s (p95 <= {p95} ms)")
+        print(f"stub stats: {stub.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""对比旧版多策略 extract_json_content 与单遍扫描 extract_json_array 的速度和结果
+
+语料为 benchmarks/json_corpus.jsonl 中收集的 DeepSeek 典型异常响应（代码块、说明文字、
+尾随逗号、单引号、被截断的输出等）。旧版两者都能解析的响应要求结果完全一致：
+    python -m benchmarks.bench_json_extract --repeat 200
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from json_utils import extract_json_array, normalize_recommendation
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_corpus.jsonl")
+
+
+def legacy_extract(content):
+    """旧版 extract_json_content 的解析顺序（去掉 Streamlit 调试输出），失败返回 None"""
+    def finish(parsed):
+        for item in parsed:
+            if isinstance(item, dict):
+                normalize_recommendation(item)
+        return parsed
+
+    try:
+        parsed = json.loads(content)
+        if not isinstance(parsed, list):
+            raise ValueError("响应不是 JSON 数组")
+        return finish(parsed)
+    except json.JSONDecodeError:
+        pass
+
+    code_match = re.search(r"```(?:json)?\s*\n?([\s\S]*?)\n?```", content, re.DOTALL)
+    if code_match:
+        try:
+            return finish(json.loads(code_match.group(1).strip()))
+        except json.JSONDecodeError:
+            pass
+
+    json_match = re.search(r'\[\s*\{.*\}\s*\]', content, re.DOTALL)
+    if json_match:
+        try:
+            return finish(json.loads(json_match.group(0)))
+        except json.JSONDecodeError:
+            pass
+
+    json_content = ''
+    in_json = False
+    for line in content.strip().split('\n'):
+        line = line.strip()
+        if line.startswith('[') or in_json:
+            json_content += line
+            in_json = True
+        if line.endswith(']'):
+            break
+    if json_content:
+        try:
+            return finish(json.loads(json_content))
+        except json.JSONDecodeError:
+            pass
+
+    for fragment in re.findall(r'\[\s*\{\s*"model"\s*:.*?\}\s*\]', content, re.DOTALL):
+        try:
+            return finish(json.loads(fragment))
+        except json.JSONDecodeError:
+            pass
+
+    for fix_attempt in [
+        lambda c: c.replace("'", '"'),
+        lambda c: re.sub(r'",\s*\}', '"}', c),
+        lambda c: re.sub(r',\s*]', ']', c)
+    ]:
+        try:
+            parsed = json.loads(fix_attempt(content))
+            if isinstance(parsed, list):
+                return finish(parsed)
+        except Exception:
+            pass
+    return None
+
+
+def new_extract(content):
+    parsed = extract_json_array(content)
+    if parsed is None:
+        return None
+    return [normalize_recommendation(item) if isinstance(item, dict) else item for item in parsed]
+
+
+def time_call(fn, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            fn(content)
+        except Exception:
+            pass
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 提取速度与结果一致性对比")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    total_legacy = total_new = 0.0
+    mismatches = 0
+    print(f"{'case':<24}{'chars':>7}{'legacy us':>11}{'new us':>9}  result")
+    for case in corpus:
+        content = case["content"]
+        try:
+            legacy = legacy_extract(content)
+        except Exception as e:
+            legacy = e
+        new = new_extract(content)
+
+        if isinstance(legacy, Exception):
+            verdict = f"legacy raised {type(legacy).__name__}, new {'ok' if new is not None else 'none'}"
+        elif legacy is None:
+            verdict = "recovered" if new is not None else "both none"
+        elif legacy == new:
+            verdict = "identical"
+        else:
+            verdict = "MISMATCH"
+            mismatches += 1
+
+        legacy_us = time_call(legacy_extract, content, args.repeat)
+        new_us = time_call(new_extract, content, args.repeat)
+        total_legacy += legacy_us
+        total_new += new_us
+        print(f"{case['name']:<24}{len(content):>7}{legacy_us:>11.1f}{new_us:>9.1f}  {verdict}")
+
+    print(f"\ntotal: legacy {total_legacy:.1f} us, new {total_new:.1f} us "
+          f"({total_legacy / total_new:.1f}x), mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""HTTP 服务压测：本地桩服务模拟 Nexar 与 DeepSeek，完全离线运行
+
+在进程内启动 Nexar / DeepSeek 桩服务与 service.BomService，多个客户端线程并发调用同步接口
+（替代方案、元器件识别、小批量风险评估，型号在 --parts 个中随机选取，可观察缓存与请求合并的效果），
+最后提交一个异步风险评估任务并轮询到完成：
+    python -m benchmarks.bench_service --requests 400 --concurrency 32 --parts 100 --job-parts 500
+
+缓存与任务队列数据库写入临时目录，不影响仓库中的 cache/ 与 jobs.sqlite3。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def http(method, url, payload=None, timeout=120):
+    """返回 (状态码, 响应JSON, 耗时秒)"""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    elapsed = time.perf_counter() - start
+    try:
+        return status, json.loads(body or b"{}"), elapsed
+    except ValueError:
+        return status, {}, elapsed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def make_request(base_url, mpns, rng):
+    """按 6:3:1 的比例生成替代方案 / 元器件识别 / 风险评估请求"""
+    roll = rng.random()
+    if roll < 0.6:
+        return "alternatives", f"{base_url}/api/alternatives", {"part_number": rng.choice(mpns)}
+    if roll < 0.9:
+        return "identify", f"{base_url}/api/identify", {"mpn": rng.choice(mpns)}
+    components = [{"mpn": mpn} for mpn in rng.sample(mpns, min(10, len(mpns)))]
+    return "risk", f"{base_url}/api/risk", {"components": components}
+
+
+def run_load(base_url, mpns, total, concurrency, seed):
+    rng = random.Random(seed)
+    requests = [make_request(base_url, mpns, rng) for _ in range(total)]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+
+    def send(item):
+        endpoint, url, payload = item
+        status, _, elapsed = http("POST", url, payload)
+        with lock:
+            statuses[endpoint][status] += 1
+            if status == 200:
+                latencies[endpoint].append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, requests))
+    return time.perf_counter() - start, latencies, statuses
+
+
+def run_job(base_url, count, poll_interval=0.2):
+    components = [{"mpn": f"JOB{i:05d}", "name": "MCU"} for i in range(count)]
+    start = time.perf_counter()
+    status, job, _ = http("POST", f"{base_url}/api/jobs", {"task": "risk", "components": components})
+    if status != 202:
+        return None, job
+    polls = 0
+    while job.get("status") in ("queued", "running"):
+        time.sleep(poll_interval)
+        _, job, _ = http("GET", f"{base_url}/api/jobs/{job['job_id']}")
+        polls += 1
+    _, result, _ = http("GET", f"{base_url}/api/jobs/{job['job_id']}/result")
+    return time.perf_counter() - start, dict(job, polls=polls, results=len(result.get("results") or {}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 服务压测（本地桩服务）")
+    parser.add_argument("--requests", type=int, default=400, help="同步请求总数")
+    parser.add_argument("--concurrency", type=int, default=32, help="客户端并发数")
+    parser.add_argument("--parts", type=int, default=100, help="随机选取的不同型号数")
+    parser.add_argument("--job-parts", type=int, default=500, help="异步风险评估任务的元器件数（0 表示跳过）")
+    parser.add_argument("--deepseek-latency", type=float, default=0.3)
+    parser.add_argument("--nexar-latency", type=float, default=0.05)
+    parser.add_argument("--rpm", type=int, default=6000, help="DeepSeek 限流器的每分钟请求数")
+    parser.add_argument("--workers", type=int, default=16, help="服务工作线程数（SERVICE_MAX_WORKERS）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # 限流器、工作线程池等在导入时读取环境变量
+    os.environ.update({"DEEPSEEK_API_KEY": "bench", "DEEPSEEK_RPM": str(args.rpm), "DEEPSEEK_TPM": str(args.rpm * 2000),
+                       "SERVICE_MAX_WORKERS": str(args.workers)})
+    from benchmarks.stub_deepseek_server import run_stub_deepseek_server
+    from benchmarks.stub_nexar_server import run_stub_nexar_server
+
+    with run_stub_nexar_server(latency=args.nexar_latency) as nexar_stub, \
+            run_stub_deepseek_server(latency=args.deepseek_latency) as deepseek_stub, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["JOB_DB_PATH"] = os.path.join(cache_dir, "jobs.sqlite3")
+        import backend
+        import jobqueue
+        import service
+        from cache_manager import PartCache
+        from circuit_breaker import nexar_breaker
+        from nexarClient import NexarClient
+
+        backend.DEEPSEEK_API_KEY = "bench"
+        backend.DEEPSEEK_BASE_URL = deepseek_stub.base_url
+        backend._nexar_client = NexarClient("bench", "bench", pool_size=args.workers, url=nexar_stub.graphql_url,
+                                            token_url=nexar_stub.token_url, circuit_breaker=nexar_breaker)
+        backend.part_cache = PartCache(cache_dir=cache_dir)
+
+        queue = jobqueue.get_job_queue()
+        server = service.BomService(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            mpns = [f"STM32F{i:04d}" for i in range(args.parts)]
+            elapsed, latencies, statuses = run_load(server.base_url, mpns, args.requests, args.concurrency, args.seed)
+            ok = sum(len(values) for values in latencies.values())
+            print(f"sync: {args.requests} requests, concurrency {args.concurrency}, {args.parts} distinct parts "
+                  f"-> {elapsed:.2f}s, {ok / elapsed:.1f} ok req/s")
+            for endpoint in ("alternatives", "identify", "risk"):
+                values = latencies.get(endpoint) or [0.0]
+                print(f"  {endpoint:<13} {dict(statuses[endpoint])}  p50 {statistics.median(values) * 1000:.0f} ms"
+                      f"  p95 {percentile(values, 0.95) * 1000:.0f} ms  p99 {percentile(values, 0.99) * 1000:.0f} ms")
+
+            if args.job_parts:
+                job_elapsed, job = run_job(server.base_url, args.job_parts)
+                if job_elapsed is None:
+                    print(f"job: submit failed: {job}")
+                else:
+                    print(f"job: {job['status']} {job['results']}/{job['total']} parts in {job_elapsed:.2f}s "
+                          f"({job['total'] / job_elapsed:.1f} parts/s, {job['polls']} polls, "
+                          f"{(job['stats'] or {}).get('requests')} DeepSeek requests)")
+
+            print(f"service workers: {service._pool.snapshot()}")
+            print(f"upstream requests: deepseek {deepseek_stub.stats['requests']}, nexar {nexar_stub.stats['requests']}")
+            print(f"coalescing: {backend.get_coalescing_stats()}")
+        finally:
+            server.shutdown()
+            server.server_close()
+            queue.stop()
+
+
+if __name__ == "__main__":
+    main()
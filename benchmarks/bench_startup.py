@@ -0,0 +1,70 @@
+"""测量应用冷启动耗时：导入 run（frontend + backend）以及首次渲染完成的时间
+
+每轮在新的 Python 进程中运行，完全离线（使用占位的 API 密钥，令牌地址指向不可达的本地端口），
+同时检查启动过程中没有创建客户端、没有获取 Nexar 令牌、没有导入 openai / pandas / openpyxl：
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行：计时导入与首次渲染，并输出一行JSON
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import run
+imported = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("run.py", default_timeout=60)
+app.run()
+rendered = time.perf_counter()
+import backend
+print(json.dumps({
+    "import_s": imported - start,
+    "first_render_s": rendered - imported,
+    "total_s": rendered - start,
+    "exceptions": [e.value for e in app.exception],
+    "clients_created": [name for name in ("_deepseek_client", "_nexar_client") if getattr(backend, name) is not None],
+    "heavy_modules": [name for name in ("openai", "pandas", "openpyxl") if name in sys.modules],
+}))
+'''
+
+
+def run_once():
+    env = dict(os.environ)
+    env.update({
+        "DEEPSEEK_API_KEY": env.get("DEEPSEEK_API_KEY") or "bench",
+        "NEXAR_CLIENT_ID": env.get("NEXAR_CLIENT_ID") or "bench",
+        "NEXAR_CLIENT_SECRET": env.get("NEXAR_CLIENT_SECRET") or "bench",
+        # 启动时若访问网络会立即失败并体现在结果中
+        "HTTPS_PROXY": "http://127.0.0.1:9",
+        "HTTP_PROXY": "http://127.0.0.1:9",
+    })
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用冷启动（导入到首次渲染）耗时")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    for key, label in (("import_s", "import run"), ("first_render_s", "first render"), ("total_s", "total")):
+        values = [result[key] for result in results]
+        print(f"{label:<13} median {statistics.median(values):.3f}s  min {min(values):.3f}s  max {max(values):.3f}s")
+    last = results[-1]
+    print(f"clients created at startup: {last['clients_created'] or 'none'}")
+    print(f"heavy modules imported at startup: {last['heavy_modules'] or 'none'}")
+    if last["exceptions"]:
+        print(f"render exceptions: {last['exceptions']}")
+
+
+if __name__ == "__main__":
+    main()
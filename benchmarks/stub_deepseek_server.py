@@ -0,0 +1,193 @@
+"""本地 DeepSeek 桩服务（离线测试与压测用）
+
+模拟 OpenAI 兼容的 /chat/completions 接口：按提示词模板识别调用类型
+（替代方案 / 风险评估 / 批量风险评估 / 元器件识别 / 对话），返回结构合法的固定内容，
+并可注入延迟与错误率。支持 stream=True（按 SSE 分块返回）。
+
+用法（在仓库根目录）：
+    python -m benchmarks.stub_deepseek_server --port 8766 --latency 0.5
+
+或在代码中作为夹具使用：
+    with run_stub_deepseek_server(latency=0.5) as stub:
+        client = OpenAI(api_key="stub", base_url=stub.base_url)
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_recommendations(mpn):
+    brands = (("GigaDevice", "国产"), ("WCH", "国产"), ("Texas Instruments", "进口"))
+    return {"recommendations": [
+        {"model": f"{brand.split()[0][:3].upper()}-{mpn}-{i}", "brand": brand, "category": "MCU", "package": "LQFP48",
+         "parameters": "72MHz, 64KB Flash", "type": origin, "pinToPin": i == 1,
+         "datasheet": "https://example.com/datasheet.pdf", "price": "¥5-¥8"}
+        for i, (brand, origin) in enumerate(brands, 1)
+    ]}
+
+
+def make_risk(mpn):
+    # 按型号固定返回（同一型号多次查询结果一致）
+    discontinued = sum(map(ord, mpn)) % 5 == 0
+    return {"mpn": mpn, "status": "已停产" if discontinued else "未停产",
+            "eol_year": "2024" if discontinued else "无计划", "description": "桩服务生成的评估结果"}
+
+
+def make_component_info(mpn):
+    return {"mpn": mpn, "manufacturer": "STMicroelectronics", "category": "MCU", "package": "LQFP48",
+            "parameters": {"内核": "Cortex-M3", "Flash": "64KB"}, "price": "¥8-¥12", "status": "量产中",
+            "leadTime": "8周", "pin_compatible": "未知"}
+
+
+def _batch_mpns(text):
+    """批量风险评估的输入（"共 N 个元器件：" 之后）每行一个 {"mpn": ...} 对象"""
+    mpns = []
+    for line in text.partition("个元器件：")[2].splitlines():
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(item, dict) and item.get("mpn"):
+            mpns.append(item["mpn"])
+    return mpns
+
+
+def build_content(messages):
+    """根据 system/user 消息判断调用类型并生成回复内容"""
+    text = "\n".join(str(message.get("content", "")) for message in messages)
+    user = str(messages[-1].get("content", "")) if messages else ""
+    if '"results"' in text:
+        return json.dumps({"results": [make_risk(mpn) for mpn in _batch_mpns(user)]}, ensure_ascii=False)
+    if '"recommendations"' in text:
+        match = re.search(r"(?:输入元器件型号|元器件型号)[:：]\s*(\S+)", user)
+        return json.dumps(make_recommendations(match.group(1) if match else "PART"), ensure_ascii=False)
+    if '"eol_year"' in text:
+        match = re.search(r"待评估元器件：(\S+?)（", user)
+        return json.dumps(make_risk(match.group(1) if match else "PART"), ensure_ascii=False)
+    if '"manufacturer"' in text:
+        match = re.search(r"元器件型号[:：]\s*(\S+)", user)
+        return json.dumps(make_component_info(match.group(1) if match else "PART"), ensure_ascii=False)
+    return "这是桩服务的回复。"
+
+
+class StubDeepSeekHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pieces = [content[i:i + 40] for i in range(0, len(content), 40)] or [""]
+        for i, piece in enumerate(pieces):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "deepseek-chat",
+                     "choices": [{"index": 0, "delta": {"content": piece},
+                                  "finish_reason": "stop" if i == len(pieces) - 1 else None}]}
+            if i == len(pieces) - 1:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            with server.stats_lock:
+                server.stats["injected_errors"] += 1
+            self._send_json(503, {"error": {"message": "injected failure"}})
+            return
+
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON body"}})
+            return
+        messages = payload.get("messages") or []
+        content = build_content(messages)
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 2
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 2,
+                 "total_tokens": prompt_tokens + len(content) // 2}
+        if payload.get("stream"):
+            self._send_stream(content, usage)
+            return
+        self._send_json(200, {
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "deepseek-chat",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+
+class StubDeepSeekServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        super().__init__((host, port), StubDeepSeekHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "injected_errors": 0}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+@contextmanager
+def run_stub_deepseek_server(latency=0.0, error_rate=0.0, port=0):
+    """在后台线程中启动桩服务，退出上下文时关闭"""
+    server = StubDeepSeekServer(port=port, latency=latency, error_rate=error_rate)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 DeepSeek 桩服务")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回503的比例")
+    args = parser.parse_args()
+
+    server = StubDeepSeekServer(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Stub DeepSeek server listening on {server.base_url} (set DEEPSEEK_BASE_URL to this address)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""本地 Nexar 桩服务（离线测试与压测用）
+
+模拟 identity.nexar.com 的 /connect/token 与 api.nexar.com 的 /graphql 两个接口，
+按请求中的型号生成固定结构的 supSearchMpn 响应，并可注入延迟与错误率。
+
+用法（在仓库根目录）：
+    python -m benchmarks.stub_nexar_server --port 8765 --latency 0.05
+
+或在代码中作为夹具使用：
+    with run_stub_nexar_server(latency=0.05) as stub:
+        client = NexarClient("id", "secret", url=stub.graphql_url, token_url=stub.token_url)
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_fake_jwt(lifetime=3600):
+    """生成只包含 exp 字段的假JWT（decodeJWT 只解析 payload）"""
+    payload = json.dumps({"exp": int(time.time()) + lifetime}).encode("utf-8")
+    encoded = base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+    return f"stub.{encoded}.signature"
+
+
+def make_part(mpn):
+    """为型号生成一条结构与 QUERY_ALTERNATIVE_PARTS 一致的假数据"""
+    return {
+        "mpn": mpn,
+        "manufacturer": {"name": "STMicroelectronics"},
+        "specs": [
+            {"attribute": {"name": "package"}, "value": "LQFP48"},
+            {"attribute": {"name": "category"}, "value": "MCU"},
+        ],
+        "medianPrice1000": {"price": 1.85, "currency": "USD"},
+        "bestImage": {"url": "https://example.com/image.png"},
+        "estimatedFactoryLeadDays": 56,
+        "similarParts": [
+            {
+                "name": f"GigaDevice GD32 {mpn}",
+                "mpn": f"GD32-{mpn}",
+                "manufacturer": {"name": "GigaDevice"},
+                "medianPrice1000": {"price": 1.2, "currency": "USD"},
+                "octopartUrl": f"https://octopart.com/gd32-{mpn.lower()}",
+                "estimatedFactoryLeadDays": 28,
+            },
+            {
+                "name": f"WCH CH32 {mpn}",
+                "mpn": f"CH32-{mpn}",
+                "manufacturer": {"name": "WCH"},
+                "medianPrice1000": {"price": 0.9, "currency": "USD"},
+                "octopartUrl": f"https://octopart.com/ch32-{mpn.lower()}",
+                "estimatedFactoryLeadDays": 21,
+            },
+        ],
+    }
+
+
+def build_graphql_data(query, variables):
+    """根据查询中的字段别名生成响应：支持单个 supSearchMpn 以及 alias: supSearchMpn(q: $qN) 形式的批量查询"""
+    aliases = re.findall(r"(\w+)\s*:\s*supSearchMpn\s*\(\s*q\s*:\s*\$(\w+)", query)
+    if not aliases:
+        aliases = [("supSearchMpn", "q")]
+    data = {}
+    for alias, variable_name in aliases:
+        mpn = str(variables.get(variable_name, "")).strip()
+        results = [{"part": make_part(mpn)}] if mpn else []
+        data[alias] = {"hits": len(results), "results": results}
+    return data
+
+
+class StubNexarHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，便于测试连接池
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        if self.path.startswith("/connect/token"):
+            with server.stats_lock:
+                server.stats["token_requests"] += 1
+            self._send_json(200, {"access_token": make_fake_jwt(server.token_lifetime), "expires_in": server.token_lifetime})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            with server.stats_lock:
+                server.stats["injected_errors"] += 1
+            self._send_json(503, {"error": "injected failure"})
+            return
+
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"errors": [{"message": "invalid JSON body"}]})
+            return
+        data = build_graphql_data(payload.get("query", ""), payload.get("variables") or {})
+        self._send_json(200, {"data": data})
+
+
+class StubNexarServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认 listen 队列只有 5，压测时几十个连接同时建立会溢出并触发 1 秒的 SYN 重传
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, token_lifetime=3600):
+        super().__init__((host, port), StubNexarHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.stats = {"requests": 0, "token_requests": 0, "injected_errors": 0}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def graphql_url(self):
+        return f"{self.base_url}/graphql"
+
+    @property
+    def token_url(self):
+        return f"{self.base_url}/connect/token"
+
+
+@contextmanager
+def run_stub_nexar_server(latency=0.0, error_rate=0.0, token_lifetime=3600, port=0):
+    """在后台线程中启动桩服务，退出上下文时关闭"""
+    server = StubNexarServer(port=port, latency=latency, error_rate=error_rate, token_lifetime=token_lifetime)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Nexar 桩服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="每个GraphQL请求的模拟延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回503的比例")
+    args = parser.parse_args()
+
+    server = StubNexarServer(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Stub Nexar server listening on {server.base_url} (graphql: {server.graphql_url}, token: {server.token_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
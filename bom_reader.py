@@ -0,0 +1,204 @@
+"""BOM文件的流式读取
+
+直接从上传的文件缓冲区逐行读取（CSV按块读取，.xlsx 使用 openpyxl 只读模式），
+只用前若干行识别型号/名称/描述列，元器件边读边去重，不把整张表载入内存，
+也不再写临时文件。一次读取同时得到预览行与元器件列表。
+"""
+import os
+import re
+
+# 预览显示的最大行数
+BOM_PREVIEW_ROWS = int(os.getenv("BOM_PREVIEW_ROWS", "200"))
+# 用于识别关键列的样本行数
+BOM_SAMPLE_ROWS = 100
+# CSV 每次读取的行数
+CSV_CHUNK_ROWS = 5000
+
+MPN_KEYWORDS = ['mpn', 'part', 'part_number', 'part number', 'partnumber', '型号', '规格型号', '器件型号']
+NAME_KEYWORDS = ['name', 'component', 'component_name', '名称', '元件名称', '器件名称']
+DESC_KEYWORDS = ['description', 'desc', '描述', '规格', '说明', '特性']
+
+_MPN_PATTERN = re.compile(r'[A-Za-z].*\d|\d.*[A-Za-z]')
+
+
+class BomData:
+    """一次读取BOM文件的结果"""
+
+    def __init__(self, columns, preview_rows, components, columns_info, total_rows):
+        self.columns = columns
+        self.preview_rows = preview_rows
+        self.components = components
+        self.columns_info = columns_info
+        self.total_rows = total_rows
+
+    def preview_dataframe(self):
+        """返回预览行的 DataFrame"""
+        import pandas as pd
+        return pd.DataFrame(self.preview_rows, columns=self.columns)
+
+
+def _cell_text(value):
+    """单元格内容转为去除首尾空白的字符串，空值返回空字符串"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value != value:  # NaN
+        return ''
+    return str(value).strip()
+
+
+def _header_names(header):
+    """生成列名，空表头按 pandas 的习惯命名为 Unnamed: N"""
+    return [_cell_text(name) or f"Unnamed: {i}" for i, name in enumerate(header)]
+
+
+def _iter_csv_rows(file_obj):
+    import pandas as pd
+
+    reader = pd.read_csv(file_obj, chunksize=CSV_CHUNK_ROWS, dtype=str)
+    first_chunk = next(reader, None)
+    if first_chunk is None:
+        return [], iter(())
+    columns = [str(col) for col in first_chunk.columns]
+
+    def rows():
+        for chunk in ([first_chunk], reader):
+            for df in chunk:
+                yield from df.itertuples(index=False, name=None)
+    return columns, rows()
+
+
+def _iter_xlsx_rows(file_obj):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    row_iter = sheet.iter_rows(values_only=True)
+    header = next(row_iter, None)
+    if header is None:
+        workbook.close()
+        return [], iter(())
+
+    def rows():
+        try:
+            for row in row_iter:
+                # 只读模式下表格末尾常有整行为空的记录
+                if any(value is not None for value in row):
+                    yield row
+        finally:
+            workbook.close()
+    return _header_names(header), rows()
+
+
+def _iter_xls_rows(file_obj):
+    # 旧版 .xls 格式无法流式读取，由 xlrd 整表载入后逐行返回
+    import pandas as pd
+
+    df = pd.read_excel(file_obj, engine='xlrd', dtype=str)
+    return [str(col) for col in df.columns], df.itertuples(index=False, name=None)
+
+
+def iter_bom_rows(file_obj, filename):
+    """返回 (列名列表, 数据行迭代器)，每行为按列顺序排列的元组"""
+    if hasattr(file_obj, "seek"):
+        file_obj.seek(0)
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext == '.csv':
+        return _iter_csv_rows(file_obj)
+    if file_ext == '.xlsx':
+        return _iter_xlsx_rows(file_obj)
+    if file_ext == '.xls':
+        return _iter_xls_rows(file_obj)
+    raise ValueError(f"不支持的文件格式: {file_ext}")
+
+
+def detect_bom_columns(columns, sample_rows):
+    """根据列名与样本行识别型号列、名称列、描述列，返回各列下标（未识别为 None）"""
+    mpn_columns = []
+    name_columns = []
+    desc_columns = []
+
+    # 遍历所有列，尝试匹配关键词
+    for idx, col in enumerate(columns):
+        col_lower = str(col).lower()
+        if any(keyword in col_lower for keyword in MPN_KEYWORDS):
+            mpn_columns.append(idx)
+        if any(keyword in col_lower for keyword in NAME_KEYWORDS):
+            name_columns.append(idx)
+        if any(keyword in col_lower for keyword in DESC_KEYWORDS):
+            desc_columns.append(idx)
+
+    # 如果没有找到明确的列，从样本中查找值像型号（字母与数字组合）的列
+    if not mpn_columns:
+        for idx in range(len(columns)):
+            sample_values = [_cell_text(row[idx]) for row in sample_rows if idx < len(row)]
+            sample_values = [val for val in sample_values if val][:5]
+            if sample_values and all(_MPN_PATTERN.search(val) for val in sample_values):
+                mpn_columns.append(idx)
+
+    mpn_idx = mpn_columns[0] if mpn_columns else None
+    name_idx = name_columns[0] if name_columns else None
+    desc_idx = desc_columns[0] if desc_columns else None
+
+    # 如果没有找到任何列，使用前几列
+    if mpn_idx is None and len(columns) >= 1:
+        mpn_idx = 0
+    if name_idx is None and len(columns) >= 2:
+        name_idx = 1
+    if desc_idx is None and len(columns) >= 3:
+        desc_idx = 2
+    return mpn_idx, name_idx, desc_idx
+
+
+def iter_bom_components(rows, mpn_idx, name_idx=None, desc_idx=None, seen_mpns=None):
+    """逐行生成去重后的元器件 {"mpn", "name", "description"}，没有型号的行跳过"""
+    seen_mpns = set() if seen_mpns is None else seen_mpns
+    if mpn_idx is None:
+        return
+
+    def cell(row, idx):
+        return _cell_text(row[idx]) if idx is not None and idx < len(row) else ''
+
+    for row in rows:
+        mpn = cell(row, mpn_idx)
+        if not mpn or mpn in seen_mpns:
+            continue
+        seen_mpns.add(mpn)
+        yield {
+            'mpn': mpn,
+            'name': cell(row, name_idx),
+            'description': cell(row, desc_idx),
+        }
+
+
+def read_bom(file_obj, filename, preview_rows=BOM_PREVIEW_ROWS):
+    """读取一次BOM文件，同时得到预览行、去重后的元器件列表和识别出的列"""
+    columns, rows = iter_bom_rows(file_obj, filename)
+
+    # 先缓存样本行用于识别关键列，之后与剩余行一起处理
+    sample = []
+    for row in rows:
+        sample.append(row)
+        if len(sample) >= max(BOM_SAMPLE_ROWS, preview_rows):
+            break
+    mpn_idx, name_idx, desc_idx = detect_bom_columns(columns, sample[:BOM_SAMPLE_ROWS])
+
+    total_rows = len(sample)
+
+    def all_rows():
+        nonlocal total_rows
+        yield from sample
+        for row in rows:
+            total_rows += 1
+            yield row
+
+    components = list(iter_bom_components(all_rows(), mpn_idx, name_idx, desc_idx))
+
+    def column_name(idx):
+        return columns[idx] if idx is not None else None
+
+    columns_info = {
+        'mpn_column': column_name(mpn_idx),
+        'name_column': column_name(name_idx),
+        'description_column': column_name(desc_idx)
+    }
+    return BomData(columns, sample[:preview_rows], components, columns_info, total_rows)
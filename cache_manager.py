@@ -0,0 +1,262 @@
+"""元器件查询结果的持久化缓存
+
+缓存文件保存在 cache/ 目录下，每个条目一个 pickle 文件，内容格式为：
+    {"part_number": ..., "data": ..., "timestamp": ..., "expiry": ...}
+替代方案（alternatives 命名空间）的文件名沿用原有规则 md5(型号小写)，
+因此目录中已有的缓存文件可以直接读取，无需迁移。
+"""
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+# 默认有效期3天，与 cache/ 目录中已有条目保持一致
+DEFAULT_TTL = int(os.getenv("CACHE_TTL_SECONDS", str(3 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2000"))
+# 过期条目继续保留的时长，上游熔断时可作为兜底数据返回，默认30天
+STALE_TTL = int(os.getenv("CACHE_STALE_SECONDS", str(30 * 24 * 3600)))
+
+# 旧版缓存文件没有命名空间字段，均视为替代方案查询结果
+LEGACY_NAMESPACE = "alternatives"
+
+
+def normalize_part_number(part_number):
+    """统一型号格式（去除首尾空白并转为小写），作为缓存键"""
+    return str(part_number or "").strip().lower()
+
+
+class PartCache:
+    """带过期时间和LRU淘汰的两级缓存（进程内存 + 磁盘pickle）
+
+    同一进程内的多个Streamlit会话共享一个实例，通过锁保证线程安全；
+    写入磁盘时先写临时文件再原子替换，多个进程同时读写也不会读到半个文件。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # 文件名 -> 缓存条目，按最近访问排序
+        self._stats = {}
+        self._loaded = False
+
+    # ---------- 内部工具 ----------
+    def _file_key(self, namespace, part_number):
+        normalized = normalize_part_number(part_number)
+        raw = normalized if namespace == LEGACY_NAMESPACE else f"{namespace}:{normalized}"
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, file_key):
+        return os.path.join(self.cache_dir, f"{file_key}.pkl")
+
+    def _count(self, namespace, field):
+        ns_stats = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "expired": 0, "stale_hits": 0,
+                                                      "writes": 0, "evictions": 0})
+        ns_stats[field] += 1
+
+    def _read_file(self, file_key):
+        """读取单个缓存文件，文件损坏时直接删除"""
+        path = self._path(file_key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self._remove_file(file_key)
+            return None
+        if not isinstance(entry, dict) or "data" not in entry or "expiry" not in entry:
+            self._remove_file(file_key)
+            return None
+        if "namespace" not in entry:
+            # 旧版缓存文件（随仓库提交的数据）：只作读取，不因过期或淘汰而删除
+            entry["namespace"] = LEGACY_NAMESPACE
+            entry["legacy"] = True
+        return entry
+
+    def _remove_file(self, file_key):
+        try:
+            os.unlink(self._path(file_key))
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """首次访问时扫描缓存目录，按写入时间建立LRU顺序"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.cache_dir):
+            return
+        now = time.time()
+        loaded = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".pkl"):
+                continue
+            file_key = filename[:-4]
+            entry = self._read_file(file_key)
+            if entry is None:
+                continue
+            if entry["expiry"] + STALE_TTL <= now and not entry.get("legacy"):
+                self._remove_file(file_key)
+                continue
+            loaded.append((entry.get("timestamp", 0), file_key, entry))
+        for _, file_key, entry in sorted(loaded, key=lambda item: item[0]):
+            self._entries[file_key] = entry
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            file_key, entry = self._entries.popitem(last=False)
+            if not entry.get("legacy"):
+                self._remove_file(file_key)
+            self._count(entry.get("namespace", LEGACY_NAMESPACE), "evictions")
+
+    # ---------- 对外接口 ----------
+    def get(self, namespace, part_number, allow_stale=False):
+        """读取缓存，未命中或已过期时返回 None（返回值为深拷贝，可放心修改）
+
+        allow_stale=True 时返回已过期的条目（上游熔断时作为兜底数据），不计入命中统计。
+        过期条目保留到被 LRU 淘汰、被新结果覆盖或过期超过 STALE_TTL 为止；旧版缓存文件不会被删除。
+        """
+        file_key = self._file_key(namespace, part_number)
+        with self._lock:
+            self._load_index()
+            entry = self._entries.get(file_key)
+            if entry is None:
+                # 其他进程可能已写入磁盘
+                entry = self._read_file(file_key)
+                if entry is not None:
+                    self._entries[file_key] = entry
+            if entry is not None and not entry.get("legacy") and entry["expiry"] + STALE_TTL <= time.time():
+                self._entries.pop(file_key, None)
+                self._remove_file(file_key)
+                entry = None
+            if entry is None:
+                if not allow_stale:
+                    self._count(namespace, "misses")
+                return None
+            if allow_stale:
+                self._count(namespace, "stale_hits")
+                return copy.deepcopy(entry["data"])
+            if entry["expiry"] <= time.time():
+                self._count(namespace, "expired")
+                self._count(namespace, "misses")
+                return None
+            self._entries.move_to_end(file_key)
+            self._count(namespace, "hits")
+            return copy.deepcopy(entry["data"])
+
+    def set(self, namespace, part_number, data, ttl=None):
+        """写入缓存（内存 + 磁盘原子写入）"""
+        file_key = self._file_key(namespace, part_number)
+        now = time.time()
+        entry = {
+            "part_number": normalize_part_number(part_number),
+            "data": copy.deepcopy(data),
+            "timestamp": now,
+            "expiry": now + (self.ttl if ttl is None else ttl),
+            "namespace": namespace,
+        }
+        with self._lock:
+            self._load_index()
+            self._entries[file_key] = entry
+            self._entries.move_to_end(file_key)
+            self._count(namespace, "writes")
+            self._evict()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(entry, f)
+                os.replace(tmp_path, self._path(file_key))
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except Exception:
+            # 磁盘不可写时仍保留内存缓存
+            pass
+
+    def contains(self, namespace, part_number):
+        """是否有未过期的缓存条目（不计入命中统计，也不改变LRU顺序）"""
+        file_key = self._file_key(namespace, part_number)
+        with self._lock:
+            self._load_index()
+            entry = self._entries.get(file_key)
+            if entry is None:
+                entry = self._read_file(file_key)
+            return entry is not None and entry["expiry"] > time.time()
+
+    def invalidate(self, namespace, part_number):
+        """删除指定型号的缓存条目"""
+        file_key = self._file_key(namespace, part_number)
+        with self._lock:
+            self._entries.pop(file_key, None)
+            self._remove_file(file_key)
+
+    def stats(self):
+        """返回各命名空间的命中/未命中统计"""
+        with self._lock:
+            result = {namespace: dict(values) for namespace, values in self._stats.items()}
+            for values in result.values():
+                lookups = values["hits"] + values["misses"]
+                values["hit_rate"] = round(values["hits"] / lookups, 3) if lookups else 0.0
+            result["__size__"] = len(self._entries)
+            return result
+
+
+# 进程级共享的缓存实例
+part_cache = PartCache()
+
+
+class ResponseStore:
+    """短期的进程内响应存储（不落盘）
+
+    用于让同一次查询中的多个函数共享一份上游响应，例如
+    identify_component 与 get_nexar_alternatives 共享一次 Nexar 查询。
+    存入的对象由调用方按只读方式使用。
+    """
+
+    def __init__(self, ttl=600, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 规范化型号 -> (过期时间, 响应)
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, part_number):
+        key = normalize_part_number(part_number)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= time.time():
+                self._entries.pop(key, None)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return item[1]
+
+    def set(self, part_number, value):
+        key = normalize_part_number(part_number)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, part_number):
+        """删除指定型号的共享响应"""
+        key = normalize_part_number(part_number)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
@@ -0,0 +1,122 @@
+"""专家对话的上下文管理：按token预算保留最近的对话，较早的对话替换为滚动摘要
+
+每轮发送的消息为：system 提示词（静态前缀）+ 较早对话的摘要 + 最近的对话原文 + 当前问题，
+估算的token数不超过 CHAT_CONTEXT_BUDGET。
+摘要在后台线程中以 BATCH 优先级增量生成（已有摘要 + 新移出预算的对话 → 新摘要）并缓存，
+不占用当前回复的等待时间；摘要尚未覆盖的较早对话在本轮中暂时省略，下一轮即可使用新摘要。
+每轮的提示词token数（估算值，以及流式响应 usage 中的实际值）记录在 ChatContext.turns 中。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import estimate_tokens
+
+# 每轮提示词的token预算（估算值，包含 system 提示词与当前问题）
+CHAT_CONTEXT_BUDGET = int(os.getenv("CHAT_CONTEXT_BUDGET", "6000"))
+# 摘要调用的最大输出token数
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "600"))
+# 只保留最近若干轮的统计
+MAX_TURN_RECORDS = 50
+
+SUMMARY_HEADER = "此前对话摘要（较早的对话已压缩）："
+
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+def _message_tokens(message):
+    return estimate_tokens([message])
+
+
+def format_transcript(messages):
+    """把对话消息转换为摘要调用的输入文本"""
+    labels = {"user": "用户", "assistant": "助手"}
+    return "\n".join(f"{labels.get(m['role'], m['role'])}：{m['content']}" for m in messages)
+
+
+class ChatContext:
+    """一个会话的对话上下文（保存在 st.session_state 中，清除对话时一并重建）
+
+    summarize 为 summarize(previous_summary, messages) -> str 的函数，在后台线程中调用。
+    """
+
+    def __init__(self, summarize, budget=CHAT_CONTEXT_BUDGET):
+        self._summarize = summarize
+        self.budget = budget
+        self.summary = ""
+        # 摘要已覆盖 history 的前 summarized_count 条消息
+        self.summarized_count = 0
+        self.turns = []
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def _split(self, system, history, user_input):
+        """返回最近对话的起始下标：从后往前保留原文直到预算用完，并从用户消息开始"""
+        used = estimate_tokens([{"content": system}, {"content": user_input}])
+        with self._lock:
+            used += _message_tokens({"content": self.summary}) if self.summary else 0
+        start = len(history)
+        while start > 0 and used + _message_tokens(history[start - 1]) <= self.budget:
+            start -= 1
+            used += _message_tokens(history[start])
+        if start == 0:
+            return 0
+        while start < len(history) and history[start]["role"] != "user":
+            start += 1
+        return start
+
+    def build_messages(self, system, history, user_input):
+        """生成本轮发送的消息列表，并在需要时于后台更新摘要
+
+        Returns:
+            (messages, turn)：turn 为本轮的统计记录，收到 usage 后由 record_usage 补充实际token数
+        """
+        start = self._split(system, history, user_input)
+        self._refresh_summary(history[:start])
+
+        with self._lock:
+            summary, summarized = self.summary, min(self.summarized_count, start)
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"})
+        messages.extend({"role": m["role"], "content": m["content"]} for m in history[start:])
+        messages.append({"role": "user", "content": user_input})
+
+        turn = {
+            "turn": len(self.turns) + 1,
+            "estimated_prompt_tokens": estimate_tokens(messages),
+            "prompt_tokens": None,
+            "recent_messages": len(history) - start,
+            "summarized_messages": summarized,
+            "omitted_messages": start - summarized,
+        }
+        self.turns.append(turn)
+        del self.turns[:-MAX_TURN_RECORDS]
+        return messages, turn
+
+    def _refresh_summary(self, older):
+        """较早的对话超出已有摘要的范围时，在后台增量生成新摘要（同一时间只有一个摘要任务）"""
+        with self._lock:
+            if len(older) <= self.summarized_count or (self._pending is not None and not self._pending.done()):
+                return
+            previous, covered = self.summary, self.summarized_count
+            new_messages = list(older[covered:])
+            self._pending = _summary_executor.submit(self._update_summary, previous, new_messages, len(older))
+
+    def _update_summary(self, previous, new_messages, count):
+        try:
+            summary = self._summarize(previous, new_messages)
+        except Exception:
+            # 摘要失败不影响对话，下一轮再尝试
+            return
+        if summary:
+            with self._lock:
+                self.summary = summary.strip()
+                self.summarized_count = count
+
+    @staticmethod
+    def record_usage(turn, usage):
+        """流式响应结束后记录实际的提示词token数"""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if prompt_tokens is not None:
+            turn["prompt_tokens"] = prompt_tokens
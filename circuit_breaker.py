@@ -0,0 +1,109 @@
+"""上游服务（Nexar / DeepSeek）的熔断器
+
+状态转换：
+- closed：正常放行，连续失败达到 failure_threshold 次后转为 open；
+- open：直接抛出 CircuitOpenError（快速失败，由调用方改用缓存数据或另一个服务的结果），
+  经过 recovery_timeout 秒后转为 half-open；
+- half-open：只放行 half_open_max_calls 个试探请求，成功则回到 closed，失败则重新 open。
+只有超时、连接错误、5xx 等说明上游异常的错误才计为失败，参数错误等不影响熔断状态。
+"""
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发送"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} 熔断中，{retry_in:.0f} 秒后重试")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """单个上游服务的熔断器，多个线程/会话共享"""
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def allows_request(self):
+        """当前是否会放行请求（不占用 half-open 的试探名额）"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls)
+
+    def before_call(self):
+        """请求发送前调用；熔断打开时抛出 CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return
+            self._stats["rejected"] += 1
+            retry_in = max(0.0, self.recovery_timeout - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats["opened"] += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._failures = 0
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            retry_in = max(0.0, self.recovery_timeout - (now - self._opened_at)) if state == OPEN else 0.0
+            return dict(self._stats, state=state, consecutive_failures=self._failures, retry_in=round(retry_in, 1))
+
+
+def _breaker_from_env(name, prefix):
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+        recovery_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET_SECONDS", "30")),
+    )
+
+
+# 进程级共享的熔断器
+nexar_breaker = _breaker_from_env("Nexar", "NEXAR")
+deepseek_breaker = _breaker_from_env("DeepSeek", "DEEPSEEK")
@@ -0,0 +1,198 @@
+"""命令行批量处理BOM（无需浏览器和 Streamlit 服务），用于夜间供应链任务
+
+    python cli.py BOM1.xlsx BOM2.csv --task risk alternatives --workers 8 --output-dir reports/
+    python cli.py BOM1.xlsx --resume        # 从上次中断处继续，已完成的元器件不再调用API
+
+每个BOM文件输出与"批量查询"标签页下载按钮相同布局的 Excel/CSV 文件：
+- risk：元器件风险评估结果_YYYYMMDD.xlsx / .csv
+- alternatives：元器件替代方案_YYYYMMDD.xlsx / .csv（get_alternatives_direct 的结果，每个方案一行）
+处理多个BOM文件时文件名前加BOM文件名。每个元器件的结果完成后即追加到检查点文件
+（输出目录下的 .<BOM文件名>.checkpoint.jsonl），--resume 时跳过其中已成功的元器件，
+失败的元器件重新处理。结束时输出吞吐量汇总。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import reports
+from bom_reader import read_bom
+
+TASKS = ("risk", "alternatives")
+
+
+class Checkpoint:
+    """按行追加的检查点文件：{"task": ..., "mpn": ..., "result": ..., "failed": ...}"""
+
+    def __init__(self, path, resume):
+        self.path = path
+        self.done = {task: {} for task in TASKS}
+        if resume and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中断时可能写了半行
+                        continue
+                    if not record.get("failed"):
+                        self.done[record["task"]][record["mpn"]] = record["result"]
+        elif os.path.exists(path):
+            os.remove(path)
+        self._lock = threading.Lock()
+
+    def record(self, task, mpn, result, failed=False):
+        line = json.dumps({"task": task, "mpn": mpn, "result": result, "failed": failed}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            if not failed:
+                self.done[task][mpn] = result
+
+
+class TaskStats:
+    def __init__(self, task, total):
+        self.task = task
+        self.total = total
+        self.resumed = 0
+        self.processed = 0
+        self.failed = 0
+        self.deepseek_requests = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        rate = self.processed / self.elapsed if self.elapsed > 0 else 0.0
+        line = (f"{self.task:<12} 共 {self.total} 个，跳过已完成 {self.resumed} 个，本次处理 {self.processed} 个"
+                f"（失败 {self.failed} 个），耗时 {self.elapsed:.1f} 秒，吞吐量 {rate:.2f} 个/秒")
+        if self.deepseek_requests:
+            line += f"，DeepSeek调用 {self.deepseek_requests} 次"
+        return line
+
+
+def run_risk(components, checkpoint, args, log):
+    """分块调用 batch_get_alternative_parts，每块完成后写入检查点"""
+    from backend import batch_get_alternative_parts
+
+    stats = TaskStats("risk", len(components))
+    pending = [c for c in components if c["mpn"] not in checkpoint.done["risk"]]
+    stats.resumed = len(components) - len(pending)
+    start = time.perf_counter()
+    for offset in range(0, len(pending), args.checkpoint_every):
+        chunk = pending[offset:offset + args.checkpoint_every]
+        results = batch_get_alternative_parts(chunk, max_workers=args.workers, risk_batch_size=args.risk_batch_size)
+        batch_stats = results.pop("__batch_stats__", {})
+        results.pop("__eol_warnings__", None)
+        stats.deepseek_requests += batch_stats.get("requests", 0)
+        for mpn, result in results.items():
+            failed = result.pop("failed", False)
+            checkpoint.record("risk", mpn, result, failed)
+            stats.failed += failed
+        stats.processed += len(chunk)
+        log.info("risk: %d/%d", stats.resumed + stats.processed, stats.total)
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def run_alternatives(components, checkpoint, args, log):
+    """并发调用 lookup_alternatives_direct（BATCH 优先级，不挤占交互查询的限流配额）"""
+    from backend import batch_lookup_alternatives_direct
+
+    stats = TaskStats("alternatives", len(components))
+    pending = [c for c in components if c["mpn"] not in checkpoint.done["alternatives"]]
+    stats.resumed = len(components) - len(pending)
+
+    def on_result(mpn, entry):
+        failed = entry.pop("failed")
+        checkpoint.record("alternatives", mpn, entry, failed)
+        stats.processed += 1
+        stats.failed += failed
+        if stats.processed % 10 == 0 or stats.processed == len(pending):
+            log.info("alternatives: %d/%d", stats.resumed + stats.processed, stats.total)
+
+    start = time.perf_counter()
+    batch_lookup_alternatives_direct(pending, max_workers=args.workers, on_result=on_result)
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def write_reports(task, components, checkpoint, output_dir, prefix, formats):
+    """按BOM中的顺序输出结果（失败的元器件不出现在文件中），返回写入的文件路径"""
+    done = checkpoint.done[task]
+    ordered = {c["mpn"]: done[c["mpn"]] for c in components if c["mpn"] in done}
+    if task == "risk":
+        rows, sheet, file_prefix = reports.risk_rows(ordered), reports.RISK_SHEET_NAME, reports.RISK_FILE_PREFIX
+    else:
+        rows = reports.alternatives_rows(ordered)
+        sheet, file_prefix = reports.ALTERNATIVES_SHEET_NAME, reports.ALTERNATIVES_FILE_PREFIX
+    if not rows:
+        return []
+    paths = []
+    for extension in formats:
+        path = os.path.join(output_dir, prefix + reports.report_filename(file_prefix, extension))
+        data = reports.excel_bytes(rows, sheet) if extension == "xlsx" else reports.csv_bytes(rows)
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def process_bom(path, args, log, multiple):
+    with open(path, "rb") as f:
+        bom = read_bom(f, os.path.basename(path))
+    components = bom.components
+    log.info("%s: 识别到 %d 个不同的元器件（型号列 %s）", path, len(components),
+             bom.columns_info.get("mpn_column", "未识别"))
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    checkpoint = Checkpoint(os.path.join(args.output_dir, f".{stem}.checkpoint.jsonl"), args.resume)
+    prefix = f"{stem}_" if multiple else ""
+    all_stats = []
+    for task in args.task:
+        runner = run_risk if task == "risk" else run_alternatives
+        all_stats.append(runner(components, checkpoint, args, log))
+        for written in write_reports(task, components, checkpoint, args.output_dir, prefix, args.format):
+            log.info("已写入 %s", written)
+    return all_stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="命令行批量处理BOM：停产风险评估与替代方案查询")
+    parser.add_argument("bom", nargs="+", help="BOM文件（.xlsx / .xls / .csv）")
+    parser.add_argument("--task", nargs="+", choices=TASKS, default=["risk"], help="要执行的任务（默认 risk）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_MAX_WORKERS", "8")), help="并发数")
+    parser.add_argument("--risk-batch-size", type=int, default=None,
+                        help="风险评估每次调用包含的元器件数（默认 RISK_BATCH_SIZE）")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="风险评估每处理多少个元器件写一次检查点")
+    parser.add_argument("--output-dir", default=".", help="输出目录（默认当前目录）")
+    parser.add_argument("--format", nargs="+", choices=("xlsx", "csv"), default=["xlsx", "csv"])
+    parser.add_argument("--resume", action="store_true", help="从检查点继续，跳过已成功处理的元器件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试信息（DeepSeek/Nexar 原始响应等）")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+
+    # 后端事件没有订阅者时写入 logging
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    log = logging.getLogger("bom_tool.cli")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    all_stats = []
+    for path in args.bom:
+        all_stats.extend(process_bom(path, args, log, multiple=len(args.bom) > 1))
+    elapsed = time.perf_counter() - start
+
+    print("\n吞吐量汇总：")
+    for stats in all_stats:
+        print("  " + stats.summary())
+    processed = sum(stats.processed for stats in all_stats)
+    print(f"  总计处理 {processed} 项，耗时 {elapsed:.1f} 秒（{processed / elapsed if elapsed > 0 else 0:.2f} 项/秒）")
+    return 1 if any(stats.failed for stats in all_stats) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""后端事件接口：backend 不直接调用界面，而是发出事件，由当前订阅者（sink）决定如何展示
+
+事件种类：
+- info / success / warning / error：提示信息，target 为建议的显示位置（"sidebar" 或 "main"）；
+- debug：调试数据（title + payload，language 不为空时按代码显示）；
+- progress：进度（value 为 0-1）；
+- status_start / status_end：耗时步骤的开始与结束（由 status() 成对发出）。
+
+sink 是接收 Event 的可调用对象，按调用上下文绑定：Streamlit 前端在每次脚本运行时
+以 use_sink(StreamlitSink()) 订阅，命令行与服务使用 LoggingSink 或 CollectingSink；
+没有订阅者时事件写入 logging。提交到线程池的任务用 bind() 包装后沿用提交方的 sink。
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("bom_tool")
+
+MESSAGE_KINDS = ("info", "success", "warning", "error")
+
+
+class Event:
+    """一条后端事件"""
+
+    __slots__ = ("kind", "message", "target", "title", "payload", "language", "value", "timestamp", "thread")
+
+    def __init__(self, kind, message="", target="sidebar", title=None, payload=None, language=None, value=None):
+        self.kind = kind
+        self.message = message
+        self.target = target
+        self.title = title
+        self.payload = payload
+        self.language = language
+        self.value = value
+        self.timestamp = time.time()
+        self.thread = threading.current_thread().name
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Event({self.kind!r}, {self.message or self.title!r})"
+
+
+class LoggingSink:
+    """把事件写入 logging（命令行与服务的默认订阅者），调试数据只在 DEBUG 级别输出"""
+
+    LEVELS = {"info": logging.INFO, "success": logging.INFO, "warning": logging.WARNING,
+              "error": logging.ERROR, "debug": logging.DEBUG, "progress": logging.DEBUG,
+              "status_start": logging.DEBUG, "status_end": logging.DEBUG}
+
+    def __init__(self, log=logger):
+        self.log = log
+
+    def __call__(self, event):
+        level = self.LEVELS.get(event.kind, logging.INFO)
+        if not self.log.isEnabledFor(level):
+            return
+        if event.kind == "debug":
+            payload = event.payload if isinstance(event.payload, str) else repr(event.payload)
+            self.log.log(level, "%s %s\n%s", event.title, event.message or "", payload[:2000])
+        elif event.kind == "progress":
+            self.log.log(level, "[%3.0f%%] %s", (event.value or 0) * 100, event.message)
+        else:
+            self.log.log(level, "%s", event.message)
+
+
+class CollectingSink:
+    """在内存中保存事件（服务端按任务返回事件记录），只保留最近 limit 条"""
+
+    def __init__(self, limit=500, kinds=None):
+        self.limit = limit
+        self.kinds = set(kinds) if kinds else None
+        self._lock = threading.Lock()
+        self.events = []
+
+    def __call__(self, event):
+        if self.kinds is not None and event.kind not in self.kinds:
+            return
+        with self._lock:
+            self.events.append(event)
+            del self.events[:-self.limit]
+
+    def snapshot(self):
+        with self._lock:
+            return [event.to_dict() for event in self.events]
+
+
+_default_sink = LoggingSink()
+_current_sink = contextvars.ContextVar("event_sink", default=None)
+
+
+def current_sink():
+    return _current_sink.get() or _default_sink
+
+
+@contextmanager
+def use_sink(sink):
+    """在 with 块内（以及其中 bind() 包装的后台任务中）把事件发送给 sink"""
+    token = _current_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _current_sink.reset(token)
+
+
+def bind(func):
+    """包装提交到线程池的函数，使其沿用提交方的 sink"""
+    sink = _current_sink.get()
+
+    def run(*args, **kwargs):
+        token = _current_sink.set(sink)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_sink.reset(token)
+    return run
+
+
+def emit(kind, message="", **fields):
+    event = Event(kind, message, **fields)
+    try:
+        current_sink()(event)
+    except Exception:
+        # 展示失败不影响后端逻辑
+        logger.exception("event sink failed for %r", event)
+    return event
+
+
+def replay(recorded):
+    """把 CollectingSink 记录的事件重新发送给当前 sink（后台任务结束后由调用方在自己的上下文中显示）"""
+    sink = current_sink()
+    for event in recorded:
+        try:
+            sink(event)
+        except Exception:
+            logger.exception("event sink failed for %r", event)
+
+
+def info(message, target="sidebar"):
+    return emit("info", message, target=target)
+
+
+def success(message, target="sidebar"):
+    return emit("success", message, target=target)
+
+
+def warning(message, target="sidebar"):
+    return emit("warning", message, target=target)
+
+
+def error(message, target="sidebar"):
+    return emit("error", message, target=target)
+
+
+def debug(title, payload=None, message="", language=None):
+    return emit("debug", message, title=title, payload=payload, language=language)
+
+
+def progress(value, message=""):
+    return emit("progress", message, value=value)
+
+
+@contextmanager
+def status(message):
+    """标记一个耗时步骤（Streamlit 前端显示为 spinner）"""
+    emit("status_start", message)
+    try:
+        yield
+    finally:
+        emit("status_end", message)
+
+
+def flush():
+    """让当前 sink 显示排队中的事件（StreamlitSink 会把其他线程发出的事件排队）"""
+    flush_sink = getattr(current_sink(), "flush", None)
+    if flush_sink is not None:
+        flush_sink()
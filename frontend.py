@@ -1,17 +1,74 @@
 import streamlit as st
 from datetime import datetime
 import time
-import pandas as pd
-import tempfile  # 用于创建临时文件，支持文件下载功能
+import threading
+from collections import deque
 from custom_components.hide_sidebar_items import get_sidebar_hide_code
-from backend import identify_component
+from backend import (identify_component, get_cache_stats, get_coalescing_stats, get_nexar_latency_stats,
+                     get_nexar_token_stats, get_structured_output_stats, get_prompt_cache_stats,
+                     get_rate_limiter_stats, get_circuit_breaker_stats, get_hedge_stats, invalidate_component_cache,
+                     is_component_cached)
+from cache_manager import normalize_part_number
+from reports import risk_rows, excel_bytes, csv_bytes, report_filename, RISK_SHEET_NAME, RISK_FILE_PREFIX
+import events
 import base64
 
 
 # 不显示报错信息到前端
 st.set_option('client.showErrorDetails', False)
 
-def render_ui(get_alternative_parts_func):
+class StreamlitSink:
+    """把后端事件显示在当前页面上
+
+    只有脚本线程可以调用 st.*：其他线程（后台任务）发出的事件先排队，
+    在脚本线程发出下一个事件或调用 flush() 时补充显示。
+    进度事件由调用方的进度条显示，这里忽略。
+    """
+
+    def __init__(self):
+        self._thread = threading.current_thread()
+        self._queue = deque()
+        self._spinners = []
+
+    def __call__(self, event):
+        if threading.current_thread() is not self._thread:
+            if not event.kind.startswith("status_"):
+                self._queue.append(event)
+            return
+        self.flush()
+        self._render(event)
+
+    def flush(self):
+        while self._queue:
+            self._render(self._queue.popleft())
+
+    def _render(self, event):
+        if event.kind in events.MESSAGE_KINDS:
+            area = st.sidebar if event.target == "sidebar" else st
+            getattr(area, event.kind)(event.message)
+        elif event.kind == "debug":
+            with st.sidebar.expander(event.title or "调试信息", expanded=False):
+                if event.message:
+                    st.write(event.message)
+                if event.payload is not None:
+                    if event.language:
+                        st.code(event.payload, language=event.language)
+                    else:
+                        st.write(event.payload)
+        elif event.kind == "status_start":
+            spinner = st.spinner(event.message)
+            spinner.__enter__()
+            self._spinners.append(spinner)
+        elif event.kind == "status_end" and self._spinners:
+            self._spinners.pop().__exit__(None, None, None)
+
+def render_ui(get_alternative_parts_func, stream_alternative_parts_func=None, progressive_alternative_parts_func=None):
+    # 后端事件（提示、调试信息）显示在本次脚本运行的页面上
+    with events.use_sink(StreamlitSink()) as sink:
+        _render_ui(get_alternative_parts_func, stream_alternative_parts_func, progressive_alternative_parts_func)
+        sink.flush()
+
+def _render_ui(get_alternative_parts_func, stream_alternative_parts_func=None, progressive_alternative_parts_func=None):
     # Streamlit 界面 - 确保 set_page_config 是第一个Streamlit命令
     st.set_page_config(page_title="BOM 元器件国产替代推荐工具", layout="wide")
     
@@ -623,7 +680,7 @@ def render_ui(get_alternative_parts_func):
         
         query_error = False
         skip_tab1_query = False  # 新增标记变量
-        component_info = identify_component(part_number)
+        component_info = identify_component_memoized(part_number)
         if search_button or st.session_state.search_triggered:
             if st.session_state.search_triggered:  # 重置状态
                 st.session_state.search_triggered = False
@@ -739,6 +796,7 @@ def render_ui(get_alternative_parts_func):
                                         param_data.append({"参数名称": param, "参数值": value})
 
                                 if param_data:
+                                    import pandas as pd  # 按需导入，避免拖慢首次渲染
                                     param_df = pd.DataFrame(param_data)
                                     st.dataframe(
                                         param_df,
@@ -753,7 +811,15 @@ def render_ui(get_alternative_parts_func):
                             else:
                                 st.info("没有找到详细参数信息", icon="ℹ️")
                 with st.spinner(f"🔄 正在查询 {part_number} 的优选替代方案..."):                
-                    recommendations = get_alternative_parts_func(part_number)
+                    if progressive_alternative_parts_func is not None:
+                        # 渐进式查询：先显示 Nexar 替代件，DeepSeek 推荐完成后替换为合并结果
+                        recommendations = display_progressive_results(
+                            part_number, *progressive_alternative_parts_func(part_number))
+                    elif stream_alternative_parts_func is not None:
+                        # 流式查询：每生成一个推荐就显示一张卡片
+                        recommendations = display_streaming_results(part_number, stream_alternative_parts_func(part_number))
+                    else:
+                        recommendations = get_alternative_parts_func(part_number)
                     
                     # 保存到历史记录
                     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -765,7 +831,8 @@ def render_ui(get_alternative_parts_func):
                     })
                     
                     # 显示结果
-                    display_search_results(part_number, recommendations)
+                    if stream_alternative_parts_func is None and progressive_alternative_parts_func is None:
+                        display_search_results(part_number, recommendations)
     
     with tab2:
         # 聊天界面容器
@@ -872,13 +939,16 @@ def render_ui(get_alternative_parts_func):
                             import sys
                             import os
                             sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-                            from backend import chat_with_expert
+                            from backend import chat_with_expert, new_chat_context
+                            if 'chat_context' not in st.session_state:
+                                st.session_state.chat_context = new_chat_context()
                             
                             try:
                                 # 调用AI对话函数并处理流式输出
                                 response_stream = chat_with_expert(
                                     user_input, 
-                                    history=st.session_state.chat_messages[:-1]  # 不包括刚刚添加的用户消息
+                                    history=st.session_state.chat_messages[:-1],  # 不包括刚刚添加的用户消息
+                                    context=st.session_state.chat_context
                                 )
                                 
                                 response_container = st.empty()
@@ -939,6 +1009,7 @@ def render_ui(get_alternative_parts_func):
                 # 添加清除对话按钮
                 st.markdown("<div style='margin-top: 10px;'></div>", unsafe_allow_html=True)
                 if st.button("🗑️ 清除对话记录", use_container_width=True, key="clear_chat_main"):
+                    st.session_state.pop("chat_context", None)
                     st.session_state.chat_messages = [{
                         "role": "assistant", 
                         "content": "对话已清除。请告诉我您需要查找什么元器件的替代方案或有什么选型需求？"
@@ -1014,29 +1085,23 @@ def render_ui(get_alternative_parts_func):
             with col2:
                 batch_process_button = st.button("开始批量查询", use_container_width=True, key="batch_button")
             
-            # 如果上传了文件，尝试预览
-            try:
-                if uploaded_file.name.endswith('.csv'):
-                    df_preview = pd.read_csv(uploaded_file)  # 移除nrows=5限制，显示所有行
-                else:
-                    df_preview = pd.read_excel(uploaded_file) 
-                
-                # 直接显示数据框，不使用expander
-                st.subheader("BOM文件预览")
-                st.dataframe(df_preview)
-            except Exception as e:
-                st.error(f"文件预览失败: {e}")
+            # 读取一次BOM文件，预览与批量处理共用同一结果
+            bom_data = load_bom_memoized(uploaded_file)
+            if bom_data is not None:
+                try:
+                    # 直接显示数据框，不使用expander
+                    st.subheader("BOM文件预览")
+                    st.dataframe(bom_data.preview_dataframe())
+                    if bom_data.total_rows > len(bom_data.preview_rows):
+                        st.caption(f"共 {bom_data.total_rows} 行，仅预览前 {len(bom_data.preview_rows)} 行")
+                except Exception as e:
+                    st.error(f"文件预览失败: {e}")
             
-            # 批量处理逻辑
+            # 批量处理逻辑：提交到持久化任务队列，在后台执行（刷新或关闭页面不影响）
             if batch_process_button:
-                # 从backend导入函数
-                import sys
-                import os
-                sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-                from backend import process_bom_file, batch_get_alternative_parts
-                
-                # 处理BOM文件，获取元器件信息
-                components, columns_info = process_bom_file(uploaded_file)
+                # 获取元器件信息（已在预览时解析）
+                components = bom_data.components if bom_data is not None else []
+                columns_info = bom_data.columns_info if bom_data is not None else {}
                 
                 if not components:
                     st.error("⚠️ 无法从BOM文件中识别元器件型号！")
@@ -1046,171 +1111,15 @@ def render_ui(get_alternative_parts_func):
                     st.sidebar.success(f"识别到的关键列: 型号列({columns_info.get('mpn_column', '未识别')}), "
                             f"名称列({columns_info.get('name_column', '未识别')})")
                     
-                    # 进度条
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    def update_progress(progress, text):
-                        progress_bar.progress(progress)
-                        status_text.text(text)
-                    
-                    # 批量风险评估（不查询替代方案）
-                    with st.spinner("正在评估所有元器件的停产风险..."):
-                        batch_results = batch_get_alternative_parts(components, update_progress)
-                    
-                    progress_bar.progress(1.0)
-                    status_text.empty()
-                    
-                    # 保存到历史记录
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    st.session_state.search_history.append({
-                        "timestamp": timestamp,
-                        "part_number": f"批量风险评估({len(components)}个)",
-                        "batch_results": batch_results,
-                        "type": "risk_assessment"
-                    })
-                    
-                    # 提取风险预警信息
-                    eol_warnings = batch_results.pop("__eol_warnings__", [])
-                    if not isinstance(eol_warnings, list):
-                        eol_warnings = []
-                    
-                    # 1. 显示风险预警区域（按新等级划分）
-                    st.subheader("⚠️ 元器件停产风险评估结果")
-                    st.markdown("""
-                    <style>
-                        .risk-red { background: #fff0f0; border-left: 4px solid #dc3545; }
-                        .risk-yellow { background: #fffbf0; border-left: 4px solid #ffc107; }
-                        .risk-green { background: #f0fff4; border-left: 4px solid #28a745; }
-                        .risk-unknown { background: #f0f0f0; border-left: 4px solid #6c757d; }
-                        .risk-item { padding: 12px; margin: 8px 0; border-radius: 4px; }
-                    </style>
-                    """, unsafe_allow_html=True)
-                    
-                    with st.expander(f"共 {len(eol_warnings)} 个元器件风险评估结果", expanded=True):
-                        # 按新风险等级分组显示
-                        red_warnings = [w for w in eol_warnings if w["warning_level"] == "红色"]
-                        yellow_warnings = [w for w in eol_warnings if w["warning_level"] == "黄色"]
-                        green_warnings = [w for w in eol_warnings if w["warning_level"] == "绿色"]
-                        unknown_warnings = [w for w in eol_warnings if w["warning_level"] == "未知"]
-                        
-                        # 红色：高风险
-                        if red_warnings:
-                            st.markdown("#### 🔴 红色预警（高风险：已停产或1年以内停产）")
-                            for w in red_warnings:
-                                st.markdown(f"""
-                                <div class="risk-item risk-red">
-                                    <strong>{w['mpn']}（{w['name']}）</strong><br>
-                                    状态：{w['status']}<br>
-                                    停产日期：{w['eol_date']}<br>
-                                    风险描述：{w['risk_description']}
-                                </div>
-                                """, unsafe_allow_html=True)
-                        
-                        # 黄色：低风险
-                        if yellow_warnings:
-                            st.markdown("#### 🟡 黄色预警（低风险：1-5年停产）")
-                            for w in yellow_warnings:
-                                st.markdown(f"""
-                                <div class="risk-item risk-yellow">
-                                    <strong>{w['mpn']}（{w['name']}）</strong><br>
-                                    状态：{w['status']}<br>
-                                    停产日期：{w['eol_date']}<br>
-                                    风险描述：{w['risk_description']}
-                                </div>
-                                """, unsafe_allow_html=True)
-                        
-                        # 绿色：无风险
-                        if green_warnings:
-                            st.markdown("#### 🟢 绿色预警（无风险：5年以上停产）")
-                            for w in green_warnings:
-                                st.markdown(f"""
-                                <div class="risk-item risk-green">
-                                    <strong>{w['mpn']}（{w['name']}）</strong><br>
-                                    状态：{w['status']}<br>
-                                    停产日期：{w['eol_date']}<br>
-                                    风险描述：{w['risk_description']}
-                                </div>
-                                """, unsafe_allow_html=True)
-                        
-                        # 未知：灰色
-                        if unknown_warnings:
-                            st.markdown("#### 灰色预警（未知风险：未检测出停产时间）")
-                            for w in unknown_warnings:
-                                st.markdown(f"""
-                                <div class="risk-item risk-unknown">
-                                    <strong>{w['mpn']}（{w['name']}）</strong><br>
-                                    状态：{w['status']}<br>
-                                    停产日期：{w['eol_date']}<br>
-                                    风险描述：{w['risk_description']}
-                                </div>
-                                """, unsafe_allow_html=True)
-                    
-                    # 确保所有变量都是列表类型
-                    red_warnings = red_warnings or []
-                    yellow_warnings = yellow_warnings or []
-                    green_warnings = green_warnings or []
-                    unknown_warnings = unknown_warnings or []
-                    eol_warnings = eol_warnings or []
-
-                    # 2. 显示统计信息（修复 HTML 和类型错误）
-                    st.info(f"""
-                    📊 风险统计：
-                    - 高风险（红色）：{len(red_warnings)} 个
-                    - 低风险（黄色）：{len(yellow_warnings)} 个
-                    - 无风险（绿色）：{len(green_warnings)} 个
-                    - 未知风险（绿色）：{len(unknown_warnings)} 个
-                    总计：{len(eol_warnings)} 个元器件
-                    """)
-                    # 3. 下载区域（仅包含风险信息）
-                    st.subheader("📊 下载风险评估结果")
-                    
-                    result_data = []
-                    for mpn, result_info in batch_results.items():
-                        result_data.append({
-                            "原型号": mpn,
-                            "原名称": result_info.get('name', ''),
-                            "描述": result_info.get('description', ''),
-                            "停产日期": result_info.get('eol_date', '未知'),
-                            "风险等级": result_info.get('warning_level', '未知'),
-                            "风险描述": result_info.get('risk_description', ''),
-                            "状态详情": result_info.get('status', '')
-                        })
-                    
-                    if result_data:
-                        df_results = pd.DataFrame(result_data)
-                        
-                        # Excel下载
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as excel_file:
-                            with pd.ExcelWriter(excel_file.name, engine='openpyxl') as writer:
-                                df_results.to_excel(writer, sheet_name='停产风险评估结果', index=False)
-                            excel_data = open(excel_file.name, 'rb').read()
-                        
-                        # CSV下载
-                        csv_data = df_results.to_csv(index=False, encoding='utf-8-sig').encode()
-                        
-                        # 显示下载按钮
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.download_button(
-                                "下载Excel",
-                                data=excel_data,
-                                file_name=f"元器件风险评估结果_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True
-                            )
-                        with col2:
-                            st.download_button(
-                                "下载CSV",
-                                data=csv_data,
-                                file_name=f"元器件风险评估结果_{datetime.now().strftime('%Y%m%d')}.csv",
-                                mime="text/csv",
-                                use_container_width=True
-                            )
-                    else:
-                        st.warning("无风险评估数据可下载")
-        else:
-            # 空白展示区，不显示任何提示或装饰
-            pass
+                    from jobqueue import get_job_queue
+                    job_id = get_job_queue().submit("risk", components, source=uploaded_file.name)
+                    # 任务ID同时写入网址，刷新页面后仍能找回任务
+                    st.session_state.batch_job_id = job_id
+                    st.query_params["job"] = job_id
+        
+        batch_job_id = st.session_state.get("batch_job_id") or st.query_params.get("job")
+        if batch_job_id:
+            display_batch_job(batch_job_id)
 
     # 在此处添加历史查询功能
     if 'search_history' not in st.session_state:
@@ -1259,6 +1168,64 @@ def render_ui(get_alternative_parts_func):
         st.caption("🔍 查询结果会自动保存到历史记录中")
         st.markdown("</div>", unsafe_allow_html=True)
 
+        # 运行指标（缓存命中情况等）
+        with st.expander("运行指标", expanded=False):
+            st.write(f"**本会话节省的元器件识别调用:** {st.session_state.get('identify_calls_saved', 0)} 次")
+            if st.button("重新识别当前元器件", key="invalidate_identify", use_container_width=True):
+                invalidate_component_identification(st.session_state.get("part_number_input", ""))
+                st.rerun()
+            cache_stats = get_cache_stats()
+            st.write(f"**缓存条目数:** {cache_stats.pop('__size__', 0)}")
+            for namespace, values in cache_stats.items():
+                st.write(f"**{namespace}**：命中 {values['hits']} 次，未命中 {values['misses']} 次，"
+                         f"命中率 {values['hit_rate']:.0%}")
+            coalescing_stats = get_coalescing_stats()
+            st.write(f"**进行中的上游请求:** {coalescing_stats.pop('__in_flight__', 0)}")
+            for namespace, values in coalescing_stats.items():
+                st.write(f"**{namespace}**：实际请求 {values['executed']} 次，合并重复请求 {values['coalesced']} 次")
+            for operation, latency in get_nexar_latency_stats().items():
+                st.write(f"**Nexar {operation}**：{latency['count']} 次，平均 {latency['avg_ms']} ms，"
+                         f"p95 ≤ {latency['p95_ms']} ms，p99 ≤ {latency['p99_ms']} ms")
+            first_card_samples = st.session_state.get("first_card_seconds", [])
+            if first_card_samples:
+                st.write(f"**首个推荐出现耗时:** 最近 {first_card_samples[-1]:.1f} 秒，"
+                         f"平均 {sum(first_card_samples) / len(first_card_samples):.1f} 秒（{len(first_card_samples)} 次查询）")
+            for call_type, values in get_structured_output_stats().items():
+                wasted_per_success = values["wasted_per_success"]
+                st.write(f"**DeepSeek {call_type}**：补全 {values['completions']} 次，成功 {values['succeeded']} 次，"
+                         f"修复 {values['repaired']}/{values['repairs']} 次，每次成功浪费 "
+                         f"{'-' if wasted_per_success is None else wasted_per_success} 次补全")
+            for prompt_name, values in get_prompt_cache_stats().items():
+                st.write(f"**提示词 {prompt_name}**：{values['calls']} 次调用，输入 {values['prompt_tokens']} tokens，"
+                         f"前缀缓存命中 {values['cache_hit_tokens']} tokens（命中率 {values['hit_rate']:.0%}）")
+            chat_context = st.session_state.get("chat_context")
+            for turn in (chat_context.turns[-5:] if chat_context is not None else []):
+                actual = turn["prompt_tokens"]
+                st.write(f"**专家对话第 {turn['turn']} 轮**：提示词 {'-' if actual is None else actual} tokens"
+                         f"（估算 {turn['estimated_prompt_tokens']}），原文 {turn['recent_messages']} 条，"
+                         f"摘要覆盖 {turn['summarized_messages']} 条，省略 {turn['omitted_messages']} 条")
+            hedge_stats = get_hedge_stats()
+            hedge_delay = hedge_stats['delay_seconds']
+            st.write(f"**国产优先补充查询**：发出 {hedge_stats['started']} 次（投机 {hedge_stats['speculative']} 次，"
+                     f"命中 {hedge_stats['won']} 次，浪费 {hedge_stats['wasted']} 次），"
+                     f"被使用 {hedge_stats['used']} 次，丢弃 {hedge_stats['discarded']} 次；"
+                     f"对冲延迟 {'未启用' if hedge_delay is None else f'{hedge_delay:.1f} 秒'}"
+                     f"（{hedge_stats['latency_samples']} 个耗时样本）")
+            breaker_labels = {"closed": "🟢 正常", "open": "🔴 熔断中", "half_open": "🟡 试探恢复"}
+            for upstream, values in get_circuit_breaker_stats().items():
+                retry_hint = f"，{values['retry_in']} 秒后试探" if values["state"] == "open" else ""
+                st.write(f"**{upstream}熔断器**：{breaker_labels.get(values['state'], values['state'])}{retry_hint}，"
+                         f"失败 {values['failures']} 次，快速失败 {values['rejected']} 次，熔断 {values['opened']} 次")
+            limiter_stats = get_rate_limiter_stats()
+            st.write(f"**DeepSeek限流**：排队中 {limiter_stats['queued']} 个，收到429 {limiter_stats['rate_limited']} 次")
+            for priority, label in (("interactive", "交互请求"), ("batch", "批量请求")):
+                values = limiter_stats[priority]
+                st.write(f"**{label}**：{values['acquired']} 次，其中等待 {values['waited']} 次，"
+                         f"累计等待 {values['wait_seconds']} 秒，最长 {values['max_wait_seconds']} 秒")
+            token_stats = get_nexar_token_stats()
+            st.write(f"**Nexar令牌**：刷新 {token_stats['refreshes']} 次（阻塞 {token_stats['blocking_refreshes']} 次），"
+                     f"失败 {token_stats['failures']} 次")
+
     # 修改历史记录查看逻辑，以支持批量查询结果
     if 'selected_history' in st.session_state:
         st.markdown("---")
@@ -1308,68 +1275,393 @@ def render_ui(get_alternative_parts_func):
     st.markdown("---")
     st.markdown('<p class="footer-text">本工具基于DeepSeek大语言模型和Nexar元件库，提供元器件替代参考</p>', unsafe_allow_html=True)
 
+def _close_batch_job():
+    st.session_state.pop("batch_job_id", None)
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+@st.fragment(run_every=1)
+def _batch_job_progress(job_id):
+    """任务进行中时每秒刷新进度；任务结束后重新运行整个页面以显示结果"""
+    from jobqueue import get_job_queue, ACTIVE_STATUSES
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        st.rerun()
+    
+    counts = job["counts"]
+    if job["status"] == "queued":
+        text = f"排队中：共 {job['total']} 个元器件"
+    else:
+        text = (f"正在评估停产风险：已完成 {counts['done']} 个，失败 {counts['failed']} 个，"
+                f"共 {job['total']} 个（{job['progress']:.0%}）")
+    if job["cancel_requested"]:
+        text += "，正在取消（当前一批完成后停止）"
+    st.progress(job["progress"], text=text)
+    st.caption(f"任务在后台执行，刷新或关闭页面不影响进度（BOM：{job['source'] or '未命名'}）")
+    if not job["cancel_requested"] and st.button("取消任务", key=f"cancel_batch_job_{job_id}"):
+        queue.cancel(job_id)
+        st.rerun()
+
+def display_batch_job(job_id):
+    """显示批量风险评估任务：进行中显示进度与取消按钮，结束后显示结果、失败重试与下载"""
+    from jobqueue import get_job_queue, ACTIVE_STATUSES
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        _close_batch_job()
+        st.warning("批量任务不存在或已过期")
+        return
+    st.session_state.batch_job_id = job_id
+    
+    if job["status"] in ACTIVE_STATUSES:
+        _batch_job_progress(job_id)
+        return
+    
+    counts = job["counts"]
+    status_text = {
+        "succeeded": f"✅ 批量评估完成：共 {job['total']} 个元器件",
+        "partial": f"⚠️ 批量评估完成，其中 {counts['failed']} 个元器件评估失败，可重试失败项",
+        "cancelled": f"任务已取消：已评估 {job['processed']} 个，未处理 {counts['cancelled']} 个",
+        "failed": f"❌ 任务执行失败：{job['error']}",
+    }.get(job["status"], job["status"])
+    col1, col2, col3 = st.columns([4, 1, 1])
+    with col1:
+        st.markdown(f"**{status_text}**（BOM：{job['source'] or '未命名'}）")
+    with col2:
+        can_retry = counts["failed"] > 0 or (job["status"] == "failed" and counts["pending"] > 0)
+        if can_retry and st.button("重试失败项", key=f"retry_batch_job_{job_id}", use_container_width=True):
+            queue.retry_failed(job_id)
+            st.rerun()
+    with col3:
+        if st.button("关闭", key=f"close_batch_job_{job_id}", use_container_width=True):
+            _close_batch_job()
+            st.rerun()
+    if job["messages"]:
+        with st.expander(f"任务提示（{len(job['messages'])} 条）"):
+            for message in job["messages"]:
+                getattr(st, message["kind"], st.info)(message["message"])
+    
+    batch_results = queue.results(job_id)
+    if not batch_results:
+        return
+    eol_warnings = [
+        {"mpn": mpn, "name": info.get("name", ""), "eol_date": info.get("eol_date", "未知"),
+         "warning_level": info.get("warning_level", "未知"), "status": info.get("status", ""),
+         "risk_description": info.get("risk_description", "")}
+        for mpn, info in batch_results.items()
+    ]
+    
+    # 每个任务只保存一次历史记录
+    recorded = st.session_state.setdefault("recorded_batch_jobs", set())
+    if job_id not in recorded:
+        recorded.add(job_id)
+        st.session_state.search_history.append({
+            "timestamp": datetime.fromtimestamp(job["finished"] or time.time()).strftime("%Y-%m-%d %H:%M:%S"),
+            "part_number": f"批量风险评估({len(batch_results)}个)",
+            "batch_results": batch_results,
+            "type": "risk_assessment"
+        })
+    
+    # 吞吐量统计（多次重试时为累计值）
+    batch_stats = job["stats"]
+    if batch_stats:
+        st.caption(f"⏱️ 共评估 {batch_stats.get('processed', 0)} 个元器件，"
+                   f"耗时 {batch_stats.get('elapsed_seconds', 0):.1f} 秒，"
+                   f"吞吐量 {batch_stats.get('parts_per_second', 0):.2f} 个/秒"
+                   f"（并发数 {batch_stats.get('max_workers', 1)}，"
+                   f"DeepSeek调用 {batch_stats.get('requests', 0)} 次）")
+    display_risk_results(batch_results, eol_warnings)
+
+def display_risk_results(batch_results, eol_warnings):
+    """显示风险评估结果：按风险等级分组、统计信息与下载按钮"""
+    # 1. 显示风险预警区域（按新等级划分）
+    st.subheader("⚠️ 元器件停产风险评估结果")
+    st.markdown("""
+    <style>
+        .risk-red { background: #fff0f0; border-left: 4px solid #dc3545; }
+        .risk-yellow { background: #fffbf0; border-left: 4px solid #ffc107; }
+        .risk-green { background: #f0fff4; border-left: 4px solid #28a745; }
+        .risk-unknown { background: #f0f0f0; border-left: 4px solid #6c757d; }
+        .risk-item { padding: 12px; margin: 8px 0; border-radius: 4px; }
+    </style>
+    """, unsafe_allow_html=True)
+
+    with st.expander(f"共 {len(eol_warnings)} 个元器件风险评估结果", expanded=True):
+        # 按新风险等级分组显示
+        red_warnings = [w for w in eol_warnings if w["warning_level"] == "红色"]
+        yellow_warnings = [w for w in eol_warnings if w["warning_level"] == "黄色"]
+        green_warnings = [w for w in eol_warnings if w["warning_level"] == "绿色"]
+        unknown_warnings = [w for w in eol_warnings if w["warning_level"] == "未知"]
+
+        # 红色：高风险
+        if red_warnings:
+            st.markdown("#### 🔴 红色预警（高风险：已停产或1年以内停产）")
+            for w in red_warnings:
+                st.markdown(f"""
+                <div class="risk-item risk-red">
+                    <strong>{w['mpn']}（{w['name']}）</strong><br>
+                    状态：{w['status']}<br>
+                    停产日期：{w['eol_date']}<br>
+                    风险描述：{w['risk_description']}
+                </div>
+                """, unsafe_allow_html=True)
+
+        # 黄色：低风险
+        if yellow_warnings:
+            st.markdown("#### 🟡 黄色预警（低风险：1-5年停产）")
+            for w in yellow_warnings:
+                st.markdown(f"""
+                <div class="risk-item risk-yellow">
+                    <strong>{w['mpn']}（{w['name']}）</strong><br>
+                    状态：{w['status']}<br>
+                    停产日期：{w['eol_date']}<br>
+                    风险描述：{w['risk_description']}
+                </div>
+                """, unsafe_allow_html=True)
+
+        # 绿色：无风险
+        if green_warnings:
+            st.markdown("#### 🟢 绿色预警（无风险：5年以上停产）")
+            for w in green_warnings:
+                st.markdown(f"""
+                <div class="risk-item risk-green">
+                    <strong>{w['mpn']}（{w['name']}）</strong><br>
+                    状态：{w['status']}<br>
+                    停产日期：{w['eol_date']}<br>
+                    风险描述：{w['risk_description']}
+                </div>
+                """, unsafe_allow_html=True)
+
+        # 未知：灰色
+        if unknown_warnings:
+            st.markdown("#### 灰色预警（未知风险：未检测出停产时间）")
+            for w in unknown_warnings:
+                st.markdown(f"""
+                <div class="risk-item risk-unknown">
+                    <strong>{w['mpn']}（{w['name']}）</strong><br>
+                    状态：{w['status']}<br>
+                    停产日期：{w['eol_date']}<br>
+                    风险描述：{w['risk_description']}
+                </div>
+                """, unsafe_allow_html=True)
+
+    # 确保所有变量都是列表类型
+    red_warnings = red_warnings or []
+    yellow_warnings = yellow_warnings or []
+    green_warnings = green_warnings or []
+    unknown_warnings = unknown_warnings or []
+    eol_warnings = eol_warnings or []
+
+    # 2. 显示统计信息（修复 HTML 和类型错误）
+    st.info(f"""
+    📊 风险统计：
+    - 高风险（红色）：{len(red_warnings)} 个
+    - 低风险（黄色）：{len(yellow_warnings)} 个
+    - 无风险（绿色）：{len(green_warnings)} 个
+    - 未知风险（绿色）：{len(unknown_warnings)} 个
+    总计：{len(eol_warnings)} 个元器件
+    """)
+    # 3. 下载区域（仅包含风险信息）
+    st.subheader("📊 下载风险评估结果")
+
+    result_data = risk_rows(batch_results)
+
+    if result_data:
+        # Excel / CSV 下载（与命令行 cli.py 输出的文件布局相同）
+        excel_data = excel_bytes(result_data, RISK_SHEET_NAME)
+        csv_data = csv_bytes(result_data)
+
+        # 显示下载按钮
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "下载Excel",
+                data=excel_data,
+                file_name=report_filename(RISK_FILE_PREFIX, "xlsx"),
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+        with col2:
+            st.download_button(
+                "下载CSV",
+                data=csv_data,
+                file_name=report_filename(RISK_FILE_PREFIX, "csv"),
+                mime="text/csv",
+                use_container_width=True
+            )
+    else:
+        st.warning("无风险评估数据可下载")
+
+def load_bom_memoized(uploaded_file):
+    """读取上传的BOM文件，同一文件在会话内只解析一次
+
+    Streamlit 每次交互都会重跑脚本，按文件标识缓存解析结果，
+    预览和"开始批量查询"都直接使用缓存，不再重复读取整张表。
+    """
+    key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None))
+    cached = st.session_state.get("bom_data")
+    if cached and cached.get("key") == key:
+        return cached["data"]
+
+    from backend import load_bom_file
+    bom_data = load_bom_file(uploaded_file)
+    st.session_state.bom_data = {"key": key, "data": bom_data}
+    return bom_data
+
+def identify_component_memoized(part_number):
+    """按规范化型号记忆元器件识别结果
+
+    会话级：型号未变化时直接复用上次结果（点击历史、切换标签、聊天输入等重跑不再请求Nexar）；
+    进程级：由 backend.identify_component 的持久化缓存负责，多个会话共享。
+    只记忆写入了持久化缓存的识别结果，失败或兜底（DeepSeek默认值、过期缓存）的结果下次重跑时重新查询；
+    持久化缓存仍有效时命中会话记忆并不节省API调用，不计入 identify_calls_saved。
+    """
+    key = normalize_part_number(part_number)
+    if not key:
+        return {}
+    memo = st.session_state.get("identified_component")
+    if memo is not None and memo["key"] == key:
+        if not is_component_cached(part_number):
+            st.session_state.identify_calls_saved = st.session_state.get("identify_calls_saved", 0) + 1
+        return memo["info"]
+
+    component_info = identify_component(part_number)
+    if component_info and is_component_cached(part_number):
+        st.session_state.identified_component = {"key": key, "info": component_info}
+    else:
+        st.session_state.pop("identified_component", None)
+    return component_info
+
+def invalidate_component_identification(part_number):
+    """显式清除会话级与进程级的识别结果，下次重跑时重新查询"""
+    st.session_state.pop("identified_component", None)
+    if normalize_part_number(part_number):
+        invalidate_component_cache(part_number)
+
 # 抽取显示结果的函数，以便重复使用
+def _render_card_styles():
+    """添加替代方案卡片的CSS样式 - 调整价格对齐和Pin兼容突出显示"""
+    st.markdown("""
+    <style>
+        div.card-wrapper {
+            display: flex;
+            flex-direction: row;
+            overflow-x: auto;
+            gap: 15px;
+            padding-bottom: 10px;
+        }
+        .price-value {
+            color: #e53935;
+            font-weight: bold;
+            min-width: 80px; /* 设置最小宽度确保对齐 */
+            display: inline-block; /* 使宽度设置生效 */
+        }
+        /* Pin兼容显示样式 - 移除背景色 */
+        .pin-compatible {
+            border: 1px solid #ccc !important;
+            text-align: left !important; /* 左对齐 */
+        }
+        .non-pin-compatible {
+            border: 1px solid #ccc !important;
+            text-align: left !important; /* 左对齐 */
+        }
+        /* 调整信息行样式确保对齐 */
+        .info-row {
+            display: flex;
+            margin-bottom: 0px;
+        }
+        .info-label {
+            width: 80px;
+            font-weight: 500;
+        }
+        .info-value {
+            flex: 1;
+        }
+        /* 参数内容样式，与其他信息对齐 */
+        .param-content {
+            padding-left: 80px;
+            margin-bottom: 0px;
+            word-wrap: break-word;
+        }
+        /* 修复间距问题 */
+        .element-container {
+            margin-top: 0 !important;
+            margin-bottom: 0 !important;
+        }
+        /* 标签专用样式 */
+        .type-label {
+            margin: 0 !important;
+            padding: 2px 8px !important;
+            border-radius: 4px !important;
+            display: inline-block !important;
+        }
+    </style>
+    """, unsafe_allow_html=True)
+
+def _render_recommendation_card(i, rec):
+    """在当前列中渲染第 i 个替代方案卡片"""
+    # 方案标题
+    st.markdown(f"### 方案 {i}")
+
+    # 型号名称
+    st.markdown(f"<h4 style='font-size:1.2rem; margin-bottom: 0.3rem;'>{rec.get('model', '未知型号')}</h4>", unsafe_allow_html=True)
+
+    # 品牌显示（移除边框，改为纯文本）
+    st.markdown(f"**品牌：** {rec.get('brand', '未知品牌')}", unsafe_allow_html=True)
+
+    # Pin-to-Pin 兼容性（简化样式，用符号直观展示）
+    pin_to_pin = rec.get('pinToPin', False)
+    if pin_to_pin is None:
+        # Nexar 先行结果尚未经过 pin-to-pin 分析
+        st.markdown("**兼容：** ⏳ 待分析", unsafe_allow_html=True)
+    else:
+        pin_symbol = "✅" if pin_to_pin else "❌"
+        st.markdown(f"**兼容：** {pin_symbol} {('Pin兼容' if pin_to_pin else '非Pin兼容')}", unsafe_allow_html=True)
+
+    # 国产/进口标签（绿色背景标识国产）
+    type_display = ""
+    if rec['type'] == "国产":
+        type_display = "<span style='background-color: #4CAF50; color: white; padding: 2px 8px; border-radius: 4px;'>国产</span>"
+    else:
+        type_display = "<span style='background-color: #2196F3; color: white; padding: 2px 8px; border-radius: 4px;'>进口</span>"
+    st.markdown(f"**产地：** {type_display}", unsafe_allow_html=True)
+
+    # 统一信息布局（紧凑排列）
+    st.markdown("""
+    <div style="margin-top: 8px; line-height: 1.6;">
+        <div style="display: flex; margin-bottom: 4px;">
+            <div style="min-width: 60px; font-weight: 500;">封装：</div>
+            <div>{}</div>
+        </div>
+        <div style="display: flex; margin-bottom: 4px;">
+            <div style="min-width: 60px; font-weight: 500;">价格：</div>
+            <div>{}</div>
+        </div>
+        <div style="display: flex; margin-bottom: 8px;">
+            <div style="min-width: 60px; font-weight: 500;">参数：</div>
+            <div>{}</div>
+        </div>
+        <div style="display: flex;">
+            <div style="min-width: 60px; font-weight: 500;">货期：</div>
+            <div>{}</div>
+        </div>
+    </div>
+    """.format(
+        rec.get('package', 'LQFP48'),
+        rec.get('price', '未知'),
+        rec.get('parameters', 'CPU内核: ARM Cortex-M3, 主频: 72MHz, Flash: 64KB, RAM: 20KB, IO: 37'),
+        rec.get('leadTime', '3-5周')
+    ), unsafe_allow_html=True)
+
+    # 数据手册链接（简化样式）
+    st.markdown(f"[参考信息]({rec.get('datasheet', 'https://example.com')})", unsafe_allow_html=True)
+
 def display_search_results(part_number, recommendations):
     # 结果区域添加容器
     
     if recommendations:
-        # 添加CSS样式 - 调整价格对齐和Pin兼容突出显示
-        st.markdown("""
-        <style>
-            div.card-wrapper {
-                display: flex;
-                flex-direction: row;
-                overflow-x: auto;
-                gap: 15px;
-                padding-bottom: 10px;
-            }
-            .price-value {
-                color: #e53935;
-                font-weight: bold;
-                min-width: 80px; /* 设置最小宽度确保对齐 */
-                display: inline-block; /* 使宽度设置生效 */
-            }
-            /* Pin兼容显示样式 - 移除背景色 */
-            .pin-compatible {
-                border: 1px solid #ccc !important;
-                text-align: left !important; /* 左对齐 */
-            }
-            .non-pin-compatible {
-                border: 1px solid #ccc !important;
-                text-align: left !important; /* 左对齐 */
-            }
-            /* 调整信息行样式确保对齐 */
-            .info-row {
-                display: flex;
-                margin-bottom: 0px;
-            }
-            .info-label {
-                width: 80px;
-                font-weight: 500;
-            }
-            .info-value {
-                flex: 1;
-            }
-            /* 参数内容样式，与其他信息对齐 */
-            .param-content {
-                padding-left: 80px;
-                margin-bottom: 0px;
-                word-wrap: break-word;
-            }
-            /* 修复间距问题 */
-            .element-container {
-                margin-top: 0 !important;
-                margin-bottom: 0 !important;
-            }
-            /* 标签专用样式 */
-            .type-label {
-                margin: 0 !important;
-                padding: 2px 8px !important;
-                border-radius: 4px !important;
-                display: inline-block !important;
-            }
-        </style>
-        """, unsafe_allow_html=True)
+        _render_card_styles()
         
         # 创建列容器来强制横向布局
         cols = st.columns(len(recommendations))
@@ -1377,56 +1669,82 @@ def display_search_results(part_number, recommendations):
         # 在每个列中放置一个卡片（优化后）
         for i, (col, rec) in enumerate(zip(cols, recommendations), 1):
             with col:
-                # 方案标题
-                st.markdown(f"### 方案 {i}")
-                
-                # 型号名称
-                st.markdown(f"<h4 style='font-size:1.2rem; margin-bottom: 0.3rem;'>{rec.get('model', '未知型号')}</h4>", unsafe_allow_html=True)
-                
-                # 品牌显示（移除边框，改为纯文本）
-                st.markdown(f"**品牌：** {rec.get('brand', '未知品牌')}", unsafe_allow_html=True)
-                
-                # Pin-to-Pin 兼容性（简化样式，用符号直观展示）
-                pin_to_pin = rec.get('pinToPin', False)
-                pin_symbol = "✅" if pin_to_pin else "❌"
-                st.markdown(f"**兼容：** {pin_symbol} {('Pin兼容' if pin_to_pin else '非Pin兼容')}", unsafe_allow_html=True)
-                
-                # 国产/进口标签（绿色背景标识国产）
-                type_display = ""
-                if rec['type'] == "国产":
-                    type_display = "<span style='background-color: #4CAF50; color: white; padding: 2px 8px; border-radius: 4px;'>国产</span>"
-                else:
-                    type_display = "<span style='background-color: #2196F3; color: white; padding: 2px 8px; border-radius: 4px;'>进口</span>"
-                st.markdown(f"**产地：** {type_display}", unsafe_allow_html=True)
-                
-                # 统一信息布局（紧凑排列）
-                st.markdown("""
-                <div style="margin-top: 8px; line-height: 1.6;">
-                    <div style="display: flex; margin-bottom: 4px;">
-                        <div style="min-width: 60px; font-weight: 500;">封装：</div>
-                        <div>{}</div>
-                    </div>
-                    <div style="display: flex; margin-bottom: 4px;">
-                        <div style="min-width: 60px; font-weight: 500;">价格：</div>
-                        <div>{}</div>
-                    </div>
-                    <div style="display: flex; margin-bottom: 8px;">
-                        <div style="min-width: 60px; font-weight: 500;">参数：</div>
-                        <div>{}</div>
-                    </div>
-                    <div style="display: flex;">
-                        <div style="min-width: 60px; font-weight: 500;">货期：</div>
-                        <div>{}</div>
-                    </div>
-                </div>
-                """.format(
-                    rec.get('package', 'LQFP48'),
-                    rec.get('price', '未知'),
-                    rec.get('parameters', 'CPU内核: ARM Cortex-M3, 主频: 72MHz, Flash: 64KB, RAM: 20KB, IO: 37'),
-                    rec.get('leadTime', '3-5周')
-                ), unsafe_allow_html=True)
-                
-                # 数据手册链接（简化样式）
-                st.markdown(f"[参考信息]({rec.get('datasheet', 'https://example.com')})", unsafe_allow_html=True)
+                _render_recommendation_card(i, rec)
     else:
-        st.info("未找到替代方案")
\ No newline at end of file
+        st.info("未找到替代方案")
+
+def display_streaming_results(part_number, recommendation_stream, max_cards=3):
+    """边接收边显示替代方案卡片，返回全部推荐列表
+
+    记录从开始查询到第一张卡片出现的时间（time-to-first-card），显示在"运行指标"中。
+    """
+    start_time = time.perf_counter()
+    _render_card_styles()
+    cols = st.columns(max_cards)
+    
+    recommendations = []
+    for rec in recommendation_stream:
+        if len(recommendations) >= max_cards:
+            break
+        recommendations.append(rec)
+        with cols[len(recommendations) - 1]:
+            _render_recommendation_card(len(recommendations), rec)
+        if len(recommendations) == 1:
+            _record_first_card_time(start_time)
+    
+    if not recommendations:
+        st.info("未找到替代方案")
+    return recommendations
+
+def _record_first_card_time(start_time):
+    first_card_seconds = time.perf_counter() - start_time
+    samples = st.session_state.setdefault("first_card_seconds", [])
+    samples.append(first_card_seconds)
+    del samples[:-50]  # 只保留最近50次
+
+def display_progressive_results(part_number, fast_recommendations, enrichment, max_cards=3):
+    """先显示 Nexar 替代件，后台的 DeepSeek 推荐完成后原位替换为合并后的结果，返回最终推荐列表
+
+    enrichment 为 None 时 fast_recommendations 即为最终结果。
+    """
+    start_time = time.perf_counter()
+    _render_card_styles()
+    placeholder = st.empty()
+
+    def render(recommendations, note):
+        with placeholder.container():
+            st.caption(note)
+            if recommendations:
+                # 列数固定为 max_cards，替换时卡片落在相同的位置
+                cols = st.columns(max_cards)
+                for i, (col, rec) in enumerate(zip(cols, recommendations), 1):
+                    with col:
+                        _render_recommendation_card(i, rec)
+            elif enrichment is None:
+                st.info("未找到替代方案")
+
+    fast_recommendations = (fast_recommendations or [])[:max_cards]
+    render(fast_recommendations, "⏳ 以下为 Nexar 数据中的替代件，DeepSeek 国产推荐与Pin兼容分析进行中..."
+           if enrichment is not None else "")
+    if fast_recommendations:
+        _record_first_card_time(start_time)
+    if enrichment is None:
+        return fast_recommendations
+
+    with st.spinner("🔄 DeepSeek 正在补充国产推荐与Pin兼容分析..."):
+        try:
+            recommendations, recorded_events = enrichment.result()
+        except Exception as e:
+            st.warning(f"DeepSeek 推荐失败，仅显示 Nexar 数据中的替代件：{e}")
+            recommendations, recorded_events = [], []
+    # 显示后台任务中发出的提示与调试信息
+    events.replay(recorded_events)
+    if not recommendations:
+        recommendations = fast_recommendations
+    elif not fast_recommendations:
+        _record_first_card_time(start_time)
+    recommendations = recommendations[:max_cards]
+    render(recommendations, "✅ 已合并 DeepSeek 国产推荐与Pin兼容分析")
+    if not recommendations:
+        st.info("未找到替代方案")
+    return recommendations
@@ -0,0 +1,497 @@
+"""持久化的批量任务队列（SQLite）：批量风险评估 / 替代方案查询在后台工作线程中执行，与浏览器会话无关
+
+任务与每个元器件的状态保存在 JOB_DB_PATH 中，页面刷新、关闭或重新运行脚本都不会丢失已完成的工作：
+- 任务状态：queued → running → succeeded / partial（部分元器件失败）/ failed（任务异常）/ cancelled；
+- 元器件状态：pending → done / failed，取消时未处理的元器件为 cancelled；
+- 工作线程按块（JOB_CHUNK_SIZE）处理待处理的元器件，每块完成后立即写入结果，取消请求在块之间生效；
+- retry_failed() 只把失败的元器件重新排队，已完成的元器件不再调用API；
+- 工作线程定期刷新任务的心跳，进程退出后超过 JOB_LEASE_SECONDS 没有心跳的任务由其他（或重启后的）
+  工作线程接手，从未处理的元器件继续。
+
+Streamlit 应用与 HTTP 服务通过 get_job_queue() 共享进程内的队列；也可以单独运行工作进程
+（此时可在应用中设置 JOB_WORKERS=0，只提交任务）：
+    python jobqueue.py --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import events
+
+logger = logging.getLogger("bom_tool.jobs")
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "0"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+TASKS = ("risk", "alternatives")
+ACTIVE_STATUSES = ("queued", "running")
+ITEM_STATUSES = ("pending", "done", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    total INTEGER NOT NULL,
+    active_done INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat REAL,
+    stats TEXT NOT NULL DEFAULT '{}',
+    messages TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    mpn TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items (job_id, status);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+class LeaseLost(Exception):
+    """任务已被其他工作线程接手（本线程的心跳超时）"""
+
+
+class JobQueue:
+    """SQLite 任务队列与进程内的工作线程
+
+    每次数据库操作使用独立的连接，写操作在 BEGIN IMMEDIATE 事务中执行，
+    多个线程、多个进程可以共用同一个数据库文件。
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, workers=JOB_WORKERS, lease_seconds=JOB_LEASE_SECONDS,
+                 poll_seconds=JOB_POLL_SECONDS, chunk_size=JOB_CHUNK_SIZE):
+        self.db_path = db_path
+        self.workers = max(0, workers)
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.chunk_size = chunk_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running = set()  # 本进程正在执行的任务ID（心跳线程据此续约）
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        self.purge(JOB_RETENTION_DAYS * 24 * 3600)
+
+    # ---------- 数据库 ----------
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _closing(conn)
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    # ---------- 提交与查询 ----------
+    def submit(self, task, components, options=None, source=""):
+        """提交任务，返回任务ID（型号重复的元器件只保留第一个）"""
+        if task not in TASKS:
+            raise ValueError(f"未知的任务类型：{task}")
+        items, seen = [], set()
+        for component in components:
+            mpn = str(component.get('mpn') or '').strip()
+            if mpn and mpn not in seen:
+                seen.add(mpn)
+                items.append((mpn, str(component.get('name') or ''), str(component.get('description') or '')))
+        if not items:
+            raise ValueError("没有可处理的元器件")
+
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO jobs (id, task, source, status, options, total, created) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                         (job_id, task, source, json.dumps(options or {}), len(items), time.time()))
+            conn.executemany("INSERT INTO job_items (job_id, idx, mpn, name, description) VALUES (?, ?, ?, ?, ?)",
+                             [(job_id, idx, *item) for idx, item in enumerate(items)])
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """任务状态与进度，任务不存在时返回 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict.fromkeys(ITEM_STATUSES, 0)
+            counts.update(conn.execute("SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+                                       (job_id,)).fetchall())
+        return _job_dict(row, counts)
+
+    def list_jobs(self, limit=20):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [job for job in (self.get(row["id"]) for row in rows) if job]
+
+    def items(self, job_id, status=None):
+        """任务中每个元器件的状态（按提交顺序），status 为 None 时返回全部"""
+        query = "SELECT * FROM job_items WHERE job_id = ?" + (" AND status = ?" if status else "") + " ORDER BY idx"
+        with self._connect() as conn:
+            rows = conn.execute(query, (job_id, status) if status else (job_id,)).fetchall()
+        return [{"idx": row["idx"], "mpn": row["mpn"], "name": row["name"], "description": row["description"],
+                 "status": row["status"], "error": row["error"], "attempts": row["attempts"],
+                 "result": json.loads(row["result"]) if row["result"] else None} for row in rows]
+
+    def results(self, job_id):
+        """已处理元器件的结果 {型号: 结果}（按提交顺序，包含失败的元器件），格式与 reports 的输入一致"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT mpn, result FROM job_items WHERE job_id = ? AND status IN ('done', 'failed') "
+                                "AND result IS NOT NULL ORDER BY idx", (job_id,)).fetchall()
+        return {row["mpn"]: json.loads(row["result"]) for row in rows}
+
+    # ---------- 取消与重试 ----------
+    def cancel(self, job_id):
+        """取消任务：排队中的任务立即取消，执行中的任务在当前块完成后停止。返回任务是否仍在进行"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] not in ACTIVE_STATUSES:
+                return False
+            if row["status"] == "queued":
+                self._mark_cancelled(conn, job_id)
+            else:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return True
+
+    def retry_failed(self, job_id):
+        """只把失败的元器件（以及任务异常中断时未处理的元器件）重新排队，返回重新排队的数量"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] in ACTIVE_STATUSES:
+                return 0
+            count = conn.execute("UPDATE job_items SET status = 'pending', error = NULL "
+                                 "WHERE job_id = ? AND status = 'failed'", (job_id,)).rowcount
+            if row["status"] == "failed":
+                count += conn.execute("SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status = 'pending'",
+                                      (job_id,)).fetchone()[0]
+            if count:
+                conn.execute("UPDATE jobs SET status = 'queued', cancel_requested = 0, error = NULL, finished = NULL, "
+                             "active_done = 0, worker = NULL WHERE id = ?", (job_id,))
+        if count:
+            self._wake.set()
+        return count
+
+    def purge(self, max_age_seconds):
+        """删除结束超过 max_age_seconds 的任务"""
+        cutoff = time.time() - max_age_seconds
+        with self._transaction() as conn:
+            ids = [row["id"] for row in conn.execute("SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                                                     (cutoff,)).fetchall()]
+            for job_id in ids:
+                conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+    @staticmethod
+    def _mark_cancelled(conn, job_id):
+        conn.execute("UPDATE job_items SET status = 'cancelled' WHERE job_id = ? AND status = 'pending'", (job_id,))
+        conn.execute("UPDATE jobs SET status = 'cancelled', finished = ?, active_done = 0 WHERE id = ?",
+                     (time.time(), job_id))
+
+    # ---------- 工作线程 ----------
+    def start(self):
+        """启动工作线程与心跳线程（workers 为 0 时只提交任务，由其他进程执行）"""
+        if self._threads or not self.workers:
+            return self
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True))
+        self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                logger.exception("failed to claim a job")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception:
+                logger.exception("job %s: failed to record the outcome", job["id"])
+            finally:
+                with self._lock:
+                    self._running.discard(job["id"])
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    with self._transaction() as conn:
+                        conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?",
+                                     (time.time(), job_id, self.worker_id))
+                except sqlite3.Error:
+                    logger.exception("failed to renew the lease of job %s", job_id)
+
+    def _claim(self):
+        """领取最早的排队任务，或心跳超时的执行中任务（其工作进程已退出）"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+                               "ORDER BY created LIMIT 1", (now - self.lease_seconds,)).fetchone()
+            if row is None:
+                return None
+            if row["status"] == "running":
+                logger.warning("job %s: lease of %s expired, resuming", row["id"], row["worker"])
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, started = COALESCE(started, ?), "
+                         "active_done = 0 WHERE id = ?", (self.worker_id, now, now, row["id"]))
+        with self._lock:
+            self._running.add(row["id"])
+        return dict(row)
+
+    def _run(self, job):
+        from backend import BATCH_MAX_WORKERS, RISK_BATCH_SIZE
+
+        job_id = job["id"]
+        options = json.loads(job["options"] or "{}")
+        stats = json.loads(job["stats"] or "{}")
+        max_workers = options.get("max_workers") or BATCH_MAX_WORKERS
+        risk_batch_size = options.get("risk_batch_size") or RISK_BATCH_SIZE
+        # 默认每块恰好让所有并发请求满载：风险评估 max_workers 个批量调用，替代方案查询每个线程约 4 个元器件
+        chunk_size = self.chunk_size or (max_workers * risk_batch_size if job["task"] == "risk" else max_workers * 4)
+        stats.update(max_workers=max_workers, risk_batch_size=risk_batch_size if job["task"] == "risk" else None)
+        sink = events.CollectingSink(limit=50, kinds=("warning", "error"))
+        try:
+            with events.use_sink(sink):
+                while not self._stop.is_set():
+                    chunk, cancel_requested = self._next_chunk(job_id, chunk_size)
+                    if cancel_requested or not chunk:
+                        break
+                    start = time.perf_counter()
+                    outcomes = self._process_chunk(job_id, job["task"], chunk, max_workers, risk_batch_size, stats)
+                    elapsed = time.perf_counter() - start
+                    stats["elapsed_seconds"] = round(stats.get("elapsed_seconds", 0) + elapsed, 3)
+                    stats["processed"] = stats.get("processed", 0) + len(chunk)
+                    stats["parts_per_second"] = round(stats["processed"] / stats["elapsed_seconds"], 3) \
+                        if stats["elapsed_seconds"] > 0 else 0.0
+                    self._commit_chunk(job_id, outcomes, stats, sink.snapshot())
+            if self._stop.is_set():
+                self._release(job_id)
+            else:
+                self._finish(job_id)
+        except LeaseLost:
+            logger.warning("job %s was taken over by another worker", job_id)
+        except Exception as e:
+            logger.exception("job %s failed", job_id)
+            with self._transaction() as conn:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ?, active_done = 0 "
+                             "WHERE id = ? AND worker = ?", (str(e), time.time(), job_id, self.worker_id))
+
+    def _next_chunk(self, job_id, chunk_size):
+        with self._connect() as conn:
+            job = conn.execute("SELECT worker, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None or job["worker"] != self.worker_id:
+                raise LeaseLost(job_id)
+            rows = conn.execute("SELECT idx, mpn, name, description FROM job_items WHERE job_id = ? AND status = 'pending' "
+                                "ORDER BY idx LIMIT ?", (job_id, chunk_size)).fetchall()
+        return [dict(row) for row in rows], bool(job["cancel_requested"])
+
+    def _process_chunk(self, job_id, task, chunk, max_workers, risk_batch_size, stats):
+        """处理一块元器件，返回 [(idx, 状态, 结果, 错误)]"""
+        from backend import batch_get_alternative_parts, batch_lookup_alternatives_direct
+
+        progress = _ProgressWriter(self, job_id)
+        outcomes = []
+        if task == "risk":
+            results = batch_get_alternative_parts(
+                chunk, progress_callback=lambda fraction, text: progress.update(round(fraction * len(chunk))),
+                max_workers=max_workers, risk_batch_size=risk_batch_size)
+            results.pop("__eol_warnings__", None)
+            batch_stats = results.pop("__batch_stats__", {})
+            stats["requests"] = stats.get("requests", 0) + batch_stats.get("requests", 0)
+            for item in chunk:
+                result = results.get(item["mpn"])
+                if result is None:
+                    outcomes.append((item["idx"], "failed", None, "没有返回结果"))
+                    continue
+                failed = result.pop("failed", False)
+                outcomes.append((item["idx"], "failed" if failed else "done", result, result["status"] if failed else None))
+        else:
+            done = 0
+
+            def on_result(mpn, entry):
+                nonlocal done
+                done += 1
+                progress.update(done)
+
+            results = batch_lookup_alternatives_direct(chunk, max_workers, on_result)
+            for item in chunk:
+                entry = results.get(item["mpn"])
+                failed = entry is None or entry.pop("failed")
+                outcomes.append((item["idx"], "failed" if failed else "done", entry, "查询失败" if failed else None))
+        return outcomes
+
+    def _commit_chunk(self, job_id, outcomes, stats, messages):
+        now = time.time()
+        with self._transaction() as conn:
+            owner = conn.execute("SELECT worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if owner is None or owner["worker"] != self.worker_id:
+                raise LeaseLost(job_id)
+            conn.executemany(
+                "UPDATE job_items SET status = ?, result = ?, error = ?, attempts = attempts + 1, updated = ? "
+                "WHERE job_id = ? AND idx = ?",
+                [(status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, now, job_id, idx)
+                 for idx, status, result, error in outcomes])
+            conn.execute("UPDATE jobs SET active_done = 0, heartbeat = ?, stats = ?, messages = ? WHERE id = ?",
+                         (now, json.dumps(stats), json.dumps([{"kind": m["kind"], "message": m["message"]} for m in messages],
+                                                             ensure_ascii=False), job_id))
+
+    def _release(self, job_id):
+        """停止工作线程时把任务放回队列，由其他工作线程（或重启后）继续"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, active_done = 0 WHERE id = ? AND worker = ?",
+                         (job_id, self.worker_id))
+
+    def _finish(self, job_id):
+        with self._transaction() as conn:
+            job = conn.execute("SELECT worker, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None or job["worker"] != self.worker_id:
+                raise LeaseLost(job_id)
+            if job["cancel_requested"]:
+                self._mark_cancelled(conn, job_id)
+                return
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+                                       (job_id,)).fetchall())
+            # 重试取消过的任务中失败的元器件后，仍有未处理（已取消）的元器件
+            status = "partial" if counts.get("failed") else ("cancelled" if counts.get("cancelled") else "succeeded")
+            conn.execute("UPDATE jobs SET status = ?, finished = ?, active_done = 0 WHERE id = ?",
+                         (status, time.time(), job_id))
+
+
+class _ProgressWriter:
+    """把块内进度写入 jobs.active_done（每个任务最多每秒写一次），同时续约心跳"""
+
+    def __init__(self, queue, job_id, interval=1.0):
+        self.queue = queue
+        self.job_id = job_id
+        self.interval = interval
+        self._last = 0.0
+
+    def update(self, active_done):
+        now = time.time()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        try:
+            with self.queue._transaction() as conn:
+                conn.execute("UPDATE jobs SET active_done = ?, heartbeat = ? WHERE id = ? AND worker = ?",
+                             (active_done, now, self.job_id, self.queue.worker_id))
+        except sqlite3.Error:
+            logger.exception("failed to record progress of job %s", self.job_id)
+
+
+@contextmanager
+def _closing(conn):
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _job_dict(row, counts):
+    processed = counts["done"] + counts["failed"]
+    active_done = row["active_done"] if row["status"] == "running" else 0
+    total = row["total"]
+    return {
+        "job_id": row["id"],
+        "task": row["task"],
+        "source": row["source"],
+        "status": row["status"],
+        "total": total,
+        "counts": counts,
+        "processed": processed,
+        "progress": round(min(total, processed + active_done) / total, 4) if total else 1.0,
+        "cancel_requested": bool(row["cancel_requested"]),
+        "created": row["created"],
+        "started": row["started"],
+        "finished": row["finished"],
+        "error": row["error"],
+        "stats": json.loads(row["stats"] or "{}"),
+        "messages": json.loads(row["messages"] or "[]"),
+    }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """返回进程共享的任务队列，第一次调用时创建并启动工作线程（接手心跳超时的任务）"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue().start()
+    return _queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量任务工作进程")
+    parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS), help="同时执行的任务数")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试信息")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    queue = JobQueue(workers=args.workers).start()
+    logger.info("job worker %s processing %s with %d workers", queue.worker_id, queue.db_path, queue.workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        queue.stop()
+
+
+if __name__ == "__main__":
+    main()
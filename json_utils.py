@@ -0,0 +1,243 @@
+"""大模型返回内容的JSON解析工具"""
+import json
+import re
+
+_CLOSERS = {'[': ']', '{': '}'}
+_PY_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+# 价格只有数字或数字范围（没有货币符号）时默认按美元处理
+_BARE_PRICE_PATTERN = re.compile(r'^[\d\.\-\s]+$')
+
+
+# 单遍扫描的记号：不含特殊字符的连续片段（双引号字符串、冒号、数字、空白）整段作为一个记号，
+# 其余为单引号字符串、未闭合的引号、括号与逗号、裸单词；整段文本由 findall 一次切分
+_TOKEN_PATTERN = re.compile(r'''(?:"[^"\\]*(?:\\.[^"\\]*)*"|[^"'\[\]{},A-Za-z_]+)+|'[^'\\]*(?:\\.[^'\\]*)*'|["']|[\[\]{},]|[A-Za-z_]\w*''')
+_OPENER_PATTERN = re.compile(r'[\[{]')
+# 最多尝试的起始位置数（说明文字中偶尔出现的括号）
+_MAX_CANDIDATES = 8
+
+
+def _repair_from(text, start):
+    """从 start 处的 [ 或 { 开始单遍扫描，返回修复后的JSON文本
+
+    扫描时同时完成：单引号字符串转双引号、去除 ]/} 前多余的逗号、Python 字面量
+    True/False/None 转为 JSON 字面量；遇到最外层容器闭合即停止。字符串中未转义的换行
+    由调用方以 strict=False 解析。输出被截断（例如达到 max_tokens）时，丢弃最后一个
+    不完整的元素并补全括号。
+    """
+    out = []
+    append = out.append
+    depth = 0
+    opener = text[start]
+    last_complete = None    # 最外层容器中最后一个完整元素之后的输出位置
+    comma_at = None         # 最近一个逗号在输出中的位置（其后只有空白时为尾随逗号）
+    for token in _TOKEN_PATTERN.findall(text, start):
+        first = token[0]
+        if first in '[{':
+            depth += 1
+            append(token)
+            comma_at = None
+        elif first in ']}':
+            if comma_at is not None:
+                out[comma_at] = ''
+                comma_at = None
+            depth -= 1
+            append(token)
+            if depth == 0:
+                return ''.join(out)
+            if depth == 1:
+                last_complete = len(out)
+        elif first == ',':
+            if depth == 1:
+                last_complete = len(out)
+            comma_at = len(out)
+            append(token)
+        elif token.isspace():
+            append(token)
+        elif first == "'" or token == '"':
+            if len(token) == 1:
+                # 未闭合的字符串：内容被截断
+                break
+            inner = token[1:-1].replace("\\'", "'").replace('\\"', '"').replace('"', '\\"')
+            append('"' + inner + '"')
+            comma_at = None
+        else:
+            append(_PY_LITERALS.get(token, token))
+            comma_at = None
+
+    # 内容被截断：保留最后一个完整元素并补全最外层括号
+    if depth > 0 and last_complete is not None:
+        return ''.join(out[:last_complete]) + _CLOSERS[opener]
+    return None
+
+
+def _candidate_starts(text, prefer):
+    """修复扫描的起始位置：prefer 类型的第一个开括号优先，其余开括号按出现顺序"""
+    preferred = text.find(prefer)
+    if preferred >= 0:
+        yield preferred
+    for match in _OPENER_PATTERN.finditer(text):
+        if match.start() != preferred:
+            yield match.start()
+
+
+def extract_json(text, prefer='['):
+    """从大模型返回的文本中提取最外层的JSON数组或对象，失败时返回 None
+
+    先直接解析，再尝试 prefer 类型的第一个开括号到最后一个闭括号之间的内容
+    （覆盖 ```json 代码块和前后说明文字）；仍失败时从开括号处单遍扫描并修复
+    尾随逗号、单引号、被截断的结尾等问题，在第一个能解析的起始位置停止。
+    """
+    if not isinstance(text, str):
+        return None
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    opener = prefer if prefer in text else ('{' if prefer == '[' else '[')
+    start = text.find(opener)
+    end = text.rfind(_CLOSERS[opener])
+    if 0 <= start < end and (start, end) != (0, len(text) - 1):
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+
+    for attempt, start in enumerate(_candidate_starts(text, prefer)):
+        if attempt >= _MAX_CANDIDATES:
+            break
+        repaired = _repair_from(text, start)
+        if repaired is None:
+            continue
+        try:
+            return json.loads(repaired, strict=False)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def extract_json_array(text):
+    """提取JSON数组；返回对象时取其中第一个数组字段，或把单个对象当作只有一个元素的数组"""
+    data = extract_json(text, prefer='[')
+    if isinstance(data, dict):
+        nested = next((value for value in data.values() if isinstance(value, list)), None)
+        data = nested if nested is not None else [data]
+    return data if isinstance(data, list) else None
+
+
+def normalize_recommendation(item):
+    """补全替代方案推荐项缺少的字段，并为不带货币符号的价格加上美元符号"""
+    # 确保基本字段存在
+    item["model"] = item.get("model", "未知型号")
+    item["brand"] = item.get("brand", "未知品牌")
+    item["parameters"] = item.get("parameters", "参数未知")
+    item["type"] = item.get("type", "未知")
+    item["datasheet"] = item.get("datasheet", "https://www.example.com/datasheet")
+    item["category"] = item.get("category", "未知类别")
+    item["package"] = item.get("package", "未知封装")
+
+    # 确保价格包含货币符号
+    price = item.get("price", "未知")
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        price = str(price)
+    if isinstance(price, str) and price != "未知" and not any(symbol in price for symbol in ["¥", "￥", "$"]):
+        if _BARE_PRICE_PATTERN.match(price):
+            # 处理类似 "1.8-2.5" 的价格范围
+            if "-" in price:
+                price_parts = price.split("-")
+                price = f"${price_parts[0].strip()}-${price_parts[1].strip()}"
+            else:
+                price = f"${price.strip()}"
+    item["price"] = price
+
+    # 物料状态与 pin-to-pin 替代信息
+    item["status"] = item.get("status", "未知")
+    item["leadTime"] = item.get("leadTime", "未知")
+    item["pinToPin"] = item.get("pinToPin", False)
+    item["compatibility"] = item.get("compatibility", "兼容性未知")
+    return item
+
+
+class IncrementalJsonArrayParser:
+    """增量解析流式返回的JSON数组，每个数组元素（对象）一完整就立即返回
+
+    支持裸数组 [{...}, {...}] 以及外层包一层对象的 {"recommendations": [{...}]}，
+    数组之前的说明文字或 ```json 代码块标记会被忽略。单个元素解析失败时跳过该元素。
+
+    用法：
+        parser = IncrementalJsonArrayParser()
+        for text in stream:
+            for obj in parser.feed(text):
+                ...
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._stack = []         # 当前所在的容器类型：'[' 或 '{'
+        self._in_string = False
+        self._escape = False
+        self._item_start = None  # 当前元素在缓冲区中的起始位置
+        self._pos = 0
+        self.items_parsed = 0
+        self.items_skipped = 0
+
+    def _is_item_container(self):
+        """栈顶数组是否为“元素数组”：最外层数组，或最外层对象中的数组"""
+        if not self._stack or self._stack[-1] != '[':
+            return False
+        depth = len(self._stack)
+        return depth == 1 or (depth == 2 and self._stack[0] == '{')
+
+    def feed(self, text):
+        """追加一段文本，返回本次新完成的对象列表"""
+        if not text:
+            return []
+        self._buffer.append(text)
+        completed = []
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                # 数组开始之前的引号（说明文字）不计入字符串状态
+                if self._stack:
+                    self._in_string = True
+            elif ch in '[{':
+                if ch == '{' and self._item_start is None and self._is_item_container():
+                    self._item_start = self._pos
+                self._stack.append(ch)
+            elif ch in ']}':
+                if self._stack:
+                    self._stack.pop()
+                if ch == '}' and self._item_start is not None and self._is_item_container():
+                    completed.append((self._item_start, self._pos + 1))
+                    self._item_start = None
+            self._pos += 1
+
+        if not completed:
+            return []
+        full_text = ''.join(self._buffer)
+        self._buffer = [full_text]
+        objects = []
+        for start, end in completed:
+            try:
+                obj = json.loads(full_text[start:end])
+            except json.JSONDecodeError:
+                self.items_skipped += 1
+                continue
+            if isinstance(obj, dict):
+                self.items_parsed += 1
+                objects.append(obj)
+        return objects
+
+    @property
+    def text(self):
+        """目前为止收到的全部文本"""
+        return ''.join(self._buffer)
@@ -2,32 +2,133 @@
 import requests
 import base64
 import json
+import random
+import re
+import threading
 import time
-from typing import Dict
+import asyncio
+from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
 
 NEXAR_URL = "https://api.nexar.com/graphql"
 PROD_TOKEN_URL = "https://identity.nexar.com/connect/token"
 
-def get_token(client_id, client_secret):
+# 需要退避重试的HTTP状态码（限流与服务端错误）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class NexarError(Exception):
+    """Base class for all Nexar client errors."""
+
+
+class NexarAuthError(NexarError):
+    """Raised when a Nexar access token cannot be obtained.
+
+    `status_code` is the token endpoint's HTTP status (None if it could not be
+    reached); `rejected` is True when the credentials themselves are missing or
+    were refused, as opposed to the identity service being unavailable.
+    """
+
+    def __init__(self, message, status_code=None, rejected=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.rejected = rejected
+
+
+class NexarTransportError(NexarError):
+    """Raised when the Nexar API cannot be reached or keeps failing after retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class NexarGraphQLError(NexarError):
+    """Raised when Nexar answers with GraphQL errors."""
+
+    def __init__(self, errors):
+        self.errors = errors or []
+        messages = "; ".join(str(error.get("message", error)) for error in self.errors if isinstance(error, dict))
+        super().__init__(messages or "Nexar GraphQL error")
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (milliseconds)."""
+
+    BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS_MS)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, latency_ms):
+        for i, upper in enumerate(self.BUCKETS_MS):
+            if latency_ms <= upper:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, q):
+        """Return the bucket upper bound below which a fraction q of requests fall."""
+        if not self.total:
+            return 0.0
+        threshold = q * self.total
+        cumulative = 0
+        for upper, count in zip(self.BUCKETS_MS, self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return round(min(upper, self.max_ms), 1)
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        return {
+            "count": self.total,
+            "avg_ms": round(self.sum_ms / self.total, 1) if self.total else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {("+Inf" if upper == float("inf") else f"<={upper}ms"): count
+                        for upper, count in zip(self.BUCKETS_MS, self.counts)},
+        }
+
+
+def get_token(client_id, client_secret, timeout=(5, 15), token_url=PROD_TOKEN_URL):
     """Return the Nexar token from the client_id and client_secret provided."""
 
     if not client_id or not client_secret:
-        raise Exception("client_id and/or client_secret are empty")
+        raise NexarAuthError("client_id and/or client_secret are empty", rejected=True)
 
-    token = {}
     try:
-        token = requests.post(
-            url=PROD_TOKEN_URL,
+        response = requests.post(
+            url=token_url,
             data={
                 "grant_type": "client_credentials",
                 "client_id": client_id,
                 "client_secret": client_secret
             },
             allow_redirects=False,
-        ).json()
+            timeout=timeout,
+        )
+    except Exception as e:
+        raise NexarAuthError(f"Error while getting Nexar token: {e}") from e
+
+    # OAuth 以 400（invalid_client 等）/ 401 / 403 拒绝凭据，其余错误视为身份服务不可用
+    rejected = response.status_code in (400, 401, 403)
+    try:
+        token = response.json()
+    except ValueError as e:
+        raise NexarAuthError(f"Nexar token endpoint returned HTTP {response.status_code} with a non-JSON body: {e}",
+                             status_code=response.status_code, rejected=rejected) from e
 
-    except Exception:
-        raise
+    if not isinstance(token, dict) or not token.get("access_token"):
+        error = token.get("error", token) if isinstance(token, dict) else token
+        raise NexarAuthError(f"Nexar token response (HTTP {response.status_code}) has no access_token: {error}",
+                             status_code=response.status_code, rejected=rejected)
 
     return token
 def decodeJWT(token):
@@ -35,39 +136,370 @@ def decodeJWT(token):
         (base64.urlsafe_b64decode(token.split(".")[1] + "==")).decode("utf-8")
     )
 
+class TokenManager:
+    """Thread-safe Nexar token holder with proactive background refresh.
+
+    A daemon thread renews the token `refresh_margin` seconds before it
+    expires, so callers normally get the current token without blocking.
+    Only when no usable token exists (first use, or background refresh kept
+    failing until the token is about to expire) does a caller fetch one
+    synchronously, and a lock ensures just one thread hits PROD_TOKEN_URL.
+    """
+
+    def __init__(self, client_id, client_secret, token_url=PROD_TOKEN_URL, timeout=(5, 15),
+                 refresh_margin: float = 300, min_validity: float = 30) -> None:
+        self.client_id = client_id
+        self.secret = client_secret
+        self.token_url = token_url
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+
+        self._token = {}
+        self._exp = 0
+        self._state_lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"refreshes": 0, "blocking_refreshes": 0, "failures": 0}
+
+    @property
+    def token(self) -> dict:
+        with self._state_lock:
+            return self._token
+
+    @property
+    def exp(self) -> float:
+        with self._state_lock:
+            return self._exp
+
+    def is_fresh(self) -> bool:
+        """True if the current token can be handed out without blocking."""
+        return self.exp > time.time() + self.min_validity
+
+    def _fetch_locked(self) -> None:
+        """Fetch a new token; the caller must hold _fetch_lock."""
+        token = get_token(self.client_id, self.secret, timeout=self.timeout, token_url=self.token_url)
+        exp = decodeJWT(token.get('access_token')).get('exp')
+        with self._state_lock:
+            self._token = token
+            self._exp = exp
+            self.stats["refreshes"] += 1
+
+    def get(self) -> str:
+        """Return a valid access token, blocking only if none is usable."""
+        if not self.is_fresh():
+            with self._fetch_lock:
+                # 等锁期间可能已被其他线程刷新
+                if not self.is_fresh():
+                    with self._state_lock:
+                        self.stats["blocking_refreshes"] += 1
+                    self._fetch_locked()
+            self._ensure_background_refresh()
+        with self._state_lock:
+            return self._token.get('access_token')
+
+    def _ensure_background_refresh(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="nexar-token-refresh", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        failures = 0
+        while not self._stop.is_set():
+            wait = self.exp - self.refresh_margin - time.time()
+            if wait > 0:
+                if self._stop.wait(wait):
+                    return
+                continue
+            try:
+                with self._fetch_lock:
+                    # 调用方可能刚刚同步刷新过
+                    if self.exp - self.refresh_margin <= time.time():
+                        self._fetch_locked()
+                failures = 0
+            except NexarError:
+                failures += 1
+                with self._state_lock:
+                    self.stats["failures"] += 1
+                if self._stop.wait(min(60, 5 * (2 ** (failures - 1)))):
+                    return
+
+    def stop(self) -> None:
+        self._stop.set()
+
+def _operation_name(query: str) -> str:
+    match = re.search(r"(?:query|mutation)\s+(\w+)", query)
+    return match.group(1) if match else "anonymous"
+
+def _backoff_delay(attempt: int, backoff_factor: float, backoff_max: float, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter; honours Retry-After when present."""
+    if retry_after:
+        try:
+            return min(backoff_max, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(backoff_max, backoff_factor * (2 ** attempt)))
+
+def _is_upstream_failure(error: Exception) -> bool:
+    """Whether an error means Nexar itself is unhealthy (counts against the circuit breaker).
+
+    Token failures count when the identity service is unreachable or answers with a
+    retryable status; credentials that are missing or refused (400/401/403) do not.
+    """
+    if isinstance(error, NexarAuthError) and error.rejected:
+        return False
+    if isinstance(error, (NexarTransportError, NexarAuthError)):
+        return error.status_code is None or error.status_code in RETRY_STATUS_CODES
+    return False
+
+def _parse_graphql_response(status_code: int, text: str, payload_loader) -> dict:
+    """Validate a final (non-retried) HTTP response and return its GraphQL data."""
+    if status_code >= 400:
+        raise NexarTransportError(f"Nexar returned HTTP {status_code}: {text[:200]}", status_code=status_code)
+
+    try:
+        response = payload_loader()
+    except ValueError as e:
+        raise NexarTransportError(f"Nexar returned a non-JSON response: {e}", status_code=status_code) from e
+
+    if ("errors" in response):
+        raise NexarGraphQLError(response["errors"])
+
+    return response["data"]
+
 class NexarClient:
-    def __init__(self, id, secret) -> None:
+    def __init__(self, id, secret, pool_size: int = 10, connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, backoff_max: float = 10.0,
+                 url: str = NEXAR_URL, token_url: str = PROD_TOKEN_URL, circuit_breaker=None) -> None:
         self.id = id
         self.secret = secret
+        self.url = url
+        self.token_url = token_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        # Optional circuit_breaker.CircuitBreaker shared with other clients of the same upstream
+        self.circuit_breaker = circuit_breaker
+
+        # 持久连接池：多个线程共享同一组 keep-alive 连接
         self.s = requests.session()
-        self.s.keep_alive = False
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._stats_lock = threading.Lock()
+
+        # The first token is fetched lazily by the first query, so constructing a client never blocks on the network
+        self.tokens = TokenManager(id, secret, token_url=self.token_url, timeout=self.timeout)
+
+    @property
+    def token(self) -> dict:
+        return self.tokens.token
+
+    @property
+    def exp(self) -> float:
+        return self.tokens.exp
 
-        self.token = get_token(id, secret)
-        self.s.headers.update({"token": self.token.get('access_token')})
-        self.exp = decodeJWT(self.token.get('access_token')).get('exp')
+    def check_exp(self) -> str:
+        """Return a valid access token; renewal normally happens in the background."""
+        return self.tokens.get()
 
-    def check_exp(self):
-        if (self.exp < time.time() + 300):
-            self.token = get_token(self.id, self.secret)
-            self.s.headers.update({"token": self.token.get('access_token')})
-            self.exp = decodeJWT(self.token.get('access_token')).get('exp')
+    def _record_latency(self, operation: str, latency_ms: float) -> None:
+        with self._stats_lock:
+            self._histograms.setdefault(operation, LatencyHistogram()).observe(latency_ms)
+
+    def latency_stats(self) -> Dict[str, dict]:
+        """Return latency histogram snapshots keyed by GraphQL operation name."""
+        with self._stats_lock:
+            return {operation: histogram.snapshot() for operation, histogram in self._histograms.items()}
 
     def get_query(self, query: str, variables: Dict) -> dict:
-        """Return Nexar response for the query."""
+        """Return Nexar response for the query.
+
+        With a circuit breaker, fails fast with CircuitOpenError while the circuit is open.
+        """
+        if self.circuit_breaker is None:
+            return self._send_query(query, variables)
+        self.circuit_breaker.before_call()
         try:
-            self.check_exp()
-            r = self.s.post(
-                NEXAR_URL,
-                json={"query": query, "variables": variables},
-            )
+            data = self._send_query(query, variables)
+        except Exception as e:
+            if _is_upstream_failure(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            raise
+        self.circuit_breaker.record_success()
+        return data
+
+    def _send_query(self, query: str, variables: Dict) -> dict:
+        operation = _operation_name(query)
+
+        access_token = self.check_exp()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                r = self.s.post(
+                    self.url,
+                    json={"query": query, "variables": variables},
+                    headers={"token": access_token},
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = NexarTransportError(f"Error while getting Nexar response: {e}")
+                retry_after = None
+            else:
+                self._record_latency(operation, (time.perf_counter() - start) * 1000)
+                if r.status_code not in RETRY_STATUS_CODES:
+                    break
+                last_error = NexarTransportError(f"Nexar returned HTTP {r.status_code}", status_code=r.status_code)
+                retry_after = r.headers.get("Retry-After")
+
+            if attempt < self.max_retries:
+                time.sleep(_backoff_delay(attempt, self.backoff_factor, self.backoff_max, retry_after))
+        else:
+            raise last_error
+
+        return _parse_graphql_response(r.status_code, r.text, r.json)
+
+
+class AsyncNexarClient:
+    """asyncio-native Nexar client for high-concurrency batch pipelines.
+
+    Uses one shared httpx connection pool and an asyncio.Semaphore to cap the
+    number of in-flight GraphQL requests, so hundreds of lookups can run on a
+    single event loop. Tokens come from the same TokenManager as NexarClient
+    (background refresh); create and use an instance inside one event loop.
 
+    The pool is capped at MAX_POOL_SIZE connections: httpcore's pool does work
+    proportional to the number of connections on every request, so beyond
+    ~20 connections client CPU rather than network latency limits throughput.
+    In-flight requests are capped at the pool size so extra callers wait on
+    the semaphore instead of in httpcore's pool queue.
+    """
+
+    MAX_POOL_SIZE = 20
+
+    def __init__(self, id, secret, max_concurrency: int = 20, pool_size: int = 20,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, backoff_max: float = 10.0,
+                 url: str = NEXAR_URL, token_url: str = PROD_TOKEN_URL, circuit_breaker=None) -> None:
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("AsyncNexarClient requires httpx: pip install httpx") from e
+
+        self.id = id
+        self.secret = secret
+        self.url = url
+        self.token_url = token_url
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.circuit_breaker = circuit_breaker
+        self._httpx = httpx
+        pool_size = min(pool_size, self.MAX_POOL_SIZE)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self.semaphore = asyncio.Semaphore(min(max_concurrency, pool_size))
+        self._refresh_lock = asyncio.Lock()
+        self.tokens = TokenManager(id, secret, token_url=token_url, timeout=(connect_timeout, read_timeout))
+
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    async def __aenter__(self):
+        await self.check_exp()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        self.tokens.stop()
+        await self.client.aclose()
+
+    @property
+    def token(self) -> dict:
+        return self.tokens.token
+
+    @property
+    def exp(self) -> float:
+        return self.tokens.exp
+
+    async def check_exp(self) -> str:
+        """Return a valid access token without blocking the event loop."""
+        if self.tokens.is_fresh():
+            return self.tokens.get()
+        # One coroutine refreshes in a worker thread; the rest wait on the loop
+        # instead of each parking a default-executor thread on TokenManager's lock.
+        async with self._refresh_lock:
+            if self.tokens.is_fresh():
+                return self.tokens.get()
+            return await asyncio.to_thread(self.tokens.get)
+
+    def latency_stats(self) -> Dict[str, dict]:
+        """Return latency histogram snapshots keyed by GraphQL operation name."""
+        return {operation: histogram.snapshot() for operation, histogram in self._histograms.items()}
+
+    async def get_query(self, query: str, variables: Dict) -> dict:
+        """Return Nexar response for the query (fails fast while the circuit breaker is open)."""
+        if self.circuit_breaker is None:
+            return await self._send_query(query, variables)
+        self.circuit_breaker.before_call()
+        try:
+            data = await self._send_query(query, variables)
         except Exception as e:
-            print(e)
-            raise Exception("Error while getting Nexar response")
+            if _is_upstream_failure(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            raise
+        self.circuit_breaker.record_success()
+        return data
+
+    async def _send_query(self, query: str, variables: Dict) -> dict:
+        operation = _operation_name(query)
+
+        async with self.semaphore:
+            access_token = await self.check_exp()
+            last_error = None
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    r = await self.client.post(
+                        self.url,
+                        json={"query": query, "variables": variables},
+                        headers={"token": access_token},
+                    )
+                except self._httpx.TransportError as e:
+                    last_error = NexarTransportError(f"Error while getting Nexar response: {e}")
+                    retry_after = None
+                else:
+                    latency_ms = (time.perf_counter() - start) * 1000
+                    self._histograms.setdefault(operation, LatencyHistogram()).observe(latency_ms)
+                    if r.status_code not in RETRY_STATUS_CODES:
+                        break
+                    last_error = NexarTransportError(f"Nexar returned HTTP {r.status_code}", status_code=r.status_code)
+                    retry_after = r.headers.get("Retry-After")
+
+                if attempt < self.max_retries:
+                    await asyncio.sleep(_backoff_delay(attempt, self.backoff_factor, self.backoff_max, retry_after))
+            else:
+                raise last_error
 
-        response = r.json()
-        if ("errors" in response):
-            for error in response["errors"]: print(error["message"])
-            raise SystemExit
+        return _parse_graphql_response(r.status_code, r.text, r.json)
 
-        return response["data"]
\ No newline at end of file
+    async def get_queries(self, query: str, variables_list: List[Dict], return_exceptions: bool = True) -> list:
+        """Run the same query for many variable sets concurrently (bounded by the semaphore)."""
+        return await asyncio.gather(
+            *(self.get_query(query, variables) for variables in variables_list),
+            return_exceptions=return_exceptions,
+        )
@@ -0,0 +1,150 @@
+"""DeepSeek 客户端限流：按每分钟请求数（RPM）与每分钟token数（TPM）的令牌桶调度
+
+多个会话（以及同一会话的批量任务线程池）共用一个进程级的 deepseek_limiter。
+请求分为两个优先级：
+- INTERACTIVE：单个型号查询、专家对话等用户正在等待的请求；
+- BATCH：BOM 批量风险评估等后台请求。
+有交互请求在排队时批量请求让行；批量请求也不能动用桶中预留给交互请求的那部分容量，
+因此一个用户的大批量 BOM 不会把其他用户的交互请求饿死。
+收到 429 时调用 pause() 让所有请求一起退避，而不是每个线程各自重试。
+"""
+import os
+import threading
+import time
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# 小于等于 0 表示不限制
+DEEPSEEK_RPM = int(os.getenv("DEEPSEEK_RPM", "120"))
+DEEPSEEK_TPM = int(os.getenv("DEEPSEEK_TPM", "200000"))
+# 批量请求不能使用的桶容量比例（留给交互请求）
+DEEPSEEK_INTERACTIVE_RESERVE = float(os.getenv("DEEPSEEK_INTERACTIVE_RESERVE", "0.2"))
+
+# token 估算：中文约 0.6 token/字，英文与符号约 0.3 token/字符，这里统一按 0.6 偏保守估计
+TOKENS_PER_CHAR = 0.6
+
+
+def estimate_tokens(messages, max_tokens=0):
+    """估算一次请求占用的token数（输入按字符数估计，输出按 max_tokens 计）"""
+    chars = sum(len(str(message.get("content") or "")) for message in messages or [])
+    return int(chars * TOKENS_PER_CHAR) + (max_tokens or 0)
+
+
+class _Bucket:
+    """每分钟补满 capacity 的令牌桶，容量不大于 0 时不限制"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.level = float(capacity)
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        if self.unlimited:
+            return
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def available(self, amount, reserve):
+        """扣除 amount 后是否仍不低于预留容量"""
+        return self.unlimited or self.level - amount >= self.capacity * reserve
+
+    def seconds_until(self, amount, reserve):
+        if self.unlimited:
+            return 0.0
+        missing = amount + self.capacity * reserve - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+
+class RateLimiter:
+    """RPM + TPM 双令牌桶，按优先级排队"""
+
+    def __init__(self, rpm=DEEPSEEK_RPM, tpm=DEEPSEEK_TPM, interactive_reserve=DEEPSEEK_INTERACTIVE_RESERVE):
+        self._cond = threading.Condition()
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm)
+        self._reserve = {INTERACTIVE: 0.0, BATCH: interactive_reserve}
+        self._waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._paused_until = 0.0
+        self._stats = {
+            name: {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self._rate_limited = 0
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """阻塞直到可以发送一个占用 tokens 的请求，返回实际从 TPM 桶扣除的token数
+
+        单个请求超过可用容量时只扣除可用容量，请求完成后以返回值调用 settle()，
+        不能用原始估算值，否则会多退还未扣除的部分。
+        """
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+                    reserve = self._reserve[priority]
+                    # 单个请求超过可用容量时按可用容量计，避免永远等待
+                    amount = tokens if self._tokens.unlimited else min(tokens, self._tokens.capacity * (1 - reserve))
+                    higher_waiting = any(self._waiting[p] for p in self._waiting if p < priority)
+                    if (now >= self._paused_until and not higher_waiting
+                            and self._requests.available(1, reserve) and self._tokens.available(amount, reserve)):
+                        if not self._requests.unlimited:
+                            self._requests.level -= 1
+                        if not self._tokens.unlimited:
+                            self._tokens.level -= amount
+                        else:
+                            amount = 0
+                        break
+                    delay = max(self._paused_until - now,
+                                self._requests.seconds_until(1, reserve),
+                                self._tokens.seconds_until(amount, reserve))
+                    # 更高优先级的请求离开时会 notify，这里的超时只是兜底
+                    self._cond.wait(timeout=min(max(delay, 0.01), 1.0))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            stats = self._stats[PRIORITY_NAMES[priority]]
+            stats["acquired"] += 1
+            if waited >= 0.01:
+                stats["waited"] += 1
+                stats["wait_seconds"] += waited
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+            return amount
+
+    def settle(self, charged, actual):
+        """请求完成后按实际用量修正 TPM 桶：charged 为 acquire() 的返回值，actual 为 None 时保持扣除的数量"""
+        if actual is None or self._tokens.unlimited:
+            return
+        with self._cond:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + charged - actual)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """收到 429 后让所有请求至少等待 seconds 秒"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._rate_limited += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            result = {name: dict(values, wait_seconds=round(values["wait_seconds"], 3),
+                                 max_wait_seconds=round(values["max_wait_seconds"], 3))
+                      for name, values in self._stats.items()}
+            result["rate_limited"] = self._rate_limited
+            result["queued"] = sum(self._waiting.values())
+            return result
+
+
+deepseek_limiter = RateLimiter()
@@ -0,0 +1,74 @@
+"""批量结果的下载文件（Excel / CSV）
+
+"批量查询"标签页的下载按钮与命令行 cli.py 共用这里的表格布局，两者输出的文件完全一致。
+"""
+import io
+from datetime import datetime
+
+RISK_SHEET_NAME = "停产风险评估结果"
+RISK_FILE_PREFIX = "元器件风险评估结果"
+ALTERNATIVES_SHEET_NAME = "替代方案"
+ALTERNATIVES_FILE_PREFIX = "元器件替代方案"
+
+
+def risk_rows(batch_results):
+    """batch_get_alternative_parts 的结果转为下载表格的行（忽略 "__" 开头的统计字段）"""
+    rows = []
+    for mpn, result_info in batch_results.items():
+        if mpn.startswith("__"):
+            continue
+        rows.append({
+            "原型号": mpn,
+            "原名称": result_info.get('name', ''),
+            "描述": result_info.get('description', ''),
+            "停产日期": result_info.get('eol_date', '未知'),
+            "风险等级": result_info.get('warning_level', '未知'),
+            "风险描述": result_info.get('risk_description', ''),
+            "状态详情": result_info.get('status', '')
+        })
+    return rows
+
+
+def alternatives_rows(alternatives):
+    """{型号: {"name", "description", "recommendations"}} 转为下载表格的行，每个替代方案一行"""
+    rows = []
+    for mpn, entry in alternatives.items():
+        for i, rec in enumerate(entry.get("recommendations") or [], 1):
+            pin_to_pin = rec.get("pinToPin")
+            rows.append({
+                "原型号": mpn,
+                "原名称": entry.get("name", ""),
+                "描述": entry.get("description", ""),
+                "方案": i,
+                "替代型号": rec.get("model", ""),
+                "品牌": rec.get("brand", ""),
+                "类别": rec.get("category", ""),
+                "封装": rec.get("package", ""),
+                "参数": rec.get("parameters", ""),
+                "产地": rec.get("type", ""),
+                "Pin兼容": "是" if pin_to_pin else ("未知" if pin_to_pin is None else "否"),
+                "价格": rec.get("price", ""),
+                "状态": rec.get("status", ""),
+                "货期": rec.get("leadTime", ""),
+                "参考信息": rec.get("datasheet", ""),
+            })
+    return rows
+
+
+def excel_bytes(rows, sheet_name):
+    import pandas as pd  # 按需导入，避免拖慢启动
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+    return buffer.getvalue()
+
+
+def csv_bytes(rows):
+    import pandas as pd
+
+    return pd.DataFrame(rows).to_csv(index=False, encoding='utf-8-sig').encode()
+
+
+def report_filename(prefix, extension, date=None):
+    return f"{prefix}_{(date or datetime.now()).strftime('%Y%m%d')}.{extension}"
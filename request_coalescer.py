@@ -0,0 +1,123 @@
+"""进程内的并发请求合并（single-flight）
+
+多个会话同时查询同一型号时，只有第一个调用者真正请求上游接口，
+其余调用者等待并共享同一份结果，避免对 Nexar / DeepSeek 发出重复请求。
+"""
+import copy
+import threading
+
+from cache_manager import normalize_part_number
+
+
+class _InFlightCall:
+    """一次正在进行中的上游调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False  # 流式调用的执行方中途停止读取，没有完整结果
+
+
+class SingleFlight:
+    """按 (命名空间, 规范化型号) 合并并发调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def _count(self, namespace, field):
+        ns_stats = self._stats.setdefault(namespace, {"executed": 0, "coalesced": 0})
+        ns_stats[field] += 1
+
+    def _join(self, namespace, key):
+        """返回 (调用键, 调用, 是否为执行方)"""
+        call_key = (namespace, normalize_part_number(key))
+        with self._lock:
+            call = self._calls.get(call_key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[call_key] = call
+                self._count(namespace, "executed")
+            else:
+                self._count(namespace, "coalesced")
+        return call_key, call, is_leader
+
+    def _finish(self, call_key, call):
+        with self._lock:
+            self._calls.pop(call_key, None)
+        call.done.set()
+
+    def do(self, namespace, key, fn, *args, **kwargs):
+        """执行 fn(*args, **kwargs)；若相同键的调用正在进行，则等待其结果
+
+        等待方拿到的是结果的深拷贝，调用方各自修改返回值互不影响；
+        上游调用抛出的异常会同样抛给所有等待方。
+        """
+        while True:
+            call_key, call, is_leader = self._join(namespace, key)
+            if is_leader:
+                break
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if not call.abandoned:
+                return copy.deepcopy(call.result)
+            # 执行方的流式调用被中途放弃：重新加入，由其中一个等待方重新执行
+
+        try:
+            result = fn(*args, **kwargs)
+            # 保存一份快照给等待方，避免调用方修改返回值后影响其他会话
+            call.result = copy.deepcopy(result)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(call_key, call)
+
+    def stream(self, namespace, key, fn, *args, **kwargs):
+        """合并生成器调用：执行方边产出边收集 fn(*args, **kwargs) 的每一项，结束后以列表共享
+
+        与 do() 共用同一组键：相同键的 do() 调用等待方得到产出项列表，
+        stream() 的等待方在执行方结束后依次得到列表中的每一项。
+        执行方中途停止读取时没有完整结果，等待方各自重新调用。
+        """
+        while True:
+            call_key, call, is_leader = self._join(namespace, key)
+            if is_leader:
+                break
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if not call.abandoned:
+                yield from copy.deepcopy(call.result)
+                return
+
+        items = []
+        try:
+            for item in fn(*args, **kwargs):
+                items.append(copy.deepcopy(item))
+                yield item
+            call.result = items
+        except GeneratorExit:
+            call.abandoned = True
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(call_key, call)
+
+    def stats(self):
+        """返回各命名空间实际执行与被合并的调用次数"""
+        with self._lock:
+            result = {namespace: dict(values) for namespace, values in self._stats.items()}
+            result["__in_flight__"] = len(self._calls)
+            return result
+
+
+# 进程级共享的请求合并器
+request_coalescer = SingleFlight()
@@ -1,10 +1,14 @@
+import os
 from frontend import render_ui
-from backend import get_alternative_parts, process_bom_file, batch_get_alternative_parts
+from backend import (get_alternative_parts, stream_alternative_parts, start_progressive_alternatives,
+                     process_bom_file, batch_get_alternative_parts)
 from custom_components.hide_sidebar_items import get_sidebar_hide_code
 
 def main():
     # 渲染主界面UI（内部会首先调用st.set_page_config）
-    render_ui(get_alternative_parts)
+    # 默认先显示 Nexar 替代件再合并 DeepSeek 推荐；PROGRESSIVE_RESULTS=0 时改为流式显示 DeepSeek 推荐
+    progressive = start_progressive_alternatives if os.getenv("PROGRESSIVE_RESULTS", "1") != "0" else None
+    render_ui(get_alternative_parts, stream_alternative_parts, progressive)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,380 @@
+"""HTTP 服务：供 MES/ERP 等系统以 JSON 接口调用元器件识别、替代方案查询与批量风险评估
+
+    python service.py --host 0.0.0.0 --port 8080
+
+接口（请求与响应均为 JSON，components 为 [{"mpn", "name", "description"}, ...]）：
+- GET  /health                   服务状态、工作线程占用、熔断器与限流器状态
+- POST /api/identify             {"mpn": ...}                       → {"component": {...}}
+- POST /api/alternatives         {"part_number": ...}               → {"recommendations": [...]}
+- POST /api/risk                 {"components": [...]}              → {"results": {...}, "stats": {...}}（同步，数量有上限）
+- POST /api/jobs                 {"task": "risk"|"alternatives", "components": [...]} → 202 {"job_id", ...}
+- GET  /api/jobs/<id>            任务状态与进度
+- GET  /api/jobs/<id>/items      每个元器件的状态（?status=failed 只返回失败的元器件）
+- POST /api/jobs/<id>/cancel     取消任务
+- POST /api/jobs/<id>/retry      只重新处理失败的元器件
+- GET  /api/jobs/<id>/result     任务结果；?format=xlsx|csv 返回与"批量查询"标签页下载相同的文件
+
+同步接口在共享的工作线程池中执行：线程与排队名额都占满时返回 503，超过 SERVICE_REQUEST_TIMEOUT 秒返回 504
+（后台调用继续完成并写入缓存，客户端重试时直接命中）。大BOM使用任务接口，任务保存在持久化的任务队列
+（jobqueue.py）中，由队列的工作线程执行，服务重启后继续处理。
+缓存、相同型号的请求合并、DeepSeek 限流与熔断器在进程内所有请求之间共享。
+每个响应的 "messages" 为本次调用中后端发出的提示信息。
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import events
+import reports
+from jobqueue import TASKS as JOB_TASKS, ACTIVE_STATUSES, get_job_queue
+
+logger = logging.getLogger("bom_tool.service")
+
+SERVICE_MAX_WORKERS = int(os.getenv("SERVICE_MAX_WORKERS", "16"))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", "64"))
+SERVICE_REQUEST_TIMEOUT = float(os.getenv("SERVICE_REQUEST_TIMEOUT", "90"))
+SERVICE_SYNC_MAX_PARTS = int(os.getenv("SERVICE_SYNC_MAX_PARTS", "50"))
+SERVICE_JOB_MAX_PARTS = int(os.getenv("SERVICE_JOB_MAX_PARTS", "5000"))
+SERVICE_MAX_BODY = int(os.getenv("SERVICE_MAX_BODY", str(10 * 1024 * 1024)))
+
+
+class ServiceError(Exception):
+    """以指定HTTP状态码返回给客户端的错误"""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class WorkerPool:
+    """有界的共享工作线程池：同时执行 max_workers 个调用，另有 max_queue 个排队名额，都占满时立即拒绝"""
+
+    def __init__(self, max_workers=SERVICE_MAX_WORKERS, max_queue=SERVICE_MAX_QUEUE, name="service-worker"):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "timeouts": 0, "in_flight": 0}
+
+    def _count(self, field, delta=1):
+        with self._lock:
+            self.stats[field] += delta
+
+    def call(self, func, *args, timeout=SERVICE_REQUEST_TIMEOUT):
+        """在池中执行 func(*args)，返回 (结果, 本次调用发出的提示信息)"""
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise ServiceError(503, "服务繁忙，请稍后重试", {"Retry-After": "1"})
+        sink = events.CollectingSink(kinds=events.MESSAGE_KINDS)
+        with events.use_sink(sink):
+            task = events.bind(func)
+        self._count("submitted")
+        self._count("in_flight")
+        try:
+            future = self._executor.submit(task, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=timeout), sink.snapshot()
+        except FutureTimeout:
+            self._count("timeouts")
+            raise ServiceError(504, f"处理超时（{timeout:g} 秒），结果将在后台完成后写入缓存，请稍后重试")
+
+    def _release(self):
+        self._count("in_flight", -1)
+        self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, max_workers=self.max_workers, capacity=self.capacity)
+
+
+_pool = WorkerPool()
+
+
+def _components(body, limit):
+    """校验请求中的 components，返回规范化的元器件列表（型号去重，保留首次出现）"""
+    components = body.get("components")
+    if not isinstance(components, list) or not components:
+        raise ServiceError(400, "components 必须是非空数组")
+    seen = set()
+    result = []
+    for item in components:
+        if isinstance(item, str):
+            item = {"mpn": item}
+        if not isinstance(item, dict) or not str(item.get("mpn") or "").strip():
+            raise ServiceError(400, "components 中的每一项必须包含 mpn")
+        mpn = str(item["mpn"]).strip()
+        if mpn in seen:
+            continue
+        seen.add(mpn)
+        result.append({"mpn": mpn, "name": str(item.get("name") or ""), "description": str(item.get("description") or "")})
+    if len(result) > limit:
+        raise ServiceError(413, f"元器件数量 {len(result)} 超过上限 {limit}" +
+                           ("，请使用 /api/jobs 提交异步任务" if limit == SERVICE_SYNC_MAX_PARTS else ""))
+    return result
+
+
+def _required(body, field):
+    value = str(body.get(field) or "").strip()
+    if not value:
+        raise ServiceError(400, f"缺少参数 {field}")
+    return value
+
+
+def _options(body):
+    options = {}
+    for field in ("max_workers", "risk_batch_size"):
+        if body.get(field) is not None:
+            try:
+                options[field] = max(1, int(body[field]))
+            except (TypeError, ValueError):
+                raise ServiceError(400, f"{field} 必须是整数")
+    return options
+
+
+def handle_health(body, query):
+    import backend
+
+    return 200, {
+        "status": "ok",
+        "workers": _pool.snapshot(),
+        "circuit_breakers": backend.get_circuit_breaker_stats(),
+        "rate_limiter": backend.get_rate_limiter_stats(),
+        "cache": backend.get_cache_stats(),
+    }
+
+
+def handle_identify(body, query):
+    from backend import identify_component
+
+    mpn = _required(body, "mpn")
+    component, messages = _pool.call(identify_component, mpn)
+    return 200, {"mpn": mpn, "component": component or None, "messages": messages}
+
+
+def handle_alternatives(body, query):
+    from backend import get_alternative_parts
+
+    part_number = _required(body, "part_number")
+    recommendations, messages = _pool.call(get_alternative_parts, part_number)
+    return 200, {"part_number": part_number, "recommendations": recommendations or [], "messages": messages}
+
+
+def handle_risk(body, query):
+    from backend import batch_get_alternative_parts
+
+    components = _components(body, SERVICE_SYNC_MAX_PARTS)
+    options = _options(body)
+    results, messages = _pool.call(
+        lambda: batch_get_alternative_parts(components, max_workers=options.get("max_workers"),
+                                            risk_batch_size=options.get("risk_batch_size")))
+    results.pop("__eol_warnings__", None)
+    stats = results.pop("__batch_stats__", None)
+    return 200, {"results": results, "stats": stats, "messages": messages}
+
+
+def _job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise ServiceError(404, f"任务 {job_id} 不存在或已过期")
+    return job
+
+
+def handle_submit_job(body, query):
+    task = body.get("task", "risk")
+    if task not in JOB_TASKS:
+        raise ServiceError(400, f"task 必须是 {' / '.join(JOB_TASKS)} 之一")
+    components = _components(body, SERVICE_JOB_MAX_PARTS)
+    job_id = get_job_queue().submit(task, components, _options(body), source=str(body.get("source") or ""))
+    return 202, dict(_job(job_id), status_url=f"/api/jobs/{job_id}", result_url=f"/api/jobs/{job_id}/result")
+
+
+def handle_job_status(body, query, job_id):
+    return 200, _job(job_id)
+
+
+def handle_job_items(body, query, job_id):
+    _job(job_id)
+    status = (query.get("status") or [None])[0]
+    items = get_job_queue().items(job_id, status)
+    return 200, {"job_id": job_id, "items": [{key: value for key, value in item.items() if key != "result"} for item in items]}
+
+
+def handle_cancel_job(body, query, job_id):
+    active = get_job_queue().cancel(job_id)
+    return (202 if active else 409), dict(_job(job_id), cancelled=active)
+
+
+def handle_retry_job(body, query, job_id):
+    job = _job(job_id)
+    if job["status"] in ACTIVE_STATUSES:
+        raise ServiceError(409, f"任务尚未结束（{job['status']}），不能重试")
+    retried = get_job_queue().retry_failed(job_id)
+    return (202 if retried else 200), dict(_job(job_id), retried=retried)
+
+
+def handle_job_result(body, query, job_id):
+    """已结束任务的结果（部分失败或已取消的任务返回已处理的元器件，failed 中列出失败的型号）"""
+    job = _job(job_id)
+    if job["status"] in ACTIVE_STATUSES:
+        raise ServiceError(409, f"任务尚未完成（{job['status']}，{job['processed']}/{job['total']}）")
+    results = get_job_queue().results(job_id)
+    file_format = (query.get("format") or ["json"])[0]
+    if file_format == "json":
+        failed = [item["mpn"] for item in get_job_queue().items(job_id, "failed")]
+        return 200, {"job_id": job_id, "task": job["task"], "status": job["status"], "results": results,
+                     "failed": failed, "error": job["error"], "stats": job["stats"]}
+    if file_format not in ("xlsx", "csv"):
+        raise ServiceError(400, "format 必须是 json / xlsx / csv 之一")
+    if job["task"] == "risk":
+        rows, sheet, prefix = reports.risk_rows(results), reports.RISK_SHEET_NAME, reports.RISK_FILE_PREFIX
+    else:
+        rows = reports.alternatives_rows(results)
+        sheet, prefix = reports.ALTERNATIVES_SHEET_NAME, reports.ALTERNATIVES_FILE_PREFIX
+    data = reports.excel_bytes(rows, sheet) if file_format == "xlsx" else reports.csv_bytes(rows)
+    return 200, (data, reports.report_filename(prefix, file_format))
+
+
+# (方法, 路径正则, 处理函数)；处理函数参数为 (请求体, 查询参数, *正则分组)，返回 (状态码, 响应)
+ROUTES = [
+    ("GET", r"/health", handle_health),
+    ("POST", r"/api/identify", handle_identify),
+    ("POST", r"/api/alternatives", handle_alternatives),
+    ("POST", r"/api/risk", handle_risk),
+    ("POST", r"/api/jobs", handle_submit_job),
+    ("GET", r"/api/jobs/([0-9a-f]{32})", handle_job_status),
+    ("GET", r"/api/jobs/([0-9a-f]{32})/result", handle_job_result),
+    ("GET", r"/api/jobs/([0-9a-f]{32})/items", handle_job_items),
+    ("POST", r"/api/jobs/([0-9a-f]{32})/cancel", handle_cancel_job),
+    ("POST", r"/api/jobs/([0-9a-f]{32})/retry", handle_retry_job),
+]
+
+FILE_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self._send(status, body, "application/json; charset=utf-8", headers)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > SERVICE_MAX_BODY:
+            raise ServiceError(413, f"请求体超过 {SERVICE_MAX_BODY} 字节")
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return {}
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            raise ServiceError(400, "请求体不是有效的JSON")
+        if not isinstance(body, dict):
+            raise ServiceError(400, "请求体必须是JSON对象")
+        return body
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/") or "/"
+        start = time.perf_counter()
+        try:
+            allowed = []
+            for route_method, pattern, handler in ROUTES:
+                match = re.fullmatch(pattern, path)
+                if not match:
+                    continue
+                if route_method != method:
+                    allowed.append(route_method)
+                    continue
+                body = self._read_body() if method == "POST" else {}
+                status, payload = handler(body, parse_qs(url.query), *match.groups())
+                break
+            else:
+                if allowed:
+                    raise ServiceError(405, f"{path} 只支持 {' / '.join(allowed)}", {"Allow": ", ".join(allowed)})
+                raise ServiceError(404, f"未知接口 {path}")
+        except ServiceError as e:
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+        except Exception as e:
+            logger.exception("%s %s failed", method, path)
+            self._send_json(500, {"error": f"内部错误：{e}"})
+        else:
+            headers = {"X-Elapsed-Ms": f"{(time.perf_counter() - start) * 1000:.0f}"}
+            if isinstance(payload, tuple):
+                data, filename = payload
+                headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+                self._send(status, data, FILE_TYPES[filename.rsplit(".", 1)[-1]], headers)
+            else:
+                self._send_json(status, payload, headers)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class BomService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8080):
+        super().__init__((host, port), ServiceHandler)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BOM元器件替代/风险评估 HTTP 服务")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8080")))
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试信息")
+    args = parser.parse_args()
+
+    # 后端事件没有订阅者时写入 logging
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+    server = BomService(args.host, args.port)
+    # 启动时即启动任务队列的工作线程，继续处理上次退出时未完成的任务
+    queue = get_job_queue()
+    logger.info("BOM service listening on %s (jobs: %s, %d workers)", server.base_url, queue.db_path, queue.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""DeepSeek 结构化输出：JSON 模式请求 + 按调用定义的结构校验 + 定向修复
+
+每个调用点声明自己期望的结构（JSON Schema 的一个小子集：type / properties /
+required / items / enum / minLength），request_structured 负责：
+1. 以 response_format={"type": "json_object"} 请求（接口不支持时自动关闭）；
+2. 用 json_utils.extract_json 解析并按结构校验；
+3. 不符合结构时只把出错的部分连同错误说明发给模型做一次小的修复调用，
+   而不是重新发送整段提示词。
+JSON 模式只能返回对象，因此列表结果统一包在一个对象字段中，例如 {"recommendations": [...]}。
+"""
+import json
+import logging
+import os
+import threading
+
+from json_utils import extract_json
+
+logger = logging.getLogger("bom_tool.structured_output")
+
+# 设为 0 可关闭 JSON 模式（例如使用不支持 response_format 的兼容接口）
+JSON_MODE_ENABLED = os.getenv("DEEPSEEK_JSON_MODE", "1") != "0"
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+}
+
+# ---------- 各调用的结构定义 ----------
+RECOMMENDATION_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["model", "brand", "type"],
+    "properties": {
+        "model": {"type": "string", "minLength": 1},
+        "brand": {"type": "string"},
+        "category": {"type": "string"},
+        "package": {"type": "string"},
+        "parameters": {"type": "string"},
+        "type": {"type": "string", "enum": ["国产", "进口", "未知"]},
+        # 数字价格由 normalize_recommendation 转为字符串，不值得一次修复调用
+        "price": {"type": ["string", "number"]},
+        "pinToPin": {"type": "boolean"},
+        "datasheet": {"type": "string"},
+    },
+}
+
+RECOMMENDATIONS_SCHEMA = {
+    "type": "object",
+    "required": ["recommendations"],
+    "properties": {"recommendations": {"type": "array", "items": RECOMMENDATION_ITEM_SCHEMA}},
+}
+
+RISK_SCHEMA = {
+    "type": "object",
+    "required": ["status", "eol_year"],
+    "properties": {
+        "status": {"type": "string", "enum": ["已停产", "未停产"]},
+        "eol_year": {"type": ["string", "integer"]},
+        "description": {"type": "string"},
+    },
+}
+
+RISK_BATCH_SCHEMA = {
+    "type": "object",
+    "required": ["results"],
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["mpn", "status", "eol_year"],
+                "properties": dict(RISK_SCHEMA["properties"], mpn={"type": "string", "minLength": 1}),
+            },
+        }
+    },
+}
+
+COMPONENT_INFO_SCHEMA = {
+    "type": "object",
+    "required": ["manufacturer", "category"],
+    "properties": {
+        "mpn": {"type": "string"},
+        "manufacturer": {"type": "string", "minLength": 1},
+        "category": {"type": "string"},
+        "package": {"type": "string"},
+        "parameters": {"type": ["object", "string"]},
+        "price": {"type": ["string", "number"]},
+        "status": {"type": "string"},
+        "leadTime": {"type": "string"},
+        "pin_compatible": {"type": "string"},
+    },
+}
+
+
+def validate(data, schema, path="$"):
+    """按结构定义校验数据，返回错误说明列表（为空表示通过）"""
+    errors = []
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_TYPE_CHECKS[t](data) for t in types):
+            return [f"{path} 应为 {'/'.join(types)}，实际为 {type(data).__name__}"]
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path} 必须是 {schema['enum']} 之一，实际为 {data!r}")
+    if isinstance(data, str) and len(data.strip()) < schema.get("minLength", 0):
+        errors.append(f"{path} 不能为空")
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}.{key} 缺失")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data and data[key] is not None:
+                errors.extend(validate(data[key], sub_schema, f"{path}.{key}"))
+    if isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def _list_field(schema):
+    """对象中唯一的数组字段名（列表类结果的外层包装），没有则返回 None"""
+    array_fields = [key for key, sub in schema.get("properties", {}).items() if sub.get("type") == "array"]
+    return array_fields[0] if len(array_fields) == 1 else None
+
+
+class StructuredResponseError(Exception):
+    """模型返回的内容在修复后仍不符合结构要求"""
+
+    def __init__(self, message, content=None, errors=None):
+        super().__init__(message)
+        self.content = content
+        self.errors = errors or []
+
+
+class StructuredOutputStats:
+    """按调用类型统计补全次数、修复次数与被浪费的补全
+
+    wasted = 补全次数 - 成功次数，即每次成功调用之外额外消耗的补全（修复调用、失败的调用）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def count(self, call_type, field, amount=1):
+        with self._lock:
+            values = self._stats.setdefault(call_type, {
+                "completions": 0, "succeeded": 0, "failed": 0, "repairs": 0, "repaired": 0, "invalid_items_dropped": 0,
+            })
+            values[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for call_type, values in self._stats.items():
+                values = dict(values)
+                values["wasted"] = max(0, values["completions"] - values["succeeded"])
+                values["wasted_per_success"] = (
+                    round(values["wasted"] / values["succeeded"], 3) if values["succeeded"] else None
+                )
+                result[call_type] = values
+            return result
+
+
+structured_stats = StructuredOutputStats()
+
+_json_mode_supported = JSON_MODE_ENABLED
+
+
+def _is_response_format_error(error):
+    """接口因不支持 response_format 而拒绝请求（上下文过长、max_tokens 无效等其他 400/422 错误不算）"""
+    if getattr(error, "status_code", None) not in (None, 400, 422):
+        return False
+    return "response_format" in str(error) or "json_object" in str(error)
+
+
+def _complete(create, messages, max_tokens, model, **kwargs):
+    """发送一次补全请求；接口不接受 response_format 时关闭 JSON 模式后重试，其他错误照常抛出"""
+    global _json_mode_supported
+    if _json_mode_supported:
+        try:
+            return create(model=model, messages=messages, stream=False, max_tokens=max_tokens,
+                          response_format={"type": "json_object"}, **kwargs)
+        except Exception as e:
+            if not _is_response_format_error(e):
+                raise
+            if _json_mode_supported:
+                logger.warning("DeepSeek 接口不支持 response_format，本进程后续调用关闭 JSON 模式: %s", e)
+            _json_mode_supported = False
+    return create(model=model, messages=messages, stream=False, max_tokens=max_tokens, **kwargs)
+
+
+def json_mode_kwargs():
+    """流式调用等场景需要自行传入的 JSON 模式参数"""
+    return {"response_format": {"type": "json_object"}} if _json_mode_supported else {}
+
+
+def _coerce(data, schema):
+    """模型忽略外层包装直接返回数组时，补上列表字段"""
+    field = _list_field(schema)
+    if isinstance(data, list) and field is not None:
+        return {field: data}
+    return data
+
+
+def _repair(create, bad_json, errors, schema, max_tokens, model, call_type):
+    """把不符合结构的片段和错误说明交给模型修复，返回修复后的数据（失败返回 None）"""
+    structured_stats.count(call_type, "repairs")
+    structured_stats.count(call_type, "completions")
+    messages = [
+        {"role": "system", "content": "你是JSON修复工具。只根据给出的错误说明修正JSON，保留其余内容不变，只返回修正后的JSON对象。"},
+        {"role": "user", "content": (
+            f"JSON结构要求：\n{json.dumps(schema, ensure_ascii=False)}\n\n"
+            f"错误：\n" + "\n".join(errors[:20]) + "\n\n"
+            f"需要修正的JSON：\n{bad_json}"
+        )},
+    ]
+    response = _complete(create, messages, max_tokens, model)
+    repaired = _coerce(extract_json(response.choices[0].message.content, prefer='{'), schema)
+    if validate(repaired, schema):
+        return None
+    structured_stats.count(call_type, "repaired")
+    return repaired
+
+
+def request_structured(create, messages, schema, call_type, max_tokens=1000, model="deepseek-chat",
+                       repair=True, **kwargs):
+    """以JSON模式调用 create（即 chat.completions.create）并返回符合 schema 的数据
+
+    列表类结构（对象中只有一个数组字段）只修复出错的元素：
+    结构正确的元素保留，出错的元素单独发给模型修复，修复后仍不合格的元素被丢弃。
+
+    Returns:
+        (data, raw_content)
+    Raises:
+        StructuredResponseError: 修复后仍不符合结构
+    """
+    structured_stats.count(call_type, "completions")
+    response = _complete(create, messages, max_tokens, model, **kwargs)
+    content = response.choices[0].message.content or ""
+    data = _coerce(extract_json(content, prefer='{'), schema)
+
+    errors = validate(data, schema)
+    if not errors:
+        structured_stats.count(call_type, "succeeded")
+        return data, content
+
+    field = _list_field(schema)
+    item_schema = schema["properties"][field].get("items", {}) if field else None
+    outer = {key: value for key, value in data.items() if key != field} if isinstance(data, dict) else None
+    # 外层结构正确、只有部分元素出错时，只修复出错的元素
+    if field and isinstance(data, dict) and isinstance(data.get(field), list) and not validate(
+            dict(outer, **{field: []}), schema):
+        items = data[field]
+        bad_indices = {i for i, item in enumerate(items) if validate(item, item_schema)}
+        kept = [item for i, item in enumerate(items) if i not in bad_indices]
+        repaired_items = []
+        if repair:
+            bad_items = {field: [items[i] for i in sorted(bad_indices)]}
+            item_errors = validate(bad_items, {"type": "object", "properties": {field: schema["properties"][field]}})
+            fixed = _repair(create, json.dumps(bad_items, ensure_ascii=False), item_errors,
+                            {"type": "object", "required": [field], "properties": {field: schema["properties"][field]}},
+                            max_tokens, model, call_type)
+            if fixed is not None:
+                repaired_items = fixed[field]
+        if len(repaired_items) == len(bad_indices):
+            # 修复后的元素放回原来的位置
+            repaired_iter = iter(repaired_items)
+            kept = [next(repaired_iter) if i in bad_indices else item for i, item in enumerate(items)]
+        else:
+            kept.extend(repaired_items)
+        structured_stats.count(call_type, "invalid_items_dropped", max(0, len(bad_indices) - len(repaired_items)))
+        if kept or not items:
+            structured_stats.count(call_type, "succeeded")
+            return dict(outer, **{field: kept}), content
+        structured_stats.count(call_type, "failed")
+        raise StructuredResponseError(f"{call_type}: 所有元素都不符合结构要求", content, errors)
+
+    if repair:
+        bad_json = json.dumps(data, ensure_ascii=False) if data is not None else content
+        fixed = _repair(create, bad_json, errors, schema, max_tokens, model, call_type)
+        if fixed is not None:
+            structured_stats.count(call_type, "succeeded")
+            return fixed, content
+    structured_stats.count(call_type, "failed")
+    raise StructuredResponseError(f"{call_type}: 响应不符合结构要求", content, errors)
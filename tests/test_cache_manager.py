@@ -0,0 +1,108 @@
+import os
+import shutil
+
+import cache_manager
+from cache_manager import LEGACY_NAMESPACE, PartCache, ResponseStore
+
+REPO_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+
+
+def test_set_get_returns_copies_and_counts_hits(tmp_path):
+    cache = PartCache(cache_dir=str(tmp_path))
+    data = [{"model": "LM1117"}]
+    cache.set("alternatives", " LM317 ", data)
+    data[0]["model"] = "changed"
+
+    result = cache.get("alternatives", "lm317")
+    assert result == [{"model": "LM1117"}]
+    result.append("x")
+    assert cache.get("alternatives", "LM317") == [{"model": "LM1117"}]
+    assert cache.get("risk", "LM317") is None
+    assert cache.stats()["alternatives"]["hits"] == 2
+    assert cache.stats()["risk"]["misses"] == 1
+
+
+def test_expired_entry_is_a_miss_but_served_as_stale(tmp_path):
+    cache = PartCache(cache_dir=str(tmp_path))
+    cache.set("nexar", "LM317", {"mpn": "LM317"}, ttl=-1)
+    assert cache.get("nexar", "LM317") is None
+    assert not cache.contains("nexar", "LM317")
+    assert cache.get("nexar", "LM317", allow_stale=True) == {"mpn": "LM317"}
+    assert cache.stats()["nexar"]["expired"] == 1
+
+
+def test_entries_past_stale_window_are_removed(tmp_path, monkeypatch):
+    cache = PartCache(cache_dir=str(tmp_path))
+    monkeypatch.setattr(cache_manager, "STALE_TTL", 10)
+    cache.set("nexar", "LM317", {"mpn": "LM317"}, ttl=-20)
+    assert cache.get("nexar", "LM317", allow_stale=True) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_lru_eviction_removes_least_recently_used(tmp_path):
+    cache = PartCache(cache_dir=str(tmp_path), max_entries=2)
+    cache.set("alternatives", "a", 1)
+    cache.set("alternatives", "b", 2)
+    assert cache.get("alternatives", "a") == 1
+    cache.set("alternatives", "c", 3)
+
+    assert cache.contains("alternatives", "a")
+    assert not cache.contains("alternatives", "b")
+    assert cache.contains("alternatives", "c")
+    assert len(os.listdir(tmp_path)) == 2
+    assert cache.stats()["alternatives"]["evictions"] == 1
+
+
+def test_entries_persist_across_instances(tmp_path):
+    PartCache(cache_dir=str(tmp_path)).set("risk", "LM317", {"risk": "绿色"})
+    assert PartCache(cache_dir=str(tmp_path)).get("risk", "lm317") == {"risk": "绿色"}
+
+
+def test_legacy_files_are_loaded_and_never_deleted(tmp_path):
+    for filename in os.listdir(REPO_CACHE_DIR):
+        shutil.copy(os.path.join(REPO_CACHE_DIR, filename), tmp_path)
+    legacy_files = sorted(os.listdir(tmp_path))
+    assert legacy_files
+
+    cache = PartCache(cache_dir=str(tmp_path), max_entries=1)
+    # 旧版条目早已过期：普通读取未命中，兜底读取仍可用
+    assert cache.get(LEGACY_NAMESPACE, "LM317") is None
+    stale = cache.get(LEGACY_NAMESPACE, "LM317", allow_stale=True)
+    assert isinstance(stale, list) and stale
+    cache.set("risk", "LM317", {"risk": "绿色"})
+
+    assert set(legacy_files) <= set(os.listdir(tmp_path))
+
+
+def test_corrupt_file_is_removed(tmp_path):
+    cache = PartCache(cache_dir=str(tmp_path))
+    path = os.path.join(tmp_path, cache._file_key("nexar", "LM317") + ".pkl")
+    with open(path, "wb") as f:
+        f.write(b"not a pickle")
+    assert cache.get("nexar", "LM317") is None
+    assert not os.path.exists(path)
+
+
+def test_invalidate_removes_memory_and_disk_entry(tmp_path):
+    cache = PartCache(cache_dir=str(tmp_path))
+    cache.set("nexar", "LM317", {"mpn": "LM317"})
+    cache.invalidate("nexar", "lm317")
+    assert not cache.contains("nexar", "LM317")
+    assert os.listdir(tmp_path) == []
+
+
+def test_response_store_ttl_lru_and_invalidate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_manager.time, "time", lambda: now[0])
+    store = ResponseStore(ttl=10, max_entries=2)
+    store.set("LM317", "r1")
+    store.set("LM1117", "r2")
+    assert store.get("lm317") == "r1"
+    store.set("AMS1117", "r3")
+    assert store.get("LM1117") is None
+    store.invalidate("LM317")
+    assert store.get("LM317") is None
+    now[0] += 11
+    assert store.get("AMS1117") is None
+    assert store.stats() == {"hits": 1, "misses": 3, "size": 0}
+
@@ -0,0 +1,73 @@
+import json
+
+from json_utils import IncrementalJsonArrayParser, extract_json, extract_json_array, normalize_recommendation
+
+ITEMS = [{"model": "TPS5430", "brand": "TI"}, {"model": "MP2307", "brand": "MPS"}]
+
+
+def test_extract_json_plain_and_code_fence():
+    text = json.dumps(ITEMS)
+    assert extract_json(text) == ITEMS
+    assert extract_json(f"以下是推荐：\n```json\n{text}\n```\n仅供参考") == ITEMS
+
+
+def test_extract_json_repairs_trailing_commas_and_single_quotes():
+    assert extract_json('[{"model": "A", "brand": "B",}, ]') == [{"model": "A", "brand": "B"}]
+    assert extract_json("[{'model': 'say \"hi\"', 'brand': 'it\\'s'}]") == [{"model": 'say "hi"', "brand": "it's"}]
+
+
+def test_extract_json_repairs_python_literals_and_raw_newlines():
+    assert extract_json('[{"pinToPin": True, "price": None, "note": "a\nb"}]') == [
+        {"pinToPin": True, "price": None, "note": "a\nb"}]
+
+
+def test_extract_json_keeps_complete_items_of_truncated_output():
+    text = '推荐如下：[{"model": "A"}, {"model": "B"}, {"model": "C", "brand": "T'
+    assert extract_json(text) == [{"model": "A"}, {"model": "B"}]
+
+
+def test_extract_json_skips_brackets_in_preamble():
+    assert extract_json('参考 {x} 与 [注1] 后的结果：[{"model": "A"},]') == [{"model": "A"}]
+
+
+def test_extract_json_returns_none_without_json():
+    assert extract_json("没有找到合适的替代料") is None
+    assert extract_json("") is None
+    assert extract_json(None) is None
+
+
+def test_extract_json_array_unwraps_object():
+    assert extract_json_array(json.dumps({"recommendations": ITEMS})) == ITEMS
+    assert extract_json_array('{"model": "A"}') == [{"model": "A"}]
+
+
+def test_normalize_recommendation_adds_currency_to_bare_prices():
+    assert normalize_recommendation({"price": "1.8-2.5"})["price"] == "$1.8-$2.5"
+    assert normalize_recommendation({"price": 3})["price"] == "$3"
+    assert normalize_recommendation({"price": "¥2"})["price"] == "¥2"
+
+
+def test_incremental_parser_yields_items_as_they_complete():
+    text = "```json\n" + json.dumps(ITEMS) + "\n```"
+    parser = IncrementalJsonArrayParser()
+    received = []
+    for i in range(0, len(text), 7):
+        received.extend(parser.feed(text[i:i + 7]))
+    assert received == ITEMS
+    assert parser.items_parsed == 2
+    assert parser.text == text
+
+
+def test_incremental_parser_handles_wrapped_object_and_braces_in_strings():
+    items = [{"model": "A", "parameters": "Vin {4.5-28V} [max]"}, {"model": "B"}]
+    parser = IncrementalJsonArrayParser()
+    received = []
+    for ch in json.dumps({"recommendations": items}):
+        received.extend(parser.feed(ch))
+    assert received == items
+
+
+def test_incremental_parser_skips_malformed_item():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('[{"model": "A",}, {"model": "B"}]') == [{"model": "B"}]
+    assert parser.items_skipped == 1
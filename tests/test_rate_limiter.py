@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import BATCH, INTERACTIVE, RateLimiter, estimate_tokens
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    """令牌桶按 time.monotonic 补充，固定时钟使测试结果确定"""
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_estimate_tokens_counts_input_and_max_tokens():
+    messages = [{"role": "user", "content": "a" * 100}, {"role": "system", "content": None}]
+    assert estimate_tokens(messages, 50) == 110
+    assert estimate_tokens(None) == 0
+
+
+def test_acquire_returns_charged_tokens_and_settle_refunds_difference(frozen_clock):
+    limiter = RateLimiter(rpm=0, tpm=1000, interactive_reserve=0.2)
+    charged = limiter.acquire(300)
+    assert charged == 300
+    assert limiter._tokens.level == 700
+    limiter.settle(charged, 100)
+    assert limiter._tokens.level == 900
+
+
+def test_oversized_request_is_clamped_and_settle_does_not_over_credit(frozen_clock):
+    limiter = RateLimiter(rpm=0, tpm=1000, interactive_reserve=0.2)
+    charged = limiter.acquire(5000, BATCH)
+    # 批量请求最多使用扣除预留后的容量
+    assert charged == 800
+    assert limiter._tokens.level == 200
+    # 429：请求被拒绝，只退还实际扣除的数量
+    limiter.settle(charged, 0)
+    assert limiter._tokens.level == 1000
+    charged = limiter.acquire(5000, INTERACTIVE)
+    limiter.settle(charged, 0)
+    assert limiter._tokens.level == 1000
+
+
+def test_settle_without_usage_keeps_charge(frozen_clock):
+    limiter = RateLimiter(rpm=0, tpm=1000)
+    charged = limiter.acquire(400)
+    limiter.settle(charged, None)
+    assert limiter._tokens.level == 600
+
+
+def test_unlimited_limiter_charges_nothing():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    assert limiter.acquire(10 ** 9) == 0
+    limiter.settle(0, 123)
+    assert limiter.stats()["interactive"]["acquired"] == 1
+
+
+def test_batch_cannot_use_interactive_reserve(frozen_clock):
+    limiter = RateLimiter(rpm=10, tpm=0, interactive_reserve=0.2)
+    for _ in range(8):
+        limiter.acquire(1, BATCH)
+    assert limiter._requests.available(1, 0.0)
+    assert not limiter._requests.available(1, limiter._reserve[BATCH])
+    # 交互请求仍可使用预留的容量
+    limiter.acquire(1, INTERACTIVE)
+    assert limiter._requests.level == 1
+
+
+def test_pause_blocks_until_deadline():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    limiter.pause(0.2)
+    start = time.monotonic()
+    limiter.acquire(1)
+    assert time.monotonic() - start >= 0.15
+    assert limiter.stats()["rate_limited"] == 1
+
+
+def test_waiting_interactive_request_goes_before_batch():
+    limiter = RateLimiter(rpm=60, tpm=0, interactive_reserve=0.0)
+    for _ in range(60):
+        limiter.acquire(1)
+    order = []
+
+    def take(priority, name):
+        limiter.acquire(1, priority)
+        order.append(name)
+
+    batch = threading.Thread(target=take, args=(BATCH, "batch"))
+    batch.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=take, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "batch"]
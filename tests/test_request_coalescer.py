@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from request_coalescer import SingleFlight
+
+
+def wait_for_waiters(flight, namespace, count, timeout=5):
+    """等到指定数量的调用已经加入正在进行的调用"""
+    deadline = time.monotonic() + timeout
+    while flight.stats().get(namespace, {}).get("coalesced", 0) < count:
+        assert time.monotonic() < deadline, "waiters did not join in time"
+        time.sleep(0.001)
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_do_runs_once_for_concurrent_callers_and_isolates_results():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return {"items": [1, 2]}
+
+    threads, results, errors = run_in_threads(4, lambda: flight.do("nexar", " LM317 ", load))
+    wait_for_waiters(flight, "nexar", 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert errors == [None] * 4
+    assert all(result == {"items": [1, 2]} for result in results)
+    results[0]["items"].append(3)
+    assert all(result["items"] == [1, 2] for result in results[1:])
+    assert flight.stats()["nexar"] == {"executed": 1, "coalesced": 3}
+    assert flight.stats()["__in_flight__"] == 0
+
+
+def test_do_propagates_leader_error_to_waiters():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    threads, results, errors = run_in_threads(3, lambda: flight.do("risk", "lm317", load))
+    wait_for_waiters(flight, "risk", 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("risk", "a", lambda: 1) == 1
+    assert flight.do("risk", "b", lambda: 2) == 2
+    assert flight.stats()["risk"] == {"executed": 2, "coalesced": 0}
+
+
+def test_stream_shares_items_with_waiters():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def produce():
+        yield {"model": "A"}
+        release.wait(5)
+        yield {"model": "B"}
+
+    stream = flight.stream("alternatives", "lm317", produce)
+    assert next(stream) == {"model": "A"}
+    threads, results, errors = run_in_threads(2, lambda: list(flight.stream("alternatives", "LM317", produce)))
+    wait_for_waiters(flight, "alternatives", 2)
+    release.set()
+    assert list(stream) == [{"model": "B"}]
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == [None, None]
+    assert results == [[{"model": "A"}, {"model": "B"}]] * 2
+
+
+def test_abandoned_stream_makes_waiter_run_again():
+    flight = SingleFlight()
+
+    def produce():
+        yield {"model": "A"}
+        yield {"model": "B"}
+
+    stream = flight.stream("alternatives", "lm317", produce)
+    next(stream)
+    threads, results, errors = run_in_threads(1, lambda: flight.do("alternatives", "lm317", lambda: ["fresh"]))
+    wait_for_waiters(flight, "alternatives", 1)
+    stream.close()
+    threads[0].join(5)
+
+    assert errors == [None]
+    assert results == [["fresh"]]
+    assert flight.stats()["alternatives"]["executed"] == 2
+    assert flight.stats()["__in_flight__"] == 0
+
+
+def test_stream_leader_error_propagates():
+    flight = SingleFlight()
+
+    def produce():
+        yield 1
+        raise ValueError("bad chunk")
+
+    with pytest.raises(ValueError):
+        list(flight.stream("alternatives", "x", produce))
+    assert flight.stats()["__in_flight__"] == 0